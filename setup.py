@@ -12,10 +12,15 @@ setup(
     packages=find_packages(where="src"),
     package_dir={'': 'src'},
     scripts=[
+        'bin/almapipo',
+        'bin/almapipo_service',
         'bin/db_create_tables',
+        'bin/db_migrate',
         'bin/delete_hol',
         'bin/input_check',
+        'bin/job_worker',
         'bin/locations_export',
+        'bin/resume_job',
         'bin/update_by_csv',
         'bin/update_record_element',
     ],
@@ -0,0 +1,73 @@
+"""Parsed Alma IDs
+
+Records are identified by a comma-separated string of record-ids, most
+specific last (e. g. 'mms_id,holding_id,item_id' for items). AlmaId splits
+such a string once, so the record-id and the ids of the parent records do
+not need to be split out again and again. The ids are interned, so e. g.
+the mms_id shared by all items of a bib is kept in memory only once.
+
+An AlmaId equals (and hashes like) the string it was parsed from, so it can
+be used wherever the string was used before.
+"""
+
+from sys import intern
+from typing import Tuple, Union
+
+
+class AlmaId:
+    """
+    Immutable, parsed almaid.
+    :param almaid: Comma-separated string of record-ids, most specific last
+    """
+    __slots__ = ("text", "ids")
+
+    def __init__(self, almaid: str):
+        object.__setattr__(self, "text", almaid)
+        object.__setattr__(
+            self, "ids", tuple(intern(record_id)
+                               for record_id in almaid.split(","))
+        )
+
+    @classmethod
+    def parse(cls, almaid: Union[str, "AlmaId"]) -> "AlmaId":
+        """
+        :param almaid: String or AlmaId
+        :return: AlmaId, the same object if almaid already is one
+        """
+        if isinstance(almaid, cls):
+            return almaid
+
+        return cls(almaid)
+
+    @property
+    def record_id(self) -> str:
+        """ID of the record itself, e. g. the item_id for items."""
+        return self.ids[-1]
+
+    @property
+    def parent_ids(self) -> Tuple[str, ...]:
+        """IDs of the records the record belongs to, e. g. mms_id and
+        holding_id for items."""
+        return self.ids[:-1]
+
+    def __setattr__(self, name, value):
+        raise AttributeError("AlmaId is immutable.")
+
+    def __delattr__(self, name):
+        raise AttributeError("AlmaId is immutable.")
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, AlmaId):
+            return self.ids == other.ids
+        if isinstance(other, str):
+            return self.text == other
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.text)
+
+    def __str__(self) -> str:
+        return self.text
+
+    def __repr__(self) -> str:
+        return f"AlmaId({self.text!r})"
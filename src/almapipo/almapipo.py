@@ -9,22 +9,35 @@ This will import the other modules and do the following:
     * If there is an error to "error"
 """
 
+from concurrent.futures import Executor
+from dataclasses import replace
+from datetime import datetime
+from functools import lru_cache, partial
 from logging import getLogger
-from typing import Callable, Iterable
-from xml.etree.ElementTree import fromstring
+from threading import Lock
+from time import monotonic, sleep
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+from xml.etree.ElementTree import fromstring, ParseError
 
 from sqlalchemy.orm import Session
 
 from . import (
+    alma_ids,
+    canary,
     config,
     db_read,
     db_write,
+    dedup,
+    exceptions,
+    pipeline,
     rest_acq,
     rest_bibs,
     rest_conf,
     rest_electronic,
     setup_rest,
+    status_writer,
     rest_users,
+    xml_extract,
 )
 
 job_timestamp = config.job_timestamp
@@ -40,7 +53,8 @@ def call_api_for_alma_set(
         record_type: str,
         method: str,
         db_session: Session,
-        manipulate_xml: Callable[[str, str], bytes] = None) -> bool:
+        manipulate_xml: Callable[[str, str], bytes] = None,
+        job_context: config.JobContext = None) -> bool:
     """
     Retrieve the almaids of all members in a set and make API calls on them.
     Will add one line to job_status_per_id for the set itself.
@@ -51,12 +65,17 @@ def call_api_for_alma_set(
     :param method: "DELETE", "GET" or "PUT" (POST not implemented yet!)
     :param db_session: SQLAlchemy session for DB connection
     :param manipulate_xml: Function with arguments almaid and data_retrieved
+    :param job_context: Job and institution to make the calls for, defaults
+        to config.default_context
     :return: Success of set retrieval
     """
+    if job_context is None:
+        job_context = config.default_context
+
     primary_key = db_write.add_almaid_to_job_status_per_id(
-        set_id, 'GET', job_timestamp, db_session
+        set_id, 'GET', job_context.job_timestamp, db_session
     )
-    almaid_list = rest_conf.retrieve_set_member_almaids(set_id)
+    almaid_list = rest_conf.retrieve_set_member_almaids(set_id, job_context)
 
     if type(almaid_list) is None:
         db_write.update_job_status(
@@ -67,7 +86,8 @@ def call_api_for_alma_set(
         return False
 
     call_api_for_list(
-        almaid_list, api, record_type, method, db_session, manipulate_xml
+        almaid_list, api, record_type, method, db_session, manipulate_xml,
+        job_context=job_context
     )
 
     db_write.update_job_status(
@@ -78,58 +98,539 @@ def call_api_for_alma_set(
 
 
 def call_api_for_list(
-        almaids: Iterable[str],
+        almaids: Iterable[Union[str, Tuple[str, bytes]]],
         api: str,
         record_type: str,
         method: str,
         db_session: Session,
-        manipulate_xml: Callable[[str, str], bytes] = None) -> None:
+        manipulate_xml: Callable[[str, str], bytes] = None,
+        stage_workers: Dict[str, int] = None,
+        queue_size: int = 100,
+        transform_processes: int = None,
+        transform_batch_size: int = 20,
+        job_context: config.JobContext = None,
+        canary_settings: canary.CanarySettings = None,
+        skip_done_since: datetime = None,
+        primary_keys_by_almaid: Dict[str, Dict[str, int]] = None,
+        record_handled: Callable[[str], None] = None) -> Dict[str, int]:
     """
     Call api for each record in the list, stores information in the db.
     See call_api_for_record doc string for details.
     Then outputs the according success rate (number of actions failed,
     succeeded or not handled at all).
-    :param almaids: Iterable of almaids, e. g. a list or generator
+
+    For POST the list holds tuples of the almaid (of the parent record) and
+    the data to send, e. g. ("991234", b"<holding>...</holding>").
+
+    The rows in job_status_per_id are added for STATUS_BATCH_SIZE almaids
+    at once, for GET and for method. Rows that already exist (e. g. of a job
+    to be continued) can be given in primary_keys_by_almaid, e. g.
+    {"991234": {"DELETE": 123}}. If GET fails for an almaid, its row for
+    method is set to "error".
+
+    If stage_workers is provided, the records are handled in a pipeline
+    instead of one after the other: fetch (GET), register (adding the rows
+    to job_status_per_id and the records fetched to fetched_records),
+    transform (manipulate_xml), send (PUT or DELETE) and persist (writing
+    the results to the DB) run at the same time, each with its own number
+    of threads, e. g. {"fetch": 8, "transform": 2, "send": 8}. Registering
+    and persisting are always done by one thread each, as they use
+    db_session. Stages not mentioned get one thread.
+
+    With transform_processes, manipulate_xml runs in a pool of processes
+    instead of threads, so XML manipulation can make use of more than one
+    CPU core. This implies pipelined calls. The pool is only started for
+    PUT, other methods do not call manipulate_xml. The transform stage hands
+    batches of up to transform_batch_size records to the pool. In this case
+    manipulate_xml has to be picklable (defined on module level or a
+    functools.partial of such a function).
+
+    With canary_settings the job is run in stages: a random sample first,
+    then stages of growing size. After each stage the error rate (and for
+    PUT the rate of responses matching the data sent) is checked and the
+    job is aborted with exceptions.CanaryException if it crosses the
+    threshold. See module canary for details.
+
+    With skip_done_since almaids repeated in the list are only handled once
+    and almaids with status "done" for the same method in any job since
+    then are not handled at all. See module dedup for details. This does
+    not apply to POST, as each POST creates a new record.
+    :param almaids: Iterable of almaids, e. g. a list or generator, for POST
+        of tuples of almaid and data to send
     :param api: First path-argument after "almaws/v1" (e. g. "bibs")
     :param record_type: Type of record to call the API for (e. g. "holdings")
-    :param method: "DELETE", "GET" or "PUT" (POST not implemented yet!)
+    :param method: "DELETE", "GET", "POST" or "PUT"
     :param db_session: SQLAlchemy session for DB connection
     :param manipulate_xml: Function with arguments almaid and data_retrieved
-    :return: None
+    :param stage_workers: Number of threads per stage for pipelined calls
+    :param queue_size: Maximum number of records waiting for each stage
+    :param transform_processes: Number of processes for manipulate_xml
+    :param transform_batch_size: Records per batch sent to the processes
+    :param job_context: Job and institution to make the calls for, defaults
+        to config.default_context
+    :param canary_settings: Run in stages and abort on too many errors
+    :param skip_done_since: Skip almaids done since then
+    :param primary_keys_by_almaid: Rows in job_status_per_id to use instead
+        of adding new ones, by almaid and action
+    :param record_handled: Function with argument almaid, called once all
+        calls for the almaid were made (successful or not), e. g. to show
+        the progress of the job
+    :return: Number of records per status for method, see
+        db_read.log_success_rate
+    """
+
+    if job_context is None:
+        job_context = config.default_context
+
+    if skip_done_since and method != "POST":
+        almaids = dedup.skip_done_almaids(
+            almaids, method, skip_done_since, db_session
+        )
+
+    record_count = 0
+    started = monotonic()
+
+    def count_almaids(input_almaids: Iterable) -> Iterable:
+        nonlocal record_count
+        for input_almaid in input_almaids:
+            record_count += 1
+            yield input_almaid
+
+    almaids = count_almaids(almaids)
+
+    if canary_settings:
+        stages = canary.split_into_stages(list(almaids), canary_settings)
+    else:
+        stages = [almaids]
+
+    process_pool = None
+
+    if transform_processes and stage_workers is None:
+        stage_workers = {}
+
+    # only PUT calls manipulate_xml
+    if transform_processes and method == "PUT":
+        process_pool = pipeline.create_process_pool(transform_processes)
+
+    try:
+        for stage_almaids in stages:
+            _call_api_for_stage(
+                stage_almaids, api, record_type, method, db_session,
+                manipulate_xml, stage_workers, queue_size, job_context,
+                process_pool, transform_processes, transform_batch_size,
+                primary_keys_by_almaid, record_handled
+            )
+            if canary_settings:
+                canary.check_stage(
+                    [_almaid_of(item, method) for item in stage_almaids],
+                    method, job_context.job_timestamp, db_session,
+                    canary_settings
+                )
+    finally:
+        if process_pool:
+            process_pool.shutdown()
+
+    if stage_workers:
+        workers = max(stage_workers.get(stage, 1) for stage in ["fetch", "send"])
+    else:
+        workers = 1
+
+    db_write.add_job_metrics(
+        method, record_count, workers, monotonic() - started,
+        job_context.job_timestamp, db_session
+    )
+
+    return db_read.log_success_rate(
+        method, job_context.job_timestamp, db_session
+    )
+
+
+def _almaid_of(item: Union[str, Tuple[str, bytes]], method: str) -> str:
     """
+    Items of call_api_for_list are almaids, for POST tuples of almaid and
+    data to send.
+    """
+
+    return item[0] if method == "POST" else item
+
+
+# Number of almaids whose rows in job_status_per_id are added at once
+STATUS_BATCH_SIZE = 100
+
+
+def _call_api_for_stage(
+        almaids: Iterable,
+        api: str,
+        record_type: str,
+        method: str,
+        db_session: Session,
+        manipulate_xml: Callable[[str, str], bytes],
+        stage_workers: Dict[str, int],
+        queue_size: int,
+        job_context: config.JobContext,
+        process_pool: Executor,
+        processes: int,
+        transform_batch_size: int,
+        primary_keys_by_almaid: Dict[str, Dict[str, int]],
+        record_handled: Callable[[str], None]) -> None:
+    """
+    Make the calls for all almaids of a job or of one stage of a job, see
+    call_api_for_list.
+    """
+
+    if process_pool:
+        _call_api_for_list_pipelined(
+            almaids, api, record_type, method, db_session, manipulate_xml,
+            stage_workers or {}, queue_size, job_context, process_pool,
+            processes, transform_batch_size, primary_keys_by_almaid,
+            record_handled
+        )
+    elif stage_workers is not None:
+        _call_api_for_list_pipelined(
+            almaids, api, record_type, method, db_session, manipulate_xml,
+            stage_workers, queue_size, job_context,
+            primary_keys_by_almaid=primary_keys_by_almaid,
+            record_handled=record_handled
+        )
+    else:
+        with status_writer.StatusWriter(db_session) as statuses:
+            for batch in _batched(almaids, STATUS_BATCH_SIZE):
+                batch_almaids = [_almaid_of(item, method) for item in batch]
+                primary_keys_of_batch = _register_almaids(
+                    batch_almaids, method, job_context.job_timestamp,
+                    db_session, primary_keys_by_almaid
+                )
+                for item, almaid, primary_keys in zip(
+                        batch, batch_almaids, primary_keys_of_batch):
+                    call_api_for_record(
+                        almaid, api, record_type, method, db_session,
+                        manipulate_xml,
+                        record_post_data=item[1] if method == "POST" else None,
+                        job_context=job_context, primary_keys=primary_keys,
+                        status_writer=statuses
+                    )
+                    if record_handled:
+                        record_handled(str(almaid))
+
+
+def _batched(items: Iterable, batch_size: int) -> Iterable[list]:
+    batch = []
+
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def _register_almaids(
+        almaids: List[str],
+        method: str,
+        job_timestamp: datetime,
+        db_session: Session,
+        primary_keys_by_almaid: Dict[str, Dict[str, int]] = None
+) -> List[Dict[str, int]]:
+    """
+    Add the rows of all calls to be made for the almaids to job_status_per_id
+    at once, GET and method for all methods but POST. Rows given in
+    primary_keys_by_almaid are used instead of adding new ones.
+    :return: primary_keys for call_api_for_record, one per almaid
+    """
+
+    actions = [method] if method in ["GET", "POST"] else ["GET", method]
+
+    if primary_keys_by_almaid is None:
+        primary_keys_by_almaid = {}
+
+    primary_keys = [dict(primary_keys_by_almaid.get(str(almaid), {}))
+                    for almaid in almaids]
+    added_keys = {}
+
+    for action in actions:
+        missing_almaids = [str(almaid) for almaid, keys
+                           in zip(almaids, primary_keys) if action not in keys]
+        if not missing_almaids:
+            continue
+
+        # almaids repeated within the batch get one row each
+        for almaid, _, primary_key in db_write.add_almaids_to_job_status_per_id(
+                missing_almaids, action, job_timestamp, db_session):
+            added_keys.setdefault((almaid, action), []).append(primary_key)
+
+    for almaid, keys in zip(almaids, primary_keys):
+        for action in actions:
+            if action not in keys:
+                keys[action] = added_keys[(str(almaid), action)].pop()
+
+    return primary_keys
+
+
+def resume_job(
+        resumed_timestamp: datetime,
+        api: str,
+        record_type: str,
+        method: str,
+        db_session: Session,
+        manipulate_xml: Callable[[str, str], bytes] = None,
+        retry_errors: bool = False,
+        wait_for_threshold: bool = False,
+        poll_seconds: int = 900,
+        job_context: config.JobContext = None) -> bool:
+    """
+    Continue a job that was interrupted, e. g. because the daily API
+    threshold was exceeded or the process died. The almaids are taken from
+    the first column of the job's lines in source_csv, so only jobs with a
+    csv file as input can be resumed. All calls are added to the original
+    job (resumed_timestamp):
+    * almaids with status "done" or "skip" for the method are skipped
+    * rows with status "new" are reused
+    * rows with status "error" are reused only if retry_errors is set
+    * almaids without a row for the method get a new one
+    With wait_for_threshold the job does not stop if the daily threshold
+    is exceeded. Instead it checks every poll_seconds whether calls are
+    possible again and then continues on its own.
+    :param resumed_timestamp: job_timestamp of the job to resume
+    :param api: First path-argument after "almaws/v1" (e. g. "bibs")
+    :param record_type: Type of record to call the API for (e. g. "holdings")
+    :param method: "DELETE", "GET" or "PUT" as used by the original job
+    :param db_session: SQLAlchemy session for DB connection
+    :param manipulate_xml: Function with arguments almaid and data_retrieved
+    :param retry_errors: Also make the calls for rows with status "error"
+    :param wait_for_threshold: Wait for the daily threshold to be reset
+    :param poll_seconds: Seconds between two checks of the threshold
+    :param job_context: Institution to make the calls for, defaults to
+        config.default_context. Its job_timestamp is replaced by
+        resumed_timestamp.
+    :return: True if all remaining almaids were handled
+    """
+
+    if job_context is None:
+        job_context = config.default_context
+
+    job_context = job_context.for_job(resumed_timestamp)
+
+    logger.info(f"Resuming job {resumed_timestamp} for {method}.")
+
+    source_csv_rows = db_read.get_source_csv_rows(
+        resumed_timestamp, db_session
+    )
+    almaids = list(dict.fromkeys(almaid for almaid, _ in source_csv_rows))
+
+    if not almaids:
+        logger.error(f"No lines in source_csv for job {resumed_timestamp}. "
+                     f"Only jobs with a csv file as input can be resumed.")
+        return False
+
+    while True:
+        try:
+            _resume_remaining_almaids(
+                almaids, api, record_type, method, db_session,
+                manipulate_xml, retry_errors, job_context
+            )
+        except exceptions.ThresholdException:
+            if not wait_for_threshold:
+                logger.error(f"Daily threshold exceeded. Resume job "
+                             f"{resumed_timestamp} again when it is reset.")
+                return False
+            _wait_for_threshold_reset(poll_seconds, job_context)
+        else:
+            break
+
+    if method != "GET":
+        db_read.log_success_rate("GET", resumed_timestamp, db_session)
+
+    return True
+
+
+def _resume_remaining_almaids(
+        almaids: List[str],
+        api: str,
+        record_type: str,
+        method: str,
+        db_session: Session,
+        manipulate_xml: Callable[[str, str], bytes],
+        retry_errors: bool,
+        job_context: config.JobContext) -> None:
+    """
+    Make the calls for all almaids of the job not done yet, see resume_job.
+    """
+
+    primary_keys_by_status = {}
+
+    for almaid, status, primary_key in db_read.get_job_status_rows(
+            method, job_context.job_timestamp, db_session):
+        primary_keys_by_status.setdefault(almaid, {})[status] = primary_key
+
+    remaining_almaids = []
+    primary_keys_by_almaid = {}
 
     for almaid in almaids:
-        call_api_for_record(
-            almaid, api, record_type, method, db_session, manipulate_xml
+        statuses = primary_keys_by_status.get(almaid, {})
+
+        if "done" in statuses or "skip" in statuses:
+            continue
+        elif "new" in statuses:
+            primary_keys_by_almaid[almaid] = {method: statuses["new"]}
+        elif "error" in statuses and retry_errors:
+            primary_keys_by_almaid[almaid] = {method: statuses["error"]}
+        elif "error" in statuses:
+            continue
+
+        remaining_almaids.append(almaid)
+
+    logger.info(f"{len(remaining_almaids)} almaid(s) remaining for "
+                f"{method}.")
+
+    call_api_for_list(
+        remaining_almaids, api, record_type, method, db_session,
+        manipulate_xml, job_context=job_context,
+        primary_keys_by_almaid=primary_keys_by_almaid
+    )
+
+
+def _wait_for_threshold_reset(
+        poll_seconds: int,
+        job_context: config.JobContext) -> None:
+
+    while True:
+        logger.warning(f"Daily threshold exceeded. Checking again in "
+                       f"{poll_seconds} seconds.")
+        sleep(poll_seconds)
+
+        calls_remaining = setup_rest.test_calls_remaining_today(job_context)
+
+        if calls_remaining and int(calls_remaining) > 0:
+            logger.info("Daily threshold was reset. Continuing.")
+            return
+
+
+def retry_transient_errors(
+        retried_timestamp: datetime,
+        api: str,
+        record_type: str,
+        method: str,
+        db_session: Session,
+        manipulate_xml: Callable[[str, str], bytes] = None,
+        batch_size: int = 100,
+        job_context: config.JobContext = None) -> int:
+    """
+    Make the calls of a job again for all almaids whose last error was
+    transient (see setup_rest.parse_api_error and table api_errors), e. g.
+    server errors or exceeded thresholds. If the GET failed, the row of the
+    method failed along with it is retried as well. Almaids with other
+    errors (e. g. a record that does not exist) are left alone. In batches of batch_size the
+    rows are set back to "new" and the calls are made, all within the
+    original job. If the process stops, the rows set to "new" can be
+    handled with resume_job.
+    :param retried_timestamp: job_timestamp of the job with the errors
+    :param api: First path-argument after "almaws/v1" (e. g. "bibs")
+    :param record_type: Type of record to call the API for (e. g. "holdings")
+    :param method: "DELETE", "GET" or "PUT" as used by the original job
+    :param db_session: SQLAlchemy session for DB connection
+    :param manipulate_xml: Function with arguments almaid and data_retrieved
+    :param batch_size: Number of almaids set back to "new" at once
+    :param job_context: Institution to make the calls for, defaults to
+        config.default_context. Its job_timestamp is replaced by
+        retried_timestamp.
+    :return: Number of almaids retried
+    """
+
+    if job_context is None:
+        job_context = config.default_context
+
+    job_context = job_context.for_job(retried_timestamp)
+    primary_keys_by_almaid = {}
+
+    for almaid, action, primary_key in db_read.get_transient_error_rows(
+            retried_timestamp, db_session):
+        if action in ("GET", method):
+            primary_keys_by_almaid.setdefault(almaid, {})[action] = \
+                primary_key
+
+    if method != "GET":
+        # If GET failed, the row of the method was set to "error" without
+        # an error of its own, so it has to be retried along with the GET
+        for almaid, job_status, primary_key in db_read.get_job_status_rows(
+                method, retried_timestamp, db_session):
+            if job_status == "error" and almaid in primary_keys_by_almaid:
+                primary_keys_by_almaid[almaid].setdefault(method, primary_key)
+
+    almaids = list(primary_keys_by_almaid)
+
+    logger.info(f"Retrying {len(almaids)} almaid(s) with transient errors "
+                f"of job {retried_timestamp}.")
+
+    for start in range(0, len(almaids), batch_size):
+        batch = almaids[start:start + batch_size]
+
+        db_write.set_job_status_for_rows(
+            "new",
+            [primary_key for almaid in batch
+             for primary_key in primary_keys_by_almaid[almaid].values()],
+            db_session
         )
 
-    db_read.log_success_rate(method, job_timestamp, db_session)
+        for almaid in batch:
+            call_api_for_record(
+                almaid, api, record_type, method, db_session, manipulate_xml,
+                job_context=job_context,
+                primary_keys=primary_keys_by_almaid[almaid]
+            )
+
+    db_read.log_success_rate("GET", retried_timestamp, db_session)
+    if method != "GET":
+        db_read.log_success_rate(method, retried_timestamp, db_session)
+
+    return len(almaids)
 
 
 def call_api_for_record(
-        almaid: str,
+        almaid: Union[str, alma_ids.AlmaId],
         api: str,
         record_type: str,
         method: str,
         db_session: Session,
         manipulate_xml: Callable[[str, str], bytes] = None,
-        record_post_data: bytes = None) -> str:
+        record_post_data: bytes = None,
+        transform_executor: Executor = None,
+        job_context: config.JobContext = None,
+        primary_keys: Dict[str, int] = None,
+        record_done: Callable[[str, str], None] = None,
+        status_writer: status_writer.StatusWriter = None) -> str:
     """
     For one almaid this function does the following:
     * Add almaid to job_status_per_id
     * Call GET for the almaid and store it in fetched_records
     * For method PUT: Manipulate the retrieved record with function
-        manipulate_xml and save in sent_records
+        manipulate_xml and save in sent_records. If the manipulated record
+        does not differ from the retrieved one, no PUT is sent and the
+        status is set to "skip".
     * For methods PUT or POST: Save the response to put_post_responses
     * Set status of all API calls in job_status_per_id
     * NOTE: method 'POST' is not implemented yet!
-    :param almaid: Comma-separated string of record-ids, most specific last
+    :param almaid: Comma-separated string of record-ids, most specific last,
+        or alma_ids.AlmaId
     :param api: First path-argument after "almaws/v1" (e. g. "bibs")
     :param record_type: Type of record to call the API for (e. g. "holdings")
     :param method: "DELETE", "GET", "POST" or "PUT"
     :param db_session: SQLAlchemy session for DB connection
     :param manipulate_xml: Function with arguments almaid and data_retrieved
     :param record_post_data: Data to be sent via POST calls
+    :param transform_executor: Run manipulate_xml here, e. g. in a
+        ProcessPoolExecutor shared by all threads of a job
+    :param job_context: Job and institution to make the calls for, defaults
+        to config.default_context
+    :param primary_keys: Rows in job_status_per_id to use instead of adding
+        new ones, by action (e. g. {"PUT": 123}). If GET fails, the row given
+        for method is set to "error".
+    :param record_done: Function with arguments almaid and the record
+        retrieved via GET (for POST the ID of the new record), called only if
+        all calls for the almaid succeeded (or the PUT was skipped)
+    :param status_writer: Buffer the changes of job_status here instead of
+        writing each right away
     :return: Only for POST the ID of the newly generated record
     """
 
@@ -137,46 +638,89 @@ def call_api_for_record(
         logger.error(f"Provided method {method} not known.")
         raise ValueError
 
-    current_api = instantiate_api_class(almaid, api, record_type)
+    if job_context is None:
+        job_context = config.default_context
+
+    job_timestamp = job_context.job_timestamp
+    parsed_almaid = alma_ids.AlmaId.parse(almaid)
+    almaid = parsed_almaid.text
+    current_api = instantiate_api_class(
+        parsed_almaid, api, record_type, job_context
+    )
 
     if method != "POST":
-        primary_key_get = db_write.add_almaid_to_job_status_per_id(
-            almaid, "GET", job_timestamp, db_session
+        primary_key_get = _get_primary_key(
+            almaid, "GET", job_timestamp, db_session, primary_keys
         )
-        record_id = str.split(almaid, ",")[-1]
+        record_id = parsed_almaid.record_id
         record_get_data = current_api.retrieve(record_id)
 
         if not record_get_data:
             logger.error(f"Could not fetch record {almaid}.")
-            db_write.update_job_status(
-                "error", primary_key_get, db_session
+            _set_error_status(
+                primary_key_get, job_timestamp, db_session,
+                setup_rest.pop_last_error(), status_writer
             )
+            if method != "GET" and primary_keys and method in primary_keys:
+                _update_job_status(
+                    "error", primary_keys[method], db_session, status_writer
+                )
             return
         else:
             db_write.add_response_content_to_fetched_records(
-                almaid, record_get_data, job_timestamp, db_session
+                almaid, record_get_data, job_timestamp, db_session,
+                job_context.store_record_blobs
             )
-            db_write.update_job_status(
-                "done", primary_key_get, db_session
+            _update_job_status(
+                "done", primary_key_get, db_session, status_writer
             )
 
         if method == "GET":
+            if record_done:
+                record_done(almaid, record_get_data)
             return
 
-        primary_key_other = db_write.add_almaid_to_job_status_per_id(
-            almaid, method, job_timestamp, db_session
+        primary_key_other = _get_primary_key(
+            almaid, method, job_timestamp, db_session, primary_keys
         )
 
         if method == "DELETE":
-            __delete_record(almaid, record_id, primary_key_other, current_api, db_session)
-        elif method == "PUT":
-            __put_record(almaid, record_id, primary_key_other, current_api, db_session, record_get_data, manipulate_xml)
+            success = __delete_record(almaid, record_id, primary_key_other, current_api, db_session, job_timestamp, status_writer)
+        else:
+            success = __put_record(almaid, record_id, primary_key_other, current_api, db_session, record_get_data, manipulate_xml, transform_executor, job_timestamp, status_writer, job_context.store_record_blobs)
+
+        if success and record_done:
+            record_done(almaid, record_get_data)
             
     elif method == "POST":
-        primary_key_post = db_write.add_almaid_to_job_status_per_id(
-            almaid, method, job_timestamp, db_session
+        primary_key_post = _get_primary_key(
+            almaid, method, job_timestamp, db_session, primary_keys
         )
-        return __post_record(almaid, primary_key_post, current_api, db_session, record_post_data)
+        recordid = __post_record(almaid, primary_key_post, current_api, db_session, record_post_data, job_timestamp, status_writer, job_context.store_record_blobs)
+
+        if recordid and record_done:
+            record_done(almaid, recordid)
+
+        return recordid
+
+
+def _get_primary_key(
+        almaid: str,
+        method: str,
+        job_timestamp: datetime,
+        db_session: Session,
+        primary_keys: Dict[str, int] = None) -> int:
+    """
+    Use the row given in primary_keys for the method or add a new row to
+    job_status_per_id.
+    """
+
+    if primary_keys and method in primary_keys:
+        return primary_keys[method]
+
+    return db_write.add_almaid_to_job_status_per_id(
+        almaid, method, job_timestamp, db_session
+    )
 
 
 def __delete_record(
@@ -184,19 +728,22 @@ def __delete_record(
         record_id: str,
         primary_key: int,
         current_api: setup_rest.GenericApi,
-        db_session) -> None:
+        db_session,
+        job_timestamp: datetime = None,
+        status_writer: status_writer.StatusWriter = None) -> bool:
 
     alma_response = current_api.delete(record_id)
 
     if alma_response is None:
-        db_write.update_job_status(
-            "error", primary_key, db_session
+        _set_error_status(
+            primary_key, job_timestamp, db_session,
+            setup_rest.pop_last_error(), status_writer
         )
         logger.error(f"Deletion did not succeed for {almaid}.")
-    else:
-        db_write.update_job_status(
-            "done", primary_key, db_session
-        )
+        return False
+
+    _update_job_status("done", primary_key, db_session, status_writer)
+    return True
 
 
 def __put_record(
@@ -206,15 +753,28 @@ def __put_record(
         current_api: setup_rest.GenericApi,
         db_session,
         record_data: str,
-        manipulate_xml: Callable[[str, str], bytes] = None) -> None:
+        manipulate_xml: Callable[[str, str], bytes] = None,
+        transform_executor: Executor = None,
+        job_timestamp: datetime = None,
+        status_writer: status_writer.StatusWriter = None,
+        store_record_blobs: bool = False) -> bool:
 
-    new_record_data = manipulate_xml(almaid, record_data)
+    if transform_executor:
+        new_record_data = transform_executor.submit(
+            manipulate_xml, almaid, record_data
+        ).result()
+    else:
+        new_record_data = manipulate_xml(almaid, record_data)
 
     if not new_record_data:
         logger.error(f"Could not manipulate data of record {almaid}.")
-        db_write.update_job_status(
-            "error", primary_key, db_session
-        )
+        _update_job_status("error", primary_key, db_session, status_writer)
+        return False
+    elif is_record_unchanged(record_data, new_record_data):
+        logger.info(f"Manipulation did not change record {almaid}. "
+                    f"Skipping PUT.")
+        _update_job_status("skip", primary_key, db_session, status_writer)
+        return True
     else:
         response = current_api.update(record_id, new_record_data)
 
@@ -223,20 +783,23 @@ def __put_record(
                         f" Adding to put_post_responses.")
 
             db_write.add_put_post_response(
-                almaid, response, job_timestamp, db_session
+                almaid, response, job_timestamp, db_session,
+                store_record_blobs
             )
             db_write.add_sent_record(
-                almaid, new_record_data, job_timestamp, db_session
-            )
-            db_write.update_job_status(
-                "done", primary_key, db_session
+                almaid, new_record_data, job_timestamp, db_session,
+                store_record_blobs
             )
+            _update_job_status("done", primary_key, db_session, status_writer)
+            return True
 
         else:
             logger.error(f"Did not receive a response for {almaid}?")
-            db_write.update_job_status(
-                "error", primary_key, db_session
+            _set_error_status(
+                primary_key, job_timestamp, db_session,
+                setup_rest.pop_last_error(), status_writer
             )
+            return False
 
 
 def __post_record(
@@ -244,7 +807,10 @@ def __post_record(
         primary_key: int,
         current_api: setup_rest.GenericApi,
         db_session,
-        record_data: bytes) -> str:
+        record_data: bytes,
+        job_timestamp: datetime = None,
+        status_writer: status_writer.StatusWriter = None,
+        store_record_blobs: bool = False) -> str:
 
     response = current_api.create(record_data)
 
@@ -268,89 +834,563 @@ def __post_record(
                     f" Adding to put_post_responses.")
 
         db_write.add_put_post_response(
-            almaid, response, job_timestamp, db_session
+            almaid, response, job_timestamp, db_session, store_record_blobs
         )
         db_write.add_sent_record(
-            almaid, record_data, job_timestamp, db_session
-        )
-        db_write.update_job_status(
-            "done", primary_key, db_session
+            almaid, record_data, job_timestamp, db_session, store_record_blobs
         )
+        _update_job_status("done", primary_key, db_session, status_writer)
         return recordid
 
     else:
         logger.error(f"Did not receive a response for {almaid}. Marking as "
                      f"erroneous.")
-        db_write.update_job_status(
-            "error", primary_key, db_session
+        _set_error_status(
+            primary_key, job_timestamp, db_session,
+            setup_rest.pop_last_error(), status_writer
+        )
+
+
+def _set_error_status(
+        primary_key: int,
+        job_timestamp: datetime,
+        db_session: Session,
+        api_error: setup_rest.ApiError = None,
+        status_writer: status_writer.StatusWriter = None) -> None:
+    """
+    Set status "error" and save the error of the failed call (if any) to
+    api_errors.
+    """
+
+    _update_job_status("error", primary_key, db_session, status_writer)
+    _add_api_error(primary_key, job_timestamp, db_session, api_error)
+
+
+def _add_api_error(
+        primary_key: int,
+        job_timestamp: datetime,
+        db_session: Session,
+        api_error: setup_rest.ApiError = None) -> None:
+    """
+    Save the error of a failed call (if any) to api_errors.
+    """
+
+    if api_error:
+        db_write.add_api_error(
+            primary_key, job_timestamp, api_error.http_status,
+            api_error.error_code, api_error.error_message,
+            api_error.transient, db_session
+        )
+
+
+def _update_job_status(
+        status: str,
+        primary_key: int,
+        db_session: Session,
+        status_writer: status_writer.StatusWriter = None) -> None:
+    """
+    Set the status via status_writer if given, right away otherwise.
+    """
+
+    if status_writer:
+        status_writer.update_job_status(status, primary_key)
+    else:
+        db_write.update_job_status(status, primary_key, db_session)
+
+
+class _RecordJob:
+    """
+    State of one almaid while it is handed through the stages of
+    _call_api_for_list_pipelined.
+    """
+
+    def __init__(
+            self,
+            almaid: Union[str, alma_ids.AlmaId],
+            record_post_data: bytes = None):
+        self.parsed_almaid = alma_ids.AlmaId.parse(almaid)
+        self.almaid = self.parsed_almaid.text
+        self.record_id = self.parsed_almaid.record_id
+        self.current_api = None
+        self.record_get_data = None
+        self.new_record_data = record_post_data
+        self.response = None
+        self.get_status = None
+        self.status = None
+        self.get_error = None
+        self.error = None
+        self.primary_keys = None
+
+
+def _call_api_for_list_pipelined(
+        almaids: Iterable,
+        api: str,
+        record_type: str,
+        method: str,
+        db_session: Session,
+        manipulate_xml: Callable[[str, str], bytes],
+        stage_workers: Dict[str, int],
+        queue_size: int,
+        job_context: config.JobContext,
+        process_pool: Executor = None,
+        processes: int = None,
+        transform_batch_size: int = 1,
+        primary_keys_by_almaid: Dict[str, Dict[str, int]] = None,
+        record_handled: Callable[[str], None] = None) -> None:
+    """
+    Pipelined version of call_api_for_list, see its doc string for details.
+    The register stage adds the rows to job_status_per_id and saves the
+    records fetched to fetched_records before they are handed on. So each
+    record changed or deleted has its backup and rows, even if the process
+    dies or a later stage fails. Only the status of the POST, PUT or DELETE
+    and the responses are written after the call.
+
+    The register and persist stages and the input (e. g. a generator reading
+    from the database) share db_session, one at a time.
+    """
+
+    if method not in ["DELETE", "GET", "POST", "PUT"]:
+        logger.error(f"Provided method {method} not known.")
+        raise ValueError
+
+    def create_stage(name: str, function: Callable) -> pipeline.Stage:
+        return pipeline.Stage(
+            name, function, stage_workers.get(name, 1), queue_size
+        )
+
+    db_lock = Lock()
+
+    stages = [
+        create_stage(
+            "fetch",
+            partial(_fetch_stage, method, api, record_type, job_context)
+        ),
+        pipeline.Stage(
+            "register",
+            partial(
+                _register_stage, method, db_session, db_lock,
+                job_context.job_timestamp, job_context.store_record_blobs,
+                primary_keys_by_almaid
+            ),
+            1,
+            queue_size,
+            STATUS_BATCH_SIZE
+        ),
+    ]
+
+    if method == "PUT" and process_pool:
+        stages.append(
+            pipeline.Stage(
+                "transform",
+                partial(
+                    _transform_stage_in_processes,
+                    manipulate_xml, process_pool, processes
+                ),
+                stage_workers.get("transform", 1),
+                queue_size,
+                transform_batch_size
+            )
+        )
+    elif method == "PUT":
+        stages.append(
+            create_stage("transform", partial(_transform_stage, manipulate_xml))
+        )
+
+    statuses = status_writer.StatusWriter(db_session)
+
+    if method != "GET":
+        stages.append(create_stage("send", partial(_send_stage, method)))
+
+    stages.append(
+        pipeline.Stage(
+            "persist",
+            partial(
+                _persist_stage, method, db_session, db_lock,
+                job_context.job_timestamp, job_context.store_record_blobs,
+                statuses, record_handled
+            ),
+            1,
+            queue_size
+        )
+    )
+
+    record_pipeline = pipeline.Pipeline(stages)
+
+    if method == "POST":
+        record_jobs = (_RecordJob(almaid, record_post_data) for
+                       almaid, record_post_data in
+                       _read_locked(almaids, db_lock))
+    else:
+        record_jobs = (_RecordJob(almaid) for almaid in
+                       _read_locked(almaids, db_lock))
+
+    with statuses:
+        record_pipeline.run(record_jobs)
+
+
+# Marks the end of the items for _read_locked
+_END_OF_ITEMS = object()
+
+
+def _read_locked(items: Iterable, lock: Lock) -> Iterable:
+    """
+    Take each item from items while holding the lock.
+    """
+
+    iterator = iter(items)
+
+    while True:
+        with lock:
+            item = next(iterator, _END_OF_ITEMS)
+
+        if item is _END_OF_ITEMS:
+            return
+
+        yield item
+
+
+def _fetch_stage(
+        method: str,
+        api: str,
+        record_type: str,
+        job_context: config.JobContext,
+        job: _RecordJob) -> _RecordJob:
+
+    job.current_api = instantiate_api_class(
+        job.parsed_almaid, api, record_type, job_context
+    )
+
+    # nothing to fetch for records to be created
+    if method == "POST":
+        return job
+
+    job.record_get_data = job.current_api.retrieve(job.record_id)
+    job.get_error = setup_rest.pop_last_error()
+
+    if job.record_get_data:
+        job.get_status = "done"
+    else:
+        logger.error(f"Could not fetch record {job.almaid}.")
+        job.get_status = "error"
+
+    return job
+
+
+def _transform_stage(
+        manipulate_xml: Callable[[str, str], bytes],
+        job: _RecordJob) -> _RecordJob:
+
+    if job.get_status != "done":
+        return job
+
+    job.new_record_data = manipulate_xml(job.almaid, job.record_get_data)
+    _check_manipulation(job)
+
+    return job
+
+
+def _transform_stage_in_processes(
+        manipulate_xml: Callable[[str, str], bytes],
+        process_pool: Executor,
+        processes: int,
+        jobs: List[_RecordJob]) -> List[_RecordJob]:
+
+    fetched_jobs = [job for job in jobs if job.get_status == "done"]
+
+    new_records = pipeline.map_in_process_pool(
+        process_pool,
+        processes,
+        manipulate_xml,
+        [job.almaid for job in fetched_jobs],
+        [job.record_get_data for job in fetched_jobs]
+    )
+
+    for job, new_record_data in zip(fetched_jobs, new_records):
+        job.new_record_data = new_record_data
+        _check_manipulation(job)
+
+    return jobs
+
+
+def _check_manipulation(job: _RecordJob) -> None:
+
+    if not job.new_record_data:
+        logger.error(f"Could not manipulate data of record {job.almaid}.")
+        job.status = "error"
+    elif is_record_unchanged(job.record_get_data, job.new_record_data):
+        logger.info(f"Manipulation did not change record {job.almaid}. "
+                    f"Skipping PUT.")
+        job.status = "skip"
+
+
+def _send_stage(method: str, job: _RecordJob) -> _RecordJob:
+
+    if job.status or (method != "POST" and job.get_status != "done"):
+        return job
+
+    job.status = "error"
+
+    if method == "DELETE":
+        job.response = job.current_api.delete(job.record_id)
+        if job.response is None:
+            logger.error(f"Deletion did not succeed for {job.almaid}.")
+        else:
+            job.status = "done"
+    elif method == "PUT":
+        job.response = job.current_api.update(
+            job.record_id, job.new_record_data
         )
+        if job.response:
+            logger.info(f"Manipulation for {job.almaid} successful.")
+            job.status = "done"
+        else:
+            logger.error(f"Did not receive a response for {job.almaid}?")
+    elif method == "POST":
+        job.response = job.current_api.create(job.new_record_data)
+        if job.response:
+            logger.info(f"Creation for '{job.almaid}' successful.")
+            job.status = "done"
+        else:
+            logger.error(f"Did not receive a response for {job.almaid}. "
+                         f"Marking as erroneous.")
+
+    job.error = setup_rest.pop_last_error()
+
+    return job
+
+
+def _register_stage(
+        method: str,
+        db_session: Session,
+        db_lock: Lock,
+        job_timestamp: datetime,
+        store_record_blobs: bool,
+        primary_keys_by_almaid: Dict[str, Dict[str, int]],
+        jobs: List[_RecordJob]) -> List[_RecordJob]:
+    """
+    Add the rows for a batch of records to job_status_per_id, save the
+    records fetched and set the status of the GET calls, all before the
+    records are handed on to be changed or deleted.
+    """
+
+    with db_lock:
+        primary_keys_of_jobs = _register_almaids(
+            [job.almaid for job in jobs], method, job_timestamp, db_session,
+            primary_keys_by_almaid
+        )
+        statuses = []
+
+        for job, primary_keys in zip(jobs, primary_keys_of_jobs):
+            job.primary_keys = primary_keys
+
+            if job.get_status == "done":
+                db_write.add_response_content_to_fetched_records(
+                    job.almaid, job.record_get_data, job_timestamp,
+                    db_session, store_record_blobs
+                )
+                statuses.append((primary_keys["GET"], "done"))
+            elif job.get_status == "error":
+                statuses.extend((primary_keys[action], "error")
+                                for action in primary_keys)
+
+        # commits the records fetched together with the statuses
+        db_write.update_job_statuses(statuses, db_session)
+
+        for job in jobs:
+            if job.get_status == "error":
+                _add_api_error(
+                    job.primary_keys["GET"], job_timestamp, db_session,
+                    job.get_error
+                )
+
+    return jobs
+
+
+def _persist_stage(
+        method: str,
+        db_session: Session,
+        db_lock: Lock,
+        job_timestamp: datetime,
+        store_record_blobs: bool,
+        status_writer: status_writer.StatusWriter,
+        record_handled: Callable[[str], None],
+        job: _RecordJob) -> None:
+
+    # the statuses of GET and of failed GETs are set by the register stage
+    if method != "GET" and job.get_status != "error":
+        _persist_job(method, db_session, db_lock, job_timestamp,
+                     store_record_blobs, status_writer, job)
+
+    if record_handled:
+        record_handled(job.almaid)
+
+
+def _persist_job(
+        method: str,
+        db_session: Session,
+        db_lock: Lock,
+        job_timestamp: datetime,
+        store_record_blobs: bool,
+        status_writer: status_writer.StatusWriter,
+        job: _RecordJob) -> None:
+
+    primary_key = job.primary_keys[method]
+
+    with db_lock:
+        if method in ["POST", "PUT"] and job.status == "done":
+            db_write.add_put_post_response(
+                job.almaid, job.response, job_timestamp, db_session,
+                store_record_blobs
+            )
+            db_write.add_sent_record(
+                job.almaid, job.new_record_data, job_timestamp, db_session,
+                store_record_blobs
+            )
+
+        if job.status == "error":
+            _set_error_status(
+                primary_key, job_timestamp, db_session, job.error,
+                status_writer
+            )
+        else:
+            status_writer.update_job_status(job.status, primary_key)
+
+
+def is_record_unchanged(
+        record_data: str,
+        new_record_data: bytes) -> bool:
+    """
+    Compare the canonical forms of a record before and after manipulation.
+    :param record_data: Record as retrieved via GET
+    :param new_record_data: Record as returned by manipulate_xml
+    :return: True if both are the same, False if not or not comparable
+    """
+    try:
+        return xml_extract.canonicalize_record(record_data) \
+            == xml_extract.canonicalize_record(new_record_data)
+    except ParseError:
+        return False
+
+
+# Number of parent ids needed for the path of each kind of record
+ROUTE_PARENT_IDS = {
+    ("bibs", "holdings"): 1,
+    ("bibs", "items"): 2,
+    ("bibs", "portfolios"): 1,
+    ("electronic", "e-services"): 1,
+    ("electronic", "portfolios"): 2,
+}
 
 
 def instantiate_api_class(
-        almaid: str,
+        almaid: Union[str, alma_ids.AlmaId],
         api: str,
-        record_type: str) -> setup_rest.GenericApi:
+        record_type: str,
+        job_context: config.JobContext = None) -> setup_rest.GenericApi:
     """
-    Switch for api calls.
-    :param almaid: Comma-separated string of record-ids, most specific last
+    Switch for api calls. API objects only depend on the path, so records
+    with the same parents share one object (see get_route_api).
+    :param almaid: Comma-separated string of record-ids, most specific last,
+        or alma_ids.AlmaId
     :param api: First path-argument after "almaws/v1" (e. g. "bibs")
     :param record_type: Type of record to call the API for (e. g. "holdings")
+    :param job_context: Context to make the calls for, defaults to env vars
+    :return: Instance of an Api Object with correct path
+    """
+    route_ids = alma_ids.AlmaId.parse(almaid).ids[
+        :ROUTE_PARENT_IDS.get((api, record_type), 0)
+    ]
+
+    # API objects do not depend on the job, so all jobs share them
+    if job_context is not None:
+        job_context = replace(job_context, job_timestamp=None)
+
+    return get_route_api(api, record_type, route_ids, job_context)
+
+
+@lru_cache(maxsize=4096)
+def get_route_api(
+        api: str,
+        record_type: str,
+        route_ids: Tuple[str, ...],
+        job_context: config.JobContext = None) -> setup_rest.GenericApi:
+    """
+    Instantiate the API object for a path, cached for the most recently
+    used paths. Use get_route_api.cache_clear() to start over.
+    :param api: First path-argument after "almaws/v1" (e. g. "bibs")
+    :param record_type: Type of record to call the API for (e. g. "holdings")
+    :param route_ids: Ids of the parent records as needed for the path
+    :param job_context: Context to make the calls for, defaults to env vars,
+        without job_timestamp so the cache is not split up by job
     :return: Instance of an Api Object with correct path
     """
-    split_almaid = str.split(almaid, ",")
 
     if api == "acq":
-        return _instantiate_acq_api(record_type)
+        return _instantiate_acq_api(record_type, job_context)
 
     elif api == "bibs":
-        return _instantiate_bibs_api(split_almaid, record_type)
+        return _instantiate_bibs_api(route_ids, record_type, job_context)
 
     elif api == "electronic":
-        return _instantiate_electronic_api(split_almaid, record_type)
+        return _instantiate_electronic_api(
+            route_ids, record_type, job_context
+        )
 
     elif api == "users":
-        return _instantiate_users_api(record_type)
+        return _instantiate_users_api(record_type, job_context)
 
     logger.error("The API you are trying to call is not implemented yet"
                  " or does not exist.")
     raise NotImplementedError
 
 
-def _instantiate_acq_api(record_type: str):
+def _instantiate_acq_api(
+        record_type: str,
+        job_context: config.JobContext = None):
     if record_type == "vendors":
-        return rest_acq.VendorsApi()
+        return rest_acq.VendorsApi(job_context)
     else:
         raise NotImplementedError
 
 
-def _instantiate_bibs_api(split_almaid: list, record_type: str):
+def _instantiate_bibs_api(
+        split_almaid: Tuple[str, ...],
+        record_type: str,
+        job_context: config.JobContext = None):
     if record_type == "bibs":
-        return rest_bibs.BibsApi()
+        return rest_bibs.BibsApi(job_context)
     elif record_type == "holdings":
-        return rest_bibs.HoldingsApi(split_almaid[0])
+        return rest_bibs.HoldingsApi(split_almaid[0], job_context)
     elif record_type == "items":
-        return rest_bibs.ItemsApi(split_almaid[0], split_almaid[1])
+        return rest_bibs.ItemsApi(
+            split_almaid[0], split_almaid[1], job_context
+        )
     elif record_type == "portfolios":
-        return rest_bibs.PortfoliosApi(split_almaid[0])
+        return rest_bibs.PortfoliosApi(split_almaid[0], job_context)
     else:
         raise NotImplementedError
 
 
-def _instantiate_electronic_api(split_almaid: list, record_type: str):
+def _instantiate_electronic_api(
+        split_almaid: Tuple[str, ...],
+        record_type: str,
+        job_context: config.JobContext = None):
     if record_type == "e-collections":
-        return rest_electronic.EcollectionsApi()
+        return rest_electronic.EcollectionsApi(job_context)
     elif record_type == "e-services":
-        return rest_electronic.EservicesApi(split_almaid[0])
+        return rest_electronic.EservicesApi(split_almaid[0], job_context)
     elif record_type == "portfolios":
         return rest_electronic.PortfoliosApi(
-            split_almaid[0], split_almaid[1]
+            split_almaid[0], split_almaid[1], job_context
         )
     else:
         raise NotImplementedError
 
 
-def _instantiate_users_api(record_type: str):
+def _instantiate_users_api(
+        record_type: str,
+        job_context: config.JobContext = None):
     if record_type == "users":
-        return rest_users.UsersApi()
+        return rest_users.UsersApi(job_context)
     else:
         raise NotImplementedError
@@ -0,0 +1,148 @@
+"""Staged jobs that stop on their own if something goes wrong
+
+A wrong manipulate_xml function or xpath should be noticed after a few
+records, not after thousands of calls. In a staged job the almaids are
+handled in stages of growing size:
+* First a random sample of sample_size almaids
+* Then the remaining almaids in stages growing by growth_factor
+
+After each stage check_stage looks at the results of that stage in the
+database and raises exceptions.CanaryException if too many calls failed or,
+for PUT, too many responses differ from the data sent (as per
+db_read.get_mismatched_almaids).
+"""
+
+from datetime import datetime
+from logging import getLogger
+from random import Random
+from typing import Iterator, List, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from . import db_read, exceptions
+
+# Logfile
+logger = getLogger(__name__)
+
+
+class CanarySettings(NamedTuple):
+    """
+    Settings for staged jobs.
+    :param sample_size: Number of almaids in the first, random stage
+    :param growth_factor: Each stage is this much bigger than the one before
+    :param max_error_rate: Abort if more calls of a stage failed than this
+    :param min_match_rate: Abort if fewer responses to PUT match the data
+        sent than this, None to skip the check
+    :param random_seed: Seed for choosing the sample, e. g. for tests
+    """
+    sample_size: int = 20
+    growth_factor: float = 4
+    max_error_rate: float = 0.05
+    min_match_rate: Optional[float] = 0.9
+    random_seed: Optional[int] = None
+
+
+def split_into_stages(
+        items: List,
+        canary_settings: CanarySettings) -> Iterator[List]:
+    """
+    Split the items of a job into a random sample and stages of growing size.
+    :param items: List of all almaids (or e. g. csv lines) of the job
+    :param canary_settings: Size of the sample and growth of the stages
+    :return: Generator of lists of items, one per stage
+    """
+
+    if canary_settings.sample_size < 1 or canary_settings.growth_factor < 1:
+        logger.error("Sample size and growth factor need to be at least 1.")
+        raise ValueError
+
+    sample_size = min(canary_settings.sample_size, len(items))
+    sample_indexes = set(
+        Random(canary_settings.random_seed).sample(
+            range(len(items)), sample_size
+        )
+    )
+
+    if sample_indexes:
+        yield [items[index] for index in sorted(sample_indexes)]
+
+    remaining_items = [
+        item for index, item in enumerate(items)
+        if index not in sample_indexes
+    ]
+    stage_size = sample_size
+    start = 0
+
+    while start < len(remaining_items):
+        stage_size = max(
+            stage_size + 1, int(stage_size * canary_settings.growth_factor)
+        )
+        yield remaining_items[start:start + stage_size]
+        start += stage_size
+
+
+def check_stage(
+        stage_almaids: List[str],
+        method: str,
+        job_timestamp: datetime,
+        db_session: Session,
+        canary_settings: CanarySettings) -> None:
+    """
+    Check error rate and, for PUT, match rate of one stage of a job.
+    :param stage_almaids: Almaids handled in the stage
+    :param method: "DELETE", "GET" or "PUT"
+    :param job_timestamp: Timestamp to identify the job
+    :param db_session: SQLAlchemy session for DB connection
+    :param canary_settings: Thresholds for the checks
+    :return: None, raises exceptions.CanaryException if a check fails
+    """
+
+    stage_set = set(stage_almaids)
+    statuses = {}
+
+    for action in sorted({"GET", method}):
+        for almaid, status, _ in db_read.get_job_status_rows(
+                action, job_timestamp, db_session):
+            if almaid in stage_set:
+                statuses.setdefault(almaid, set()).add((action, status))
+
+    failed = [almaid for almaid in stage_set
+              if any(status == "error" for _, status in
+                     statuses.get(almaid, ()))]
+    error_rate = len(failed) / len(stage_set) if stage_set else 0.0
+
+    logger.info(f"Stage of {len(stage_set)} almaid(s): error rate "
+                f"{error_rate:.1%}.")
+
+    if error_rate > canary_settings.max_error_rate:
+        logger.error(f"Error rate {error_rate:.1%} exceeds "
+                     f"{canary_settings.max_error_rate:.1%}. Aborting job "
+                     f"{job_timestamp}.")
+        raise exceptions.CanaryException(
+            f"Error rate {error_rate:.1%} exceeds threshold."
+        )
+
+    if method != "PUT" or canary_settings.min_match_rate is None:
+        return
+
+    sent = [almaid for almaid in stage_set
+            if (method, "done") in statuses.get(almaid, ())]
+
+    if not sent:
+        return
+
+    mismatched = db_read.get_mismatched_almaids(
+        job_timestamp, db_session, sent
+    )
+    match_rate = 1 - len(mismatched) / len(sent)
+
+    logger.info(f"Stage of {len(stage_set)} almaid(s): {match_rate:.1%} of "
+                f"responses match the data sent.")
+
+    if match_rate < canary_settings.min_match_rate:
+        logger.error(f"Match rate {match_rate:.1%} is below "
+                     f"{canary_settings.min_match_rate:.1%}. Aborting job "
+                     f"{job_timestamp}.")
+        raise exceptions.CanaryException(
+            f"Match rate {match_rate:.1%} is below threshold."
+        )
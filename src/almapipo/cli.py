@@ -0,0 +1,887 @@
+"""One commandline interface for all kinds of jobs
+
+Used by the script almapipo, the other scripts in bin are aliases for its
+subcommands:
+* get: GET records listed in a CSV/TSV file or an Alma set
+* delete: DELETE records listed in a CSV/TSV file or an Alma set
+* update: PUT records as described in a CSV/TSV file, see module csv_update
+* post: POST the XML files listed in a CSV/TSV file
+* resume: Continue an interrupted job, see almapipo.resume_job
+* retry: Retry calls with transient errors, see
+  almapipo.retry_transient_errors
+* rollback: Send the records saved before a job changed or deleted them,
+  see module rollback
+* budget: Set the daily budget shared by jobs or reserve calls of it, see
+  module scheduler
+
+All subcommands but resume, retry and budget share the options --workers,
+--rate, --batch-size, --max-calls, --progress, --canary, --plan and
+--job-name (with --priority and --weight), get, delete and update also
+--skip-done-days. The exit code tells how the job went, see EXIT_OK,
+EXIT_RECORD_ERRORS and EXIT_ABORTED (argparse itself exits with 2 on wrong
+arguments).
+"""
+
+from argparse import ArgumentParser, Namespace
+from dataclasses import replace
+from datetime import date, datetime, timedelta
+from functools import partial
+from itertools import chain
+from logging import basicConfig, getLogger
+from pathlib import Path
+from sys import stdout
+from threading import Lock
+from time import monotonic
+from typing import (
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    TextIO,
+    Tuple,
+    Union,
+)
+
+from . import (
+    almapipo,
+    canary,
+    config,
+    csv_update,
+    db_read,
+    db_write,
+    dedup,
+    exceptions,
+    input_read,
+    planner,
+    rate_limit,
+    rest_conf,
+    rollback,
+    scheduler,
+)
+
+# Logfile
+logger = getLogger(__name__)
+
+# Exit codes
+EXIT_OK = 0
+EXIT_RECORD_ERRORS = 1
+EXIT_ABORTED = 3
+
+
+class RunSettings(NamedTuple):
+    """
+    Settings shared by all subcommands, see create_parser.
+    :param workers: Number of threads fetching and sending records, with 1
+        the records are handled one after the other
+    :param batch_size: Maximum number of records waiting for each stage of
+        the pipeline, see almapipo.call_api_for_list
+    :param max_calls: Stop before the job makes more API calls than this
+    :param show_progress: Print throughput and ETA on standard out
+    :param canary_settings: Handle the records in stages, see module canary
+    :param skip_done_days: Skip almaids repeated in the input or done by any
+        job in this many days before the job, see module dedup
+    :param plan_only: Only log the number of calls and the estimated
+        duration, see module planner
+    """
+    workers: int = 8
+    batch_size: int = 100
+    max_calls: Optional[int] = None
+    show_progress: bool = False
+    canary_settings: Optional[canary.CanarySettings] = None
+    skip_done_days: Optional[float] = None
+    plan_only: bool = False
+
+
+class ProgressLine:
+    """
+    Line on standard out with records done, records per second and the
+    estimated time left, rewritten at most once per interval. Thread-safe.
+    :param total: Number of records of the job, None if not known
+    :param stream: Where to write the line, defaults to sys.stdout
+    :param interval: Minimum number of seconds between two updates
+    """
+
+    def __init__(
+            self,
+            total: Optional[int],
+            stream: TextIO = None,
+            interval: float = 1.0):
+        self.total = total
+        self.done = 0
+        self.stream = stream or stdout
+        self.interval = interval
+        self._start = monotonic()
+        self._last_write = None
+        self._lock = Lock()
+
+    def advance(self, count: int = 1) -> None:
+        """
+        Count records as done and rewrite the line if the interval passed.
+        :param count: Number of records done
+        :return: None
+        """
+        with self._lock:
+            self.done += count
+            now = monotonic()
+            if self._last_write is None \
+                    or now - self._last_write >= self.interval:
+                self._last_write = now
+                self._write(now)
+
+    def finish(self) -> None:
+        """
+        Write the final state of the line and end it.
+        :return: None
+        """
+        with self._lock:
+            self._write(monotonic())
+            self.stream.write("\n")
+            self.stream.flush()
+
+    def format_line(self, elapsed_seconds: float) -> str:
+        """
+        :param elapsed_seconds: Seconds since the start of the job
+        :return: Text of the line, e. g. '50/200 records, 5.0/s, ETA 0:00:30'
+        """
+        rate = self.done / elapsed_seconds if elapsed_seconds > 0 else 0.0
+
+        if self.total is None:
+            return f"{self.done} records, {rate:.1f}/s"
+
+        if rate > 0:
+            seconds_left = int((self.total - self.done) / rate)
+            eta = f"{seconds_left // 3600}:{seconds_left // 60 % 60:02}:" \
+                  f"{seconds_left % 60:02}"
+        else:
+            eta = "unknown"
+
+        return f"{self.done}/{self.total} records, {rate:.1f}/s, ETA {eta}"
+
+    def _write(self, now: float) -> None:
+        self.stream.write("\r" + self.format_line(now - self._start))
+        self.stream.flush()
+
+
+def run_set_job(
+        set_id: str,
+        method: str,
+        api: str,
+        record_type: str,
+        job_context: config.JobContext,
+        run_settings: RunSettings,
+        manipulate_xml: Callable[[str, str], bytes] = None) -> int:
+    """
+    Make the calls for all members of an Alma set with run_job. With
+    plan_only the job is planned from the set's total_record_count without
+    retrieving its members. The calls retrieving the members count against
+    max_calls.
+    :param set_id: In the Alma UI go to "Set Details" and look for "Set ID"
+    :param method: "DELETE", "GET" or "PUT"
+    :param api: First path-argument after "almaws/v1" (e. g. "bibs")
+    :param record_type: Type of record to call the API for (e. g. "holdings")
+    :param job_context: Job and institution to make the calls for
+    :param run_settings: Workers, limits and output of the job
+    :param manipulate_xml: Function with arguments almaid and data_retrieved,
+        needed for PUT
+    :return: Exit code as of run_job
+    """
+
+    if run_settings.plan_only:
+        with job_context.create_db_session() as db_session:
+            try:
+                job_plan = planner.plan_job_for_alma_set(
+                    set_id, method, db_session, run_settings.workers,
+                    job_context=job_context
+                )
+            except ValueError:
+                return EXIT_ABORTED
+        return EXIT_ABORTED if job_plan.fits_threshold is False else EXIT_OK
+
+    almaids = list(rest_conf.retrieve_set_member_almaids(
+        set_id, job_context=job_context
+    ))
+
+    if run_settings.max_calls is not None:
+        # retrieving the members takes one call for the count and one per 100
+        set_calls = 1 + len(almaids) // 100 + 1
+        run_settings = run_settings._replace(
+            max_calls=max(0, run_settings.max_calls - set_calls)
+        )
+
+    return run_job(
+        almaids, method, api, record_type, job_context, run_settings,
+        manipulate_xml, total=len(almaids)
+    )
+
+
+def run_job(
+        almaids: Iterable[Union[str, Tuple[str, bytes]]],
+        method: str,
+        api: str,
+        record_type: str,
+        job_context: config.JobContext,
+        run_settings: RunSettings,
+        manipulate_xml: Callable[[str, str], bytes] = None,
+        total: int = None) -> int:
+    """
+    Make the calls for all almaids of a job with almapipo.call_api_for_list,
+    in a pipeline if there is more than one worker.
+    :param almaids: Almaids of the records, for POST tuples of almaid and
+        data to send
+    :param method: "DELETE", "GET", "POST" or "PUT"
+    :param api: First path-argument after "almaws/v1" (e. g. "bibs")
+    :param record_type: Type of record to call the API for (e. g. "holdings")
+    :param job_context: Job and institution to make the calls for
+    :param run_settings: Workers, limits and output of the job
+    :param manipulate_xml: Function with arguments almaid and data_retrieved,
+        needed for PUT
+    :param total: Number of records of the job, shown with --progress
+    :return: Exit code, see EXIT_OK, EXIT_RECORD_ERRORS and EXIT_ABORTED,
+        with plan_only EXIT_ABORTED means the job exceeds the calls
+        remaining for today
+    """
+
+    if run_settings.skip_done_days is not None and method != "POST":
+        almaids = _skip_done_almaids(
+            almaids, method, run_settings.skip_done_days, job_context
+        )
+        # the number of almaids skipped is only known once all are read
+        total = None
+
+    if run_settings.plan_only:
+        with job_context.create_db_session() as db_session:
+            job_plan = planner.plan_job_for_list(
+                almaids, method, db_session, run_settings.workers,
+                job_context=job_context
+            )
+        return EXIT_ABORTED if job_plan.fits_threshold is False else EXIT_OK
+
+    limit_reached = False
+
+    def limit_calls(items: Iterable) -> Iterable:
+        nonlocal limit_reached
+        max_records = run_settings.max_calls \
+            // planner.CALLS_PER_RECORD[method]
+
+        for number, item in enumerate(items):
+            if number >= max_records:
+                logger.error(f"Reached the maximum of "
+                             f"{run_settings.max_calls} calls.")
+                limit_reached = True
+                return
+            yield item
+
+    if run_settings.max_calls is not None:
+        almaids = limit_calls(almaids)
+
+    progress = None
+    record_handled = None
+
+    if run_settings.show_progress:
+        progress = ProgressLine(total)
+
+        def record_handled(almaid: str) -> None:
+            progress.advance()
+
+    stage_workers = None
+
+    if run_settings.workers > 1:
+        stage_workers = {"fetch": run_settings.workers,
+                         "send": run_settings.workers}
+
+    aborted = False
+
+    with job_context.create_db_session() as db_session:
+        try:
+            status_counts = almapipo.call_api_for_list(
+                almaids, api, record_type, method, db_session,
+                manipulate_xml, stage_workers,
+                queue_size=run_settings.batch_size,
+                job_context=job_context,
+                canary_settings=run_settings.canary_settings,
+                record_handled=record_handled
+            )
+        except (exceptions.ApiException, exceptions.CanaryException) as error:
+            logger.error(f"Stopping job {job_context.job_timestamp}: "
+                         f"{error!r}")
+            aborted = True
+            status_counts = db_read.log_success_rate(
+                method, job_context.job_timestamp, db_session
+            )
+        finally:
+            if progress:
+                progress.finish()
+
+    if aborted or limit_reached:
+        return EXIT_ABORTED
+
+    # failed GETs also set the status of method to "error"
+    error_count = status_counts.get("error", 0)
+
+    if error_count:
+        logger.warning(f"{error_count} record(s) had errors.")
+        return EXIT_RECORD_ERRORS
+
+    return EXIT_OK
+
+
+def create_common_parser() -> ArgumentParser:
+    """
+    :return: Parser with the options shared by all subcommands running
+        records, to be used as parent of other parsers
+    """
+
+    common_parser = ArgumentParser(add_help=False)
+    common_parser.add_argument(
+        "--workers",
+        type=int,
+        default=RunSettings().workers,
+        help="Number of threads fetching and sending records, 1 handles "
+             "one record after the other."
+    )
+    common_parser.add_argument(
+        "--rate",
+        type=float,
+        metavar="CALLS_PER_SECOND",
+        help="Make no more API calls per second than this."
+    )
+    common_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=RunSettings().batch_size,
+        help="Maximum number of records waiting for each stage of the "
+             "pipeline."
+    )
+    common_parser.add_argument(
+        "--max-calls",
+        type=int,
+        help="Stop before the job makes more API calls than this."
+    )
+    common_parser.add_argument(
+        "--progress",
+        action="store_true",
+        help="Show records done, records per second and time left."
+    )
+    common_parser.add_argument(
+        "--canary",
+        type=int,
+        metavar="SAMPLE_SIZE",
+        help="Handle a random sample of this many records first, then the "
+             "rest in stages of growing size. Stop if more than 5%% of the "
+             "calls of a stage fail or, for PUT, more than 10%% of the "
+             "responses differ from the data sent."
+    )
+    common_parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Only show the number of API calls the job needs and how long "
+             "it will take, estimated from previous jobs. No calls changing "
+             "records are made and nothing is saved to the database."
+    )
+    common_parser.add_argument(
+        "--job-name",
+        help="Share the calls per second (--rate, defaults to Alma's limit) "
+             "and the daily budget with other jobs under this name, see "
+             "module scheduler."
+    )
+    common_parser.add_argument(
+        "--priority",
+        type=int,
+        default=0,
+        help="With --job-name: jobs with lower priority wait while jobs with "
+             "higher priority make calls."
+    )
+    common_parser.add_argument(
+        "--weight",
+        type=float,
+        default=1.0,
+        help="With --job-name: share of the calls per second compared to "
+             "other jobs of the same priority."
+    )
+
+    return common_parser
+
+
+def create_parser() -> ArgumentParser:
+    """
+    :return: Parser for the almapipo script with all subcommands
+    """
+
+    common_parser = create_common_parser()
+
+    parser = ArgumentParser(
+        description="Make API calls for many Alma records.",
+        epilog="Exit codes: 0 = all calls succeeded, 1 = some calls had "
+               "errors, 2 = wrong arguments, 3 = job was stopped.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for command, method in [("get", "GET"), ("delete", "DELETE")]:
+        subparser = subparsers.add_parser(
+            command,
+            parents=[common_parser],
+            help=f"{method} records listed in a CSV/TSV file or a set.",
+        )
+        _add_api_arguments(subparser)
+        input_group = subparser.add_mutually_exclusive_group(required=True)
+        input_group.add_argument(
+            "input_file",
+            nargs="?",
+            type=Path,
+            help="File with a header and almaids in the first column, e.g. "
+                 "MMSID,HOLID for holdings."
+        )
+        input_group.add_argument(
+            "--set-id",
+            help="ID of an Alma set with the records."
+        )
+        _add_skip_done_argument(subparser)
+        subparser.set_defaults(method=method, run=_run_get_or_delete)
+
+    update_parser = subparsers.add_parser(
+        "update",
+        parents=[common_parser],
+        help="PUT records as described in a CSV/TSV file.",
+        epilog="Example heading: 'bibs,holdings,items;item_data/description;"
+               "append:item_data/public_note'"
+    )
+    update_parser.add_argument(
+        "input_file",
+        type=Path,
+        help="File with almaids in the first column and xpaths (optionally "
+             "prefixed by a mode) as headings of all other columns."
+    )
+    mode_group = update_parser.add_mutually_exclusive_group()
+    mode_group.add_argument(
+        "--append",
+        action="store_true",
+        help="Append the values for columns without mode."
+    )
+    mode_group.add_argument(
+        "--prepend",
+        action="store_true",
+        help="Prepend the values for columns without mode."
+    )
+    _add_skip_done_argument(update_parser)
+    update_parser.set_defaults(method="PUT", run=_run_update)
+
+    post_parser = subparsers.add_parser(
+        "post",
+        parents=[common_parser],
+        help="POST the XML files listed in a CSV/TSV file."
+    )
+    _add_api_arguments(post_parser)
+    post_parser.add_argument(
+        "input_file",
+        type=Path,
+        help="File with a header, the almaids of the parent records (e.g. "
+             "MMSID for holdings) in the first column and the paths of the "
+             "XML files to send in the second column."
+    )
+    post_parser.set_defaults(method="POST", run=_run_post)
+
+    resume_parser = subparsers.add_parser(
+        "resume",
+        help="Continue an interrupted GET or DELETE job.",
+        epilog="Example: almapipo resume '2020-02-02 20:02:02.202002+00:00' "
+               "bibs holdings DELETE --wait"
+    )
+    resume_parser.add_argument(
+        "job_timestamp",
+        type=datetime.fromisoformat,
+        help="job_timestamp of the job to resume as saved in the database."
+    )
+    _add_api_arguments(resume_parser)
+    resume_parser.add_argument(
+        "method",
+        choices=["GET", "DELETE"],
+        help="Method used by the original job."
+    )
+    resume_parser.add_argument(
+        "--retry-errors",
+        action="store_true",
+        help="Also make the calls for almaids that had errors."
+    )
+    resume_parser.add_argument(
+        "--wait",
+        action="store_true",
+        help="If the daily threshold is exceeded, wait for it to be reset "
+             "and continue."
+    )
+    resume_parser.set_defaults(run=_run_resume)
+
+    retry_parser = subparsers.add_parser(
+        "retry",
+        help="Retry the calls of a GET or DELETE job that had transient "
+             "errors.",
+        epilog="Example: almapipo retry '2020-02-02 20:02:02.202002+00:00' "
+               "bibs holdings DELETE"
+    )
+    retry_parser.add_argument(
+        "job_timestamp",
+        type=datetime.fromisoformat,
+        help="job_timestamp of the job as saved in the database."
+    )
+    _add_api_arguments(retry_parser)
+    retry_parser.add_argument(
+        "method",
+        choices=["GET", "DELETE"],
+        help="Method used by the original job."
+    )
+    retry_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=RunSettings().batch_size,
+        help="Number of almaids set back to 'new' at once."
+    )
+    retry_parser.set_defaults(run=_run_retry)
+
+    rollback_parser = subparsers.add_parser(
+        "rollback",
+        parents=[common_parser],
+        help="Undo the PUT and DELETE calls of a job.",
+        epilog="Example: almapipo rollback "
+               "'2020-02-02 20:02:02.202002+00:00' bibs holdings --workers 32"
+    )
+    rollback_parser.add_argument(
+        "job_timestamp",
+        type=datetime.fromisoformat,
+        help="job_timestamp of the job to roll back as saved in the "
+             "database."
+    )
+    _add_api_arguments(rollback_parser)
+    rollback_parser.set_defaults(run=_run_rollback)
+
+    budget_parser = subparsers.add_parser(
+        "budget",
+        help="Set the daily budget of API calls or reserve calls of it.",
+        epilog="Example: almapipo budget --daily-calls 400000 --reserve "
+               "nightly-update 50000 --priority 10"
+    )
+    budget_parser.add_argument(
+        "--day",
+        type=date.fromisoformat,
+        help="Day to set the budget or reservation for, defaults to today."
+    )
+    budget_parser.add_argument(
+        "--daily-calls",
+        type=int,
+        help="Number of calls all jobs together may make in the day."
+    )
+    budget_parser.add_argument(
+        "--reserve",
+        nargs=2,
+        metavar=("JOB_NAME", "CALLS"),
+        help="Reserve calls of the daily budget for the job with this "
+             "--job-name."
+    )
+    budget_parser.add_argument(
+        "--priority",
+        type=int,
+        default=0,
+        help="Priority of the job with the reservation."
+    )
+    budget_parser.set_defaults(run=_run_budget)
+
+    return parser
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Run the almapipo script.
+    :param argv: Arguments without the name of the script, defaults to
+        sys.argv[1:]
+    :return: Exit code
+    """
+
+    args = create_parser().parse_args(argv)
+
+    # setup_logfile needs the logfile directory from env vars on import
+    from . import setup_logfile
+
+    setup_logfile.log_to_stdout(logger)
+    setup_logfile.log_to_stdout(db_read.logger)
+    setup_logfile.log_to_stdout(planner.logger)
+    basicConfig(
+        format='%(asctime)s - %(name)s %(threadName)s - %(levelname)s - '
+               '%(message)s'
+    )
+
+    return args.run(args, context_from_args(args))
+
+
+def context_from_args(args: Namespace) -> config.JobContext:
+    """
+    :param args: Parsed arguments
+    :return: config.default_context, limited to --rate calls per second or
+        to the share of --job-name
+    """
+
+    job_context = config.default_context
+
+    if getattr(args, "job_name", None):
+        job_context = scheduler.schedule_job(
+            args.job_name, args.priority, args.weight,
+            args.rate or scheduler.DEFAULT_CALLS_PER_SECOND, job_context
+        )
+    elif getattr(args, "rate", None):
+        job_context = replace(
+            job_context, rate_limiter=rate_limit.RateLimiter(args.rate)
+        )
+
+    return job_context
+
+
+def settings_from_args(args: Namespace) -> RunSettings:
+    """
+    :param args: Parsed arguments of a parser with create_common_parser as
+        parent
+    :return: Settings for run_job
+    """
+
+    canary_settings = None
+
+    if args.canary:
+        canary_settings = canary.CanarySettings(sample_size=args.canary)
+
+    return RunSettings(
+        workers=args.workers,
+        batch_size=args.batch_size,
+        max_calls=args.max_calls,
+        show_progress=args.progress,
+        canary_settings=canary_settings,
+        skip_done_days=getattr(args, "skip_done_days", None),
+        plan_only=args.plan,
+    )
+
+
+def _add_api_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "api",
+        help="API to make the calls for, e.g. 'bibs'."
+    )
+    parser.add_argument(
+        "record_type",
+        help="Type of record to make the calls for, e.g. 'holdings'."
+    )
+
+
+def _add_skip_done_argument(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--skip-done-days",
+        type=float,
+        metavar="DAYS",
+        help="Handle almaids repeated in the input only once and skip "
+             "almaids any job did the same action for successfully in this "
+             "many days before."
+    )
+
+
+def _skip_done_almaids(
+        almaids: Iterable[str],
+        method: str,
+        skip_done_days: float,
+        job_context: config.JobContext) -> Iterator[str]:
+    """
+    Hand on the almaids not done yet while they are read, with a DB session
+    of its own.
+    """
+
+    done_since = job_context.job_timestamp - timedelta(days=skip_done_days)
+
+    with job_context.create_db_session() as db_session:
+        yield from dedup.skip_done_almaids(
+            almaids, method, done_since, db_session
+        )
+
+
+def _read_input_file(
+        input_file: Path,
+        job_context: config.JobContext,
+        plan_only: bool = False) -> Tuple[Optional[int], Iterator[dict]]:
+    """
+    Save the lines of the file to source_csv while reading it, then read it
+    again for the job, so the lines are never all kept in memory. With
+    plan_only nothing is saved and the number of lines is None.
+    :return: Number of lines and generator of the lines
+    """
+
+    if plan_only:
+        return None, input_read.read_csv_contents(str(input_file))
+
+    with job_context.create_db_session() as db_session:
+        line_count = db_write.copy_csv_lines_to_source_csv(
+            input_read.read_csv_contents(str(input_file)),
+            job_context.job_timestamp, db_session
+        )
+
+    return line_count, input_read.read_csv_contents(str(input_file))
+
+
+def _first_column(csv_line: dict) -> str:
+    return next(iter(csv_line.values()))
+
+
+def _run_get_or_delete(args: Namespace, job_context: config.JobContext) -> int:
+    if args.set_id:
+        return run_set_job(
+            args.set_id, args.method, args.api, args.record_type,
+            job_context, settings_from_args(args)
+        )
+
+    total, csv_lines = _read_input_file(
+        args.input_file, job_context, args.plan
+    )
+    almaids = (_first_column(csv_line) for csv_line in csv_lines)
+
+    return run_job(
+        almaids, args.method, args.api, args.record_type, job_context,
+        settings_from_args(args), total=total
+    )
+
+
+def _run_update(args: Namespace, job_context: config.JobContext) -> int:
+    _, csv_lines = _read_input_file(args.input_file, job_context, args.plan)
+    first_csv_line = next(csv_lines, None)
+
+    if first_csv_line is None:
+        logger.warning("No lines to update.")
+        return EXIT_OK
+
+    if args.append:
+        default_mode = "append"
+    elif args.prepend:
+        default_mode = "prepend"
+    else:
+        default_mode = "replace"
+
+    api, record_type = csv_update.get_api_and_record_type(first_csv_line)
+    updates_by_almaid = csv_update.group_updates_by_almaid(
+        chain([first_csv_line], csv_lines), default_mode
+    )
+
+    return run_job(
+        list(updates_by_almaid), "PUT", api, record_type, job_context,
+        settings_from_args(args),
+        partial(csv_update.apply_updates_of_almaid, updates_by_almaid),
+        total=len(updates_by_almaid)
+    )
+
+
+def _run_post(args: Namespace, job_context: config.JobContext) -> int:
+    total, csv_lines = _read_input_file(
+        args.input_file, job_context, args.plan
+    )
+    records = (tuple(csv_line.values())[:2] for csv_line in csv_lines)
+
+    # the files are read one at a time while the records are sent
+    if not args.plan:
+        records = ((almaid, Path(xml_path).read_bytes())
+                   for almaid, xml_path in records)
+
+    return run_job(
+        records, "POST", args.api, args.record_type, job_context,
+        settings_from_args(args), total=total
+    )
+
+
+def _run_resume(args: Namespace, job_context: config.JobContext) -> int:
+    with job_context.create_db_session() as db_session:
+        success = almapipo.resume_job(
+            args.job_timestamp,
+            args.api,
+            args.record_type,
+            args.method,
+            db_session,
+            retry_errors=args.retry_errors,
+            wait_for_threshold=args.wait,
+            job_context=job_context
+        )
+
+    return EXIT_OK if success else EXIT_ABORTED
+
+
+def _run_retry(args: Namespace, job_context: config.JobContext) -> int:
+    with job_context.create_db_session() as db_session:
+        try:
+            almapipo.retry_transient_errors(
+                args.job_timestamp,
+                args.api,
+                args.record_type,
+                args.method,
+                db_session,
+                batch_size=args.batch_size,
+                job_context=job_context
+            )
+        except exceptions.ThresholdException:
+            logger.error(f"Daily threshold exceeded. Resume job "
+                         f"{args.job_timestamp} when it is reset.")
+            return EXIT_ABORTED
+
+        status_counts = db_read.get_status_counts(
+            args.job_timestamp, db_session
+        )
+        error_count = sum(
+            status_counts.get(action, {}).get("error", 0)
+            for action in sorted({"GET", args.method})
+        )
+
+    return EXIT_RECORD_ERRORS if error_count else EXIT_OK
+
+
+def _run_rollback(args: Namespace, job_context: config.JobContext) -> int:
+    with job_context.create_db_session() as db_session:
+        if not args.plan:
+            rollback.register_rollback(
+                args.job_timestamp, job_context, db_session
+            )
+        almaids_by_method = rollback.get_almaids_to_roll_back(
+            args.job_timestamp, db_session
+        )
+
+    if not almaids_by_method:
+        logger.warning(f"Job {args.job_timestamp} has no PUT or DELETE calls "
+                       f"to roll back.")
+        return EXIT_OK
+
+    exit_codes = []
+    backup_reader = rollback.BackupReader(args.job_timestamp, job_context)
+
+    try:
+        for method, almaids in almaids_by_method.items():
+            if rollback.ROLLBACK_METHODS[method] == "PUT" or args.plan:
+                exit_codes.append(run_job(
+                    almaids, rollback.ROLLBACK_METHODS[method], args.api,
+                    args.record_type, job_context, settings_from_args(args),
+                    backup_reader.restore_record, total=len(almaids)
+                ))
+            else:
+                exit_codes.append(run_job(
+                    backup_reader.get_records_to_post(almaids), "POST",
+                    args.api, args.record_type, job_context,
+                    settings_from_args(args), total=len(almaids)
+                ))
+
+            if exit_codes[-1] == EXIT_ABORTED:
+                break
+    finally:
+        backup_reader.close()
+
+    return max(exit_codes)
+
+
+def _run_budget(args: Namespace, job_context: config.JobContext) -> int:
+    if args.daily_calls is not None:
+        scheduler.set_daily_budget(args.daily_calls, args.day, job_context)
+        logger.info(f"Daily budget set to {args.daily_calls} calls.")
+
+    if args.reserve:
+        job_name, reserved_calls = args.reserve
+        scheduler.reserve_calls(
+            job_name, int(reserved_calls), args.priority,
+            budget_day=args.day, job_context=job_context
+        )
+        logger.info(f"Reserved {reserved_calls} calls for {job_name}.")
+
+    return EXIT_OK
@@ -1,6 +1,86 @@
 """Config used package-wide."""
 
+from dataclasses import dataclass, field, replace
 from datetime import datetime, timezone
+from os import environ
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
 
 # Timestamp as inserted in the database and used for logfile-names
 job_timestamp = datetime.now(timezone.utc)
+
+
+@dataclass(frozen=True)
+class JobContext:
+    """
+    Everything a job needs to know about where its calls go to and where
+    they are recorded. Several contexts can be used within one process, e. g.
+    for jobs in sandbox and production or for several concurrent jobs.
+
+    Everything left as None falls back to the module-level defaults:
+    setup_rest.api_key, setup_rest.api_base_url, setup_rest.rate_limiter
+    and db_connect.db_engine (the latter two read from env vars on import).
+    :param job_timestamp: Timestamp to identify the job in the database
+    :param api_key: API key for Alma
+    :param api_base_url: Base URL of the Alma API, e. g. for sandbox
+    :param db_engine: Engine for the database the job is recorded in
+    :param rate_limiter: Limit of calls per second, see module rate_limit
+    :param store_record_blobs: Store the XML of records in record_blobs, once
+        per content_hash, instead of in every row, see db_write
+    """
+    job_timestamp: datetime = field(
+        default_factory=lambda: datetime.now(timezone.utc)
+    )
+    api_key: str = None
+    api_base_url: str = None
+    db_engine: Engine = None
+    rate_limiter: object = None
+    store_record_blobs: bool = False
+
+    def for_job(self, new_job_timestamp: datetime = None) -> "JobContext":
+        """
+        Same context for another job.
+        :param new_job_timestamp: Timestamp of the other job, defaults to now
+        :return: New JobContext
+        """
+        if new_job_timestamp is None:
+            new_job_timestamp = datetime.now(timezone.utc)
+
+        return replace(self, job_timestamp=new_job_timestamp)
+
+    def get_db_engine(self) -> Engine:
+        """
+        Engine of the context's database.
+        :return: SQLAlchemy engine
+        """
+        if self.db_engine is None:
+            # db_connect needs its env vars on import, so only import on use
+            from . import db_connect
+            return db_connect.db_engine
+
+        return self.db_engine
+
+    def create_db_session(self) -> Session:
+        """
+        Create a session for the context's database.
+        :return: SQLAlchemy session
+        """
+        if self.db_engine is None:
+            # db_connect needs its env vars on import, so only import on use
+            from . import db_connect
+            return db_connect.DBSession()
+
+        return Session(bind=self.db_engine)
+
+
+# Store each distinct record only once, see README
+try:
+    store_record_blobs = bool(int(environ["ALMA_REST_DB_RECORD_BLOBS"]))
+except KeyError:
+    store_record_blobs = False
+
+# Context of the job started with this process
+default_context = JobContext(
+    job_timestamp, store_record_blobs=store_record_blobs
+)
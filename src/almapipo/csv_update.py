@@ -0,0 +1,146 @@
+"""Update records as described in a CSV/TSV file
+
+Used by the script update_by_csv, see cli. The file has the following layout:
+* Heading of column 1: which kinds of IDs are listed (e.g. 'bibs,holdings')
+* Headings of all other columns: xpath of the element to change, optionally
+  with a mode as prefix: 'replace:', 'append:', 'prepend:' or 'remove:'
+* Column 1: comma-separated list of IDs of the record
+* All other columns: text to set for the element. Empty cells leave the
+  element as it is. For 'remove:' any text removes the element.
+
+All rows for the same almaid are merged, so each record is retrieved once,
+gets all changes of all its rows and columns and is sent back once.
+"""
+
+from logging import getLogger
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from xml.etree.ElementTree import ParseError, fromstring, tostring
+
+from . import xml_modify
+
+# Logfile
+logger = getLogger(__name__)
+
+MODES = ["replace", "append", "prepend", "remove"]
+
+
+class ColumnUpdate(NamedTuple):
+    """Change of one element of a record as given by one cell."""
+    xpath: str
+    mode: str
+    text: str
+
+
+def parse_column_heading(
+        heading: str,
+        default_mode: str = "replace") -> Tuple[str, str]:
+    """
+    Split a column heading into mode and xpath.
+    :param heading: Heading like 'append:item_data/description'
+    :param default_mode: Mode for headings without prefix
+    :return: Tuple of mode and xpath
+    """
+
+    mode, separator, xpath = heading.partition(":")
+
+    if separator and mode in MODES:
+        return mode, xpath
+
+    return default_mode, heading
+
+
+def get_api_and_record_type(csv_line: dict) -> Tuple[str, str]:
+    """
+    Take api and record_type from the heading of the first column, e. g.
+    'bibs,holdings,items' means api 'bibs' and record_type 'items'.
+    :param csv_line: Any row of the csv file as dict
+    :return: Tuple of api and record_type
+    """
+
+    almaid_names = list(csv_line.keys())[0].split(",")
+
+    return almaid_names[0], almaid_names[-1]
+
+
+def group_updates_by_almaid(
+        csv_lines: Iterable[dict],
+        default_mode: str = "replace") -> Dict[str, List[ColumnUpdate]]:
+    """
+    Collect the changes of all rows and columns per almaid, in the order
+    they appear in the file.
+    :param csv_lines: Rows of the csv file as dicts
+    :param default_mode: Mode for columns without prefix in the heading
+    :return: Dictionary with almaids as keys and lists of changes as values
+    """
+
+    if default_mode not in MODES:
+        logger.error(f"Mode {default_mode} not known, use one of {MODES}.")
+        raise ValueError
+
+    updates_by_almaid = {}
+
+    for csv_line in csv_lines:
+        cells = list(csv_line.items())
+        almaid = cells[0][1]
+        updates = updates_by_almaid.setdefault(almaid, [])
+
+        for heading, text in cells[1:]:
+            if not text:
+                continue
+            mode, xpath = parse_column_heading(heading, default_mode)
+            updates.append(ColumnUpdate(xpath, mode, text))
+
+    return updates_by_almaid
+
+
+def apply_column_updates(
+        column_updates: List[ColumnUpdate],
+        almaid: str,
+        record_data: str) -> Optional[bytes]:
+    """
+    Apply all changes for one record, usable as manipulate_xml via
+    functools.partial.
+    :param column_updates: Changes as returned by group_updates_by_almaid
+    :param almaid: Comma-separated string of record-ids, most specific last
+    :param record_data: String containing XML data as retrieved via GET
+    :return: Manipulated XML or None if the record could not be parsed
+    """
+
+    try:
+        xml = fromstring(record_data)
+    except ParseError:
+        logger.warning(f"Could not call fromstring on record for {almaid}.")
+        return None
+
+    for column_update in column_updates:
+        logger.info(f"Record {almaid}: {column_update.mode} "
+                    f"'{column_update.xpath}' with '{column_update.text}'.")
+
+        if column_update.mode == "remove":
+            xml = xml_modify.remove_element_by_path(xml, column_update.xpath)
+        else:
+            xml = xml_modify.update_element(
+                xml, column_update.xpath, None, column_update.text, None,
+                None, column_update.mode == "append",
+                column_update.mode == "prepend"
+            )
+
+    return tostring(xml)
+
+
+def apply_updates_of_almaid(
+        updates_by_almaid: Dict[str, List[ColumnUpdate]],
+        almaid: str,
+        record_data: str) -> Optional[bytes]:
+    """
+    Apply all changes given for the almaid, usable as manipulate_xml for a
+    whole job via functools.partial.
+    :param updates_by_almaid: Changes as returned by group_updates_by_almaid
+    :param almaid: Comma-separated string of record-ids, most specific last
+    :param record_data: String containing XML data as retrieved via GET
+    :return: Manipulated XML or None if the record could not be parsed
+    """
+
+    return apply_column_updates(
+        updates_by_almaid.get(almaid, []), almaid, record_data
+    )
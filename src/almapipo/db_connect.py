@@ -3,6 +3,7 @@
 from os import environ
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 
 # SQLAlchemy logging behavior
@@ -21,11 +22,32 @@ db_url = environ["ALMA_REST_DB_URL"]
 
 params = f"postgresql://{db_user}:{db_pw}@{db_url}/{database}"
 
-db_engine = create_engine(
-    params,
-    echo=does_sqlalchemy_log,
-    execution_options={
-        "isolation_level": "AUTOCOMMIT"
-    }
-)
+
+def create_db_engine(
+        engine_database: str,
+        engine_user: str,
+        engine_pw: str,
+        engine_url: str) -> Engine:
+    """
+    Create an engine as used by almapipo, e. g. for the db_engine of a
+    config.JobContext that writes to another database than the env vars.
+    :param engine_database: Name of the database
+    :param engine_user: Database user
+    :param engine_pw: Password of the database user
+    :param engine_url: Host (and port) of the database
+    :return: SQLAlchemy Engine
+    """
+    engine_params = f"postgresql://{engine_user}:{engine_pw}@{engine_url}/" \
+                    f"{engine_database}"
+
+    return create_engine(
+        engine_params,
+        echo=does_sqlalchemy_log,
+        execution_options={
+            "isolation_level": "AUTOCOMMIT"
+        }
+    )
+
+
+db_engine = create_db_engine(database, db_user, db_pw, db_url)
 DBSession = sessionmaker(bind=db_engine)
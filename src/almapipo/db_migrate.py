@@ -0,0 +1,401 @@
+"""Upgrade existing databases to the current table definitions
+
+db_create_tables only creates tables that do not exist yet, it does not
+change tables created by an earlier version of almapipo. MIGRATIONS lists
+the changes to setup_db since then, each with a version number. upgrade
+applies all migrations not yet listed in the table schema_versions, in the
+order of their versions.
+
+All migrations can be applied more than once and leave a database created
+from the current setup_db as it is, so db_create_tables simply runs upgrade
+after creating the tables. Indexes are built with CREATE INDEX CONCURRENTLY,
+so jobs can keep writing to the tables meanwhile. Changing the type of
+source_csv.csv_line to JSONB rewrites the table and locks it until done, as
+does counting the rows of job_status_per_id for job_summary.
+
+The triggers keeping job_summary up to date lock its row of the job until
+the end of each transaction writing job_status_per_id, so concurrent
+writers of the same job wait for each other there. They apply the changes
+of a whole statement at once, so batching status updates (as
+status_writer.StatusWriter does) keeps this wait short.
+"""
+
+from logging import getLogger
+from typing import Callable, List, NamedTuple
+
+from sqlalchemy import Index, inspect, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex
+
+from . import setup_db
+
+# Logfile
+logger = getLogger(__name__)
+
+
+class Migration(NamedTuple):
+    """
+    One change of the tables, see MIGRATIONS.
+    :param version: Number of the migration, higher than all before
+    :param description: What the migration changes
+    :param upgrade: Function with argument connection (in autocommit mode)
+        that applies the change and can be run more than once
+    """
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+def create_index(connection: Connection, index: Index) -> None:
+    """
+    Build an index as defined in setup_db without locking its table for
+    writes. An invalid index left by an interrupted build is built again.
+    :param connection: Connection in autocommit mode
+    :param index: Index of a table in setup_db
+    :return: None
+    """
+
+    is_valid = connection.execute(
+        text("SELECT pg_index.indisvalid FROM pg_index "
+             "JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+             "WHERE pg_class.relname = :index_name"),
+        {"index_name": index.name}
+    ).scalar()
+
+    if is_valid:
+        return
+
+    if is_valid is False:
+        logger.warning(f"Index {index.name} is invalid, building it again.")
+        connection.execute(text(f"DROP INDEX CONCURRENTLY {index.name}"))
+
+    logger.info(f"Building index {index.name}.")
+    create_statement = str(
+        CreateIndex(index).compile(dialect=connection.dialect)
+    )
+    connection.execute(text(create_statement.replace(
+        "CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1
+    )))
+
+
+def create_indexes(
+        connection: Connection,
+        table: setup_db.Base,
+        index_names: List[str] = None) -> None:
+    """
+    Build the indexes of a table as defined in setup_db, see create_index.
+    :param connection: Connection in autocommit mode
+    :param table: Table of setup_db, e. g. setup_db.FetchedRecords
+    :param index_names: Only build these indexes, defaults to all
+    :return: None
+    """
+
+    for index in sorted(table.__table__.indexes, key=lambda i: i.name):
+        if index_names is None or index.name in index_names:
+            create_index(connection, index)
+
+
+def _add_lookup_indexes(connection: Connection) -> None:
+    create_indexes(connection, setup_db.JobStatusPerId)
+    create_indexes(connection, setup_db.FetchedRecords)
+    create_indexes(connection, setup_db.SentRecords,
+                   ["ix_sent_records_job_almaid"])
+    create_indexes(connection, setup_db.PutPostResponses,
+                   ["ix_put_post_responses_job_almaid"])
+
+
+def _convert_source_csv_to_jsonb(connection: Connection) -> None:
+    columns = {column["name"]: column["type"] for column in
+               inspect(connection).get_columns("source_csv")}
+
+    if "almaid" not in columns:
+        connection.execute(text(
+            "ALTER TABLE source_csv ADD COLUMN almaid VARCHAR(100)"
+        ))
+
+    if not isinstance(columns["csv_line"], JSONB):
+        # Only JSON knows which column was the first one
+        logger.info("Saving almaids of source_csv.")
+        connection.execute(text(
+            "UPDATE source_csv SET almaid = "
+            "(SELECT value FROM json_each_text(csv_line) LIMIT 1) "
+            "WHERE almaid IS NULL"
+        ))
+        logger.info("Converting source_csv.csv_line to JSONB.")
+        connection.execute(text(
+            "ALTER TABLE source_csv "
+            "ALTER COLUMN csv_line TYPE JSONB USING csv_line::JSONB"
+        ))
+
+    create_indexes(connection, setup_db.SourceCsv)
+
+
+# Keeps job_summary up to date with job_status_per_id
+COUNT_JOB_STATUS_FUNCTION = """
+CREATE OR REPLACE FUNCTION count_job_status() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+            AND OLD.job_timestamp IS NOT DISTINCT FROM NEW.job_timestamp
+            AND OLD.job_action IS NOT DISTINCT FROM NEW.job_action
+            AND OLD.job_status IS NOT DISTINCT FROM NEW.job_status THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE job_summary SET record_count = record_count - 1
+         WHERE job_timestamp = OLD.job_timestamp
+           AND job_action = OLD.job_action
+           AND job_status = OLD.job_status;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO job_summary
+               (job_timestamp, job_action, job_status, record_count)
+        VALUES (NEW.job_timestamp, NEW.job_action, NEW.job_status, 1)
+        ON CONFLICT (job_timestamp, job_action, job_status)
+        DO UPDATE SET record_count = job_summary.record_count + 1;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def _add_job_summary(connection: Connection) -> None:
+    setup_db.JobSummary.__table__.create(connection, checkfirst=True)
+
+    # Count the existing rows and add the trigger at once, so no change of
+    # job_status_per_id is missed or counted twice
+    with connection.engine.connect() as transaction_connection:
+        transaction_connection = transaction_connection.execution_options(
+            isolation_level="READ COMMITTED"
+        )
+        with transaction_connection.begin():
+            for statement in [
+                "LOCK TABLE job_status_per_id IN SHARE ROW EXCLUSIVE MODE",
+                "DELETE FROM job_summary",
+                "INSERT INTO job_summary "
+                "(job_timestamp, job_action, job_status, record_count) "
+                "SELECT job_timestamp, job_action, job_status, count(*) "
+                "FROM job_status_per_id "
+                "WHERE job_timestamp IS NOT NULL "
+                "AND job_action IS NOT NULL AND job_status IS NOT NULL "
+                "GROUP BY job_timestamp, job_action, job_status",
+                COUNT_JOB_STATUS_FUNCTION,
+                "DROP TRIGGER IF EXISTS job_status_summary "
+                "ON job_status_per_id",
+                "CREATE TRIGGER job_status_summary "
+                "AFTER INSERT OR UPDATE OR DELETE ON job_status_per_id "
+                "FOR EACH ROW EXECUTE PROCEDURE count_job_status()",
+            ]:
+                transaction_connection.execute(text(statement))
+
+
+# Replaces count_job_status, which changes a row of job_summary once for every
+# row of job_status_per_id. This adds up the changes of a whole statement
+# first, so bulk writes (e. g. db_write.update_job_statuses) change each row
+# of job_summary only once. Transition tables need PostgreSQL 10 or later.
+COUNT_JOB_STATUSES_FUNCTION = """
+CREATE OR REPLACE FUNCTION count_job_statuses() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO job_summary
+               (job_timestamp, job_action, job_status, record_count)
+        SELECT job_timestamp, job_action, job_status, count(*)
+          FROM new_rows
+         WHERE job_timestamp IS NOT NULL
+           AND job_action IS NOT NULL AND job_status IS NOT NULL
+         GROUP BY job_timestamp, job_action, job_status
+         ORDER BY job_timestamp, job_action, job_status
+        ON CONFLICT (job_timestamp, job_action, job_status)
+        DO UPDATE SET record_count =
+            job_summary.record_count + EXCLUDED.record_count;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO job_summary
+               (job_timestamp, job_action, job_status, record_count)
+        SELECT job_timestamp, job_action, job_status, sum(delta)
+          FROM (SELECT job_timestamp, job_action, job_status, 1 AS delta
+                  FROM new_rows
+                 UNION ALL
+                SELECT job_timestamp, job_action, job_status, -1 AS delta
+                  FROM old_rows) AS changes
+         WHERE job_timestamp IS NOT NULL
+           AND job_action IS NOT NULL AND job_status IS NOT NULL
+         GROUP BY job_timestamp, job_action, job_status
+        HAVING sum(delta) <> 0
+         ORDER BY job_timestamp, job_action, job_status
+        ON CONFLICT (job_timestamp, job_action, job_status)
+        DO UPDATE SET record_count =
+            job_summary.record_count + EXCLUDED.record_count;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE job_summary SET record_count = record_count - deleted.count
+          FROM (SELECT job_timestamp, job_action, job_status, count(*)
+                  FROM old_rows
+                 GROUP BY job_timestamp, job_action, job_status) AS deleted
+         WHERE job_summary.job_timestamp = deleted.job_timestamp
+           AND job_summary.job_action = deleted.job_action
+           AND job_summary.job_status = deleted.job_status;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def _count_job_statuses_per_statement(connection: Connection) -> None:
+    # Swap the triggers in one transaction, so no change is missed or
+    # counted twice
+    with connection.engine.connect() as transaction_connection:
+        transaction_connection = transaction_connection.execution_options(
+            isolation_level="READ COMMITTED"
+        )
+        with transaction_connection.begin():
+            for statement in [
+                COUNT_JOB_STATUSES_FUNCTION,
+                "DROP TRIGGER IF EXISTS job_status_summary "
+                "ON job_status_per_id",
+                "DROP TRIGGER IF EXISTS job_status_summary_insert "
+                "ON job_status_per_id",
+                "CREATE TRIGGER job_status_summary_insert "
+                "AFTER INSERT ON job_status_per_id "
+                "REFERENCING NEW TABLE AS new_rows "
+                "FOR EACH STATEMENT EXECUTE PROCEDURE count_job_statuses()",
+                "DROP TRIGGER IF EXISTS job_status_summary_update "
+                "ON job_status_per_id",
+                "CREATE TRIGGER job_status_summary_update "
+                "AFTER UPDATE ON job_status_per_id "
+                "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows "
+                "FOR EACH STATEMENT EXECUTE PROCEDURE count_job_statuses()",
+                "DROP TRIGGER IF EXISTS job_status_summary_delete "
+                "ON job_status_per_id",
+                "CREATE TRIGGER job_status_summary_delete "
+                "AFTER DELETE ON job_status_per_id "
+                "REFERENCING OLD TABLE AS old_rows "
+                "FOR EACH STATEMENT EXECUTE PROCEDURE count_job_statuses()",
+                "DROP FUNCTION IF EXISTS count_job_status()",
+            ]:
+                transaction_connection.execute(text(statement))
+
+
+def _add_content_hashes(connection: Connection) -> None:
+    # Rows written before are compared by their XML, see
+    # db_read.get_mismatched_almaids
+    for table in [setup_db.SentRecords, setup_db.PutPostResponses]:
+        connection.execute(text(
+            f"ALTER TABLE {table.__tablename__} "
+            f"ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)"
+        ))
+        create_indexes(connection, table)
+
+
+def _add_record_blobs(connection: Connection) -> None:
+    setup_db.RecordBlobs.__table__.create(connection, checkfirst=True)
+    connection.execute(text(
+        "ALTER TABLE fetched_records "
+        "ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)"
+    ))
+
+
+def _add_job_tables(connection: Connection) -> None:
+    setup_db.Base.metadata.create_all(
+        connection,
+        tables=[table.__table__ for table in [
+            setup_db.JobMetrics,
+            setup_db.JobLeases,
+            setup_db.ApiCallCounts,
+            setup_db.ApiErrors,
+            setup_db.DailyBudgets,
+            setup_db.BudgetShares,
+            setup_db.JobLineage,
+        ]],
+        checkfirst=True
+    )
+
+
+MIGRATIONS = [
+    Migration(
+        1,
+        "Indexes for lookups by job, status and almaid",
+        _add_lookup_indexes
+    ),
+    Migration(
+        2,
+        "source_csv: almaid column, JSONB and indexes",
+        _convert_source_csv_to_jsonb
+    ),
+    Migration(
+        3,
+        "job_summary: counts per job, action and status kept by a trigger",
+        _add_job_summary
+    ),
+    Migration(
+        4,
+        "sent_records and put_post_responses: content_hash and indexes",
+        _add_content_hashes
+    ),
+    Migration(
+        5,
+        "record_blobs: records stored once per content_hash",
+        _add_record_blobs
+    ),
+    Migration(
+        6,
+        "Tables for metrics, leases, call counts, errors, budgets and lineage",
+        _add_job_tables
+    ),
+    Migration(
+        7,
+        "job_summary: trigger counting once per statement instead of per row",
+        _count_job_statuses_per_statement
+    ),
+]
+
+
+def get_pending_migrations(db_engine: Engine) -> List[Migration]:
+    """
+    :param db_engine: Engine of the database to check
+    :return: Migrations not applied yet, in the order to apply them
+    """
+
+    setup_db.SchemaVersions.__table__.create(db_engine, checkfirst=True)
+
+    with db_engine.connect() as connection:
+        applied = set(connection.execute(
+            text("SELECT version FROM schema_versions")
+        ).scalars())
+
+    return [migration for migration in
+            sorted(MIGRATIONS, key=lambda m: m.version)
+            if migration.version not in applied]
+
+
+def upgrade(db_engine: Engine) -> List[int]:
+    """
+    Apply all pending migrations and record them in schema_versions.
+    :param db_engine: Engine of the database to upgrade
+    :return: Versions of the migrations applied
+    """
+
+    applied = []
+
+    for migration in get_pending_migrations(db_engine):
+        logger.info(f"Applying migration {migration.version}: "
+                    f"{migration.description}")
+
+        with db_engine.connect() as connection:
+            connection = connection.execution_options(
+                isolation_level="AUTOCOMMIT"
+            )
+            migration.upgrade(connection)
+            connection.execute(
+                setup_db.SchemaVersions.__table__.insert().values(
+                    version=migration.version,
+                    description=migration.description
+                )
+            )
+
+        applied.append(migration.version)
+
+    if not applied:
+        logger.info("Database is up to date.")
+
+    return applied
@@ -5,14 +5,18 @@ Query the following information:
 * Status of API calls for records
 * API responses to PUT/POST calls
 * Data sent to the API via PUT/POST calls
+* Duration of previous jobs
+* Jobs currently sharing the daily API budget
+* Errors of failed API calls
 """
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from logging import getLogger
-from typing import Iterable
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from xml.etree.ElementTree import Element
 
-from sqlalchemy import func, String
+from sqlalchemy import and_, exists, func, or_, String
+from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.orm import Session, Query
 
 from . import setup_db
@@ -29,45 +33,70 @@ def check_data_sent_equals_response(
     For given almaid and job_timestamp check if the data sent via PUT/POST
     and the data received in the API's response are the same. Check depends on
     the two relevant database tables (sent_records and put_post_responses).
+    To check a whole job use get_mismatched_almaids.
     :param almaid: Comma separated string of Alma IDs to identify the record
     :param job_timestamp: Job that created the entry in the database tables
     :param db_session: Session to be used for the check
     :return: True if matches, False if non-existent or does not match.
     """
 
-    sent_id = func.concat(
-        setup_db.SentRecords.almaid,
-        setup_db.SentRecords.job_timestamp
-    )
-    response_id = func.concat(
-        setup_db.PutPostResponses.almaid,
-        setup_db.PutPostResponses.job_timestamp
-    )
-
-    if check_data_sent_and_response_exist(almaid, job_timestamp, db_session):
-
-        sent_received_matching = db_session.query(
-            setup_db.PutPostResponses
-        ).join(
-            setup_db.SentRecords,
-            sent_id == response_id
-        ).filter(
-            setup_db.SentRecords.alma_record.cast(String) ==
-            setup_db.PutPostResponses.alma_record.cast(String)
-        ).filter_by(
-            job_timestamp=job_timestamp
-        ).filter_by(
-            almaid=almaid
-        )
-
-        if sent_received_matching.count() > 0:
-            return True
+    if check_data_sent_and_response_exist(almaid, job_timestamp, db_session) \
+            and not get_mismatched_almaids(
+                job_timestamp, db_session, [almaid]):
+        return True
 
     logger.warning(f"Data in sent_records and put_post_responses for {almaid}"
                    f" and {job_timestamp} did not match.")
     return False
 
 
+def get_mismatched_almaids(
+        job_timestamp: datetime,
+        db_session: Session,
+        almaids: Iterable[str] = None) -> List[str]:
+    """
+    For a whole job get the almaids whose data sent via PUT/POST has no
+    matching response in put_post_responses, with one query. Records are
+    compared by content_hash (see xml_extract.hash_record), rows written
+    before there was a content_hash by their XML as text.
+    :param job_timestamp: Job that created the entries in the database tables
+    :param db_session: Session to be used for the check
+    :param almaids: Only check these almaids, defaults to all of the job
+    :return: Almaids without matching response, sorted
+    """
+
+    sent = setup_db.SentRecords
+    response = setup_db.PutPostResponses
+
+    matching_response = exists().where(
+        response.job_timestamp == sent.job_timestamp,
+        response.almaid == sent.almaid,
+        or_(
+            response.content_hash == sent.content_hash,
+            and_(
+                or_(response.content_hash.is_(None),
+                    sent.content_hash.is_(None)),
+                response.alma_record.cast(String) ==
+                sent.alma_record.cast(String)
+            )
+        )
+    )
+
+    mismatched = db_session.query(
+        sent.almaid
+    ).filter(
+        sent.job_timestamp == job_timestamp,
+        ~matching_response
+    ).distinct()
+
+    if almaids is not None:
+        mismatched = mismatched.filter(
+            sent.almaid.in_([str(almaid) for almaid in almaids])
+        )
+
+    return sorted(almaid for almaid, in mismatched)
+
+
 def check_data_sent_and_response_exist(
         almaid: str,
         job_timestamp: datetime,
@@ -114,8 +143,12 @@ def get_value_from_source_csv(
         db_session: Session) -> str:
     """
     For a given string of almaid and job_timestamp, retrieve a specific value
-    from the csv as it was saved in source_csv table.
+    from the csv as it was saved in source_csv table. The line is looked up
+    via the index on job_timestamp and almaid, which holds the value of the
+    first column. Still one query per record, for lookups of many records
+    use input_helpers.CsvIndex.
     :param almaid_name: Key of the almaid, heading of first column in csv
+        (the almaid is always taken from the first column)
     :param almaid: Comma separated string of Alma IDs to identify the record
     :param job_timestamp: Job that created the entry in source_csv
     :param json_key: Heading of the column that has the desired information
@@ -125,10 +158,9 @@ def get_value_from_source_csv(
 
     value_query = db_session.query(
         setup_db.SourceCsv
-    ).filter(
-        setup_db.SourceCsv.csv_line[almaid_name].astext == almaid
     ).filter_by(
-        job_timestamp=job_timestamp
+        job_timestamp=job_timestamp,
+        almaid=almaid
     )
 
     json_value = value_query.first().csv_line[json_key]
@@ -136,6 +168,77 @@ def get_value_from_source_csv(
     return json_value
 
 
+def get_source_csv_lines(
+        job_timestamp: datetime,
+        db_session: Session) -> Iterable[dict]:
+    """
+    For a given job_timestamp get all lines of the csv as they were saved
+    in source_csv table, in the order they were imported. The keys are not
+    in the order of the columns, see get_source_csv_rows for the almaids.
+    :param job_timestamp: Job that created the entries in source_csv
+    :param db_session: SQLAlchemy Session
+    :return: Generator of csv lines as dictionaries
+    """
+
+    lines_query = db_session.query(
+        setup_db.SourceCsv.csv_line
+    ).filter_by(
+        job_timestamp=job_timestamp
+    ).order_by(
+        setup_db.SourceCsv.primary_key
+    )
+
+    for result in lines_query.yield_per(1000):
+        yield result[0]
+
+
+def get_source_csv_rows(
+        job_timestamp: datetime,
+        db_session: Session) -> Iterable[Tuple[str, dict]]:
+    """
+    For a given job_timestamp get the almaid (first column) and the whole
+    line of all lines of the csv saved in source_csv table, in the order
+    they were imported.
+    :param job_timestamp: Job that created the entries in source_csv
+    :param db_session: SQLAlchemy Session
+    :return: Generator of almaid and csv line as dictionary
+    """
+
+    rows_query = db_session.query(
+        setup_db.SourceCsv.almaid,
+        setup_db.SourceCsv.csv_line
+    ).filter_by(
+        job_timestamp=job_timestamp
+    ).order_by(
+        setup_db.SourceCsv.primary_key
+    )
+
+    for almaid, csv_line in rows_query.yield_per(1000):
+        yield almaid, csv_line
+
+
+def query_record_xml(table: setup_db.Base, db_session: Session) -> Query:
+    """
+    Query alma_record of fetched_records, sent_records or put_post_responses.
+    Records stored in record_blobs (see config.JobContext) are taken
+    from there, so both kinds of rows can be read alike.
+    :param table: E. g. setup_db.FetchedRecords
+    :param db_session: SQLAlchemy Session
+    :return: Query of the XML of all rows, to be filtered and ordered further
+    """
+
+    return db_session.query(
+        func.coalesce(
+            table.alma_record,
+            setup_db.RecordBlobs.alma_record,
+            type_=setup_db.XMLType()
+        )
+    ).outerjoin(
+        setup_db.RecordBlobs,
+        setup_db.RecordBlobs.content_hash == table.content_hash
+    )
+
+
 def get_fetched_xml_by_timestamp(
         job_timestamp: datetime,
         db_session: Session
@@ -148,34 +251,61 @@ def get_fetched_xml_by_timestamp(
     :return: XML of the records
     """
 
-    record_query = db_session.query(
-        setup_db.FetchedRecords.alma_record
-    ).filter_by(
-        job_timestamp=job_timestamp
+    record_query = query_record_xml(
+        setup_db.FetchedRecords, db_session
+    ).filter(
+        setup_db.FetchedRecords.job_timestamp == job_timestamp
     )
 
     for result in record_query.all():
         yield result[0]
 
 
-def get_most_recent_fetched_xml(almaid: str, db_session: Session):
+def get_most_recent_fetched_xml(
+        almaid: str,
+        db_session: Session) -> Optional[Element]:
     """
     For a comma separated string of Alma IDs query for the record's
     most recently saved XML in the table fetched_records.
     :param almaid: Comma separated string of Alma IDs to identify the record.
     :param db_session: SQLAlchemy Session
-    :return: SQLAlchemy query object of the record.
+    :return: XML of the record or None if it was never fetched
     """
 
-    record_query = db_session.query(
-        setup_db.FetchedRecords
-    ).filter_by(
-        almaid=almaid
+    record = query_record_xml(
+        setup_db.FetchedRecords, db_session
+    ).filter(
+        setup_db.FetchedRecords.almaid == almaid
     ).order_by(
         setup_db.FetchedRecords.job_timestamp.desc()
-    ).limit(1)
+    ).first()
+
+    return record[0] if record else None
 
-    return record_query.first().alma_record
+
+def get_fetched_xml_of_job(
+        almaid: str,
+        job_timestamp: datetime,
+        db_session: Session) -> Optional[Element]:
+    """
+    Get the record as it was fetched by a job, i. e. before the job
+    changed or deleted it.
+    :param almaid: Comma separated string of Alma IDs to identify the record
+    :param job_timestamp: Job that created the entry in fetched_records
+    :param db_session: SQLAlchemy Session
+    :return: XML of the record or None if the job did not fetch it
+    """
+
+    record = query_record_xml(
+        setup_db.FetchedRecords, db_session
+    ).filter(
+        setup_db.FetchedRecords.almaid == almaid,
+        setup_db.FetchedRecords.job_timestamp == job_timestamp
+    ).order_by(
+        setup_db.FetchedRecords.primary_key
+    ).first()
+
+    return record[0] if record else None
 
 
 def get_list_of_ids_by_status_and_method(
@@ -186,7 +316,7 @@ def get_list_of_ids_by_status_and_method(
     """
     From table job_status_per_id get all Alma IDs that match the status
     given as the parameter.
-    :param status: "new", "done" or "error"
+    :param status: "new", "done", "error" or "skip"
     :param method: "DELETE", "GET", "POST" or "PUT"
     :param db_session: DB session to connect to
     :param job_timestamp: Timestamp to identify the job that made the entry
@@ -206,29 +336,309 @@ def get_list_of_ids_by_status_and_method(
     return list_of_ids
 
 
+def get_job_status_rows(
+        method: str,
+        job_timestamp: datetime,
+        db_session: Session) -> Query:
+    """
+    From table job_status_per_id get all rows of a job for one method.
+    :param method: "DELETE", "GET", "POST" or "PUT"
+    :param job_timestamp: Timestamp to identify the job that made the entry
+    :param db_session: DB session to connect to
+    :return: Query of rows with almaid, job_status and primary_key
+    """
+
+    status_rows = db_session.query(
+        setup_db.JobStatusPerId.almaid,
+        setup_db.JobStatusPerId.job_status,
+        setup_db.JobStatusPerId.primary_key
+    ).filter_by(
+        job_timestamp=job_timestamp
+    ).filter_by(
+        job_action=method
+    ).order_by(
+        setup_db.JobStatusPerId.primary_key
+    )
+
+    return status_rows
+
+
+def get_transient_error_rows(
+        job_timestamp: datetime,
+        db_session: Session) -> List[Tuple[str, str, int]]:
+    """
+    Get all rows of a job in job_status_per_id with status "error" whose
+    last saved API error is transient (see setup_rest.parse_api_error).
+    :param job_timestamp: Timestamp to identify the job
+    :param db_session: DB session to connect to
+    :return: List of almaid, job_action and primary_key of the rows
+    """
+
+    last_errors = db_session.query(
+        setup_db.ApiErrors.status_key,
+        setup_db.ApiErrors.transient
+    ).filter_by(
+        job_timestamp=job_timestamp
+    ).distinct(
+        setup_db.ApiErrors.status_key
+    ).order_by(
+        setup_db.ApiErrors.status_key,
+        setup_db.ApiErrors.primary_key.desc()
+    ).subquery()
+
+    error_rows = db_session.query(
+        setup_db.JobStatusPerId.almaid,
+        setup_db.JobStatusPerId.job_action,
+        setup_db.JobStatusPerId.primary_key
+    ).join(
+        last_errors,
+        last_errors.c.status_key == setup_db.JobStatusPerId.primary_key
+    ).filter(
+        setup_db.JobStatusPerId.job_timestamp == job_timestamp,
+        setup_db.JobStatusPerId.job_status == "error",
+        last_errors.c.transient.is_(True)
+    ).order_by(
+        setup_db.JobStatusPerId.primary_key
+    )
+
+    return [(almaid, job_action, primary_key)
+            for almaid, job_action, primary_key in error_rows]
+
+
+def count_done_almaids(
+        method: str,
+        done_since: datetime,
+        db_session: Session) -> int:
+    """
+    Count the distinct almaids with status "done" for the method in any job
+    since done_since.
+    :param method: GET, PUT, POST or DELETE
+    :param done_since: Only jobs with a job_timestamp since then count
+    :param db_session: DB session to connect to
+    :return: Number of almaids
+    """
+
+    return db_session.query(
+        func.count(setup_db.JobStatusPerId.almaid.distinct())
+    ).filter(
+        setup_db.JobStatusPerId.job_action == method,
+        setup_db.JobStatusPerId.job_status == "done",
+        setup_db.JobStatusPerId.job_timestamp >= done_since
+    ).scalar()
+
+
+def get_done_almaids(
+        method: str,
+        done_since: datetime,
+        db_session: Session) -> Iterable[str]:
+    """
+    Stream the distinct almaids with status "done" for the method in any
+    job since done_since.
+    :param method: GET, PUT, POST or DELETE
+    :param done_since: Only jobs with a job_timestamp since then count
+    :param db_session: DB session to connect to
+    :return: Generator of almaids
+    """
+
+    done_almaids = db_session.query(
+        setup_db.JobStatusPerId.almaid
+    ).filter(
+        setup_db.JobStatusPerId.job_action == method,
+        setup_db.JobStatusPerId.job_status == "done",
+        setup_db.JobStatusPerId.job_timestamp >= done_since
+    ).distinct().yield_per(10000)
+
+    return (almaid for almaid, in done_almaids)
+
+
+def get_done_almaids_among(
+        almaids: Iterable[str],
+        method: str,
+        done_since: datetime,
+        db_session: Session) -> Set[str]:
+    """
+    Check which of the almaids have status "done" for the method in any job
+    since done_since.
+    :param almaids: Almaids to check
+    :param method: GET, PUT, POST or DELETE
+    :param done_since: Only jobs with a job_timestamp since then count
+    :param db_session: DB session to connect to
+    :return: Set of the almaids done
+    """
+
+    done_almaids = db_session.query(
+        setup_db.JobStatusPerId.almaid
+    ).filter(
+        setup_db.JobStatusPerId.almaid.in_([str(almaid) for almaid in almaids]),
+        setup_db.JobStatusPerId.job_action == method,
+        setup_db.JobStatusPerId.job_status == "done",
+        setup_db.JobStatusPerId.job_timestamp >= done_since
+    ).distinct()
+
+    return {almaid for almaid, in done_almaids}
+
+
+def get_seconds_per_record(
+        method: str,
+        db_session: Session,
+        number_of_jobs: int = 10) -> Optional[float]:
+    """
+    From table job_metrics calculate how long handling one record took on
+    average for the most recent jobs with the given method. Jobs with
+    several workers are taken into account as if one worker had handled
+    all records.
+    :param method: GET, PUT, POST or DELETE
+    :param db_session: DB session to connect to
+    :param number_of_jobs: Number of most recent jobs to consider
+    :return: Seconds per record for one worker, None if there are no jobs
+    """
+
+    recent_jobs = db_session.query(
+        setup_db.JobMetrics.duration_seconds,
+        setup_db.JobMetrics.workers,
+        setup_db.JobMetrics.record_count
+    ).filter_by(
+        job_action=method
+    ).filter(
+        setup_db.JobMetrics.record_count > 0
+    ).order_by(
+        setup_db.JobMetrics.job_timestamp.desc()
+    ).limit(number_of_jobs).subquery()
+
+    seconds_per_record = db_session.query(
+        func.avg(
+            recent_jobs.c.duration_seconds * recent_jobs.c.workers
+            / recent_jobs.c.record_count
+        )
+    ).scalar()
+
+    if seconds_per_record is None:
+        return None
+
+    return float(seconds_per_record)
+
+
+def get_status_counts(
+        job_timestamp: datetime,
+        db_session: Session) -> Dict[str, Dict[str, int]]:
+    """
+    Count the rows of a job in job_status_per_id per action and status with
+    one query.
+    :param job_timestamp: Timestamp to identify the job
+    :param db_session: DB session to connect to
+    :return: Number of rows by job_action and job_status, e. g.
+        {"GET": {"done": 10, "error": 1}}
+    """
+
+    status_counts = db_session.query(
+        setup_db.JobStatusPerId.job_action,
+        setup_db.JobStatusPerId.job_status,
+        func.count()
+    ).filter_by(
+        job_timestamp=job_timestamp
+    ).group_by(
+        setup_db.JobStatusPerId.job_action,
+        setup_db.JobStatusPerId.job_status
+    )
+
+    counts = {}
+
+    for job_action, job_status, row_count in status_counts:
+        counts.setdefault(job_action, {})[job_status] = row_count
+
+    return counts
+
+
+def get_job_summary(
+        job_timestamp: datetime,
+        db_session: Session) -> Dict[str, Dict[str, int]]:
+    """
+    Same as get_status_counts, but read from table job_summary, which is
+    kept up to date with every change of job_status_per_id (see
+    db_migrate). Cheap enough to poll while the job is running.
+    :param job_timestamp: Timestamp to identify the job
+    :param db_session: DB session to connect to
+    :return: Number of rows by job_action and job_status, e. g.
+        {"GET": {"done": 10, "error": 1}}
+    """
+
+    summary_rows = db_session.query(
+        setup_db.JobSummary.job_action,
+        setup_db.JobSummary.job_status,
+        setup_db.JobSummary.record_count
+    ).filter_by(
+        job_timestamp=job_timestamp
+    )
+
+    counts = {}
+
+    for job_action, job_status, record_count in summary_rows:
+        counts.setdefault(job_action, {})[job_status] = record_count
+
+    return counts
+
+
 def log_success_rate(
         method: str,
         job_timestamp: datetime,
-        db_session: Session) -> None:
+        db_session: Session) -> Dict[str, int]:
     """
     For the current job check how many records have a specific status in
-    job_status_per_id.
+    job_status_per_id. Read from job_summary, or if the job or the table
+    itself is not found there (e. g. in a database not yet upgraded by
+    db_migrate) counted in job_status_per_id.
     :param method: GET, PUT, POST or DELETE
     :param job_timestamp: Timestamp to identify the job which created the line
     :param db_session: DB session to make use of
-    :return: None
+    :return: Number of records by status for the method
     """
 
-    ids_done = get_list_of_ids_by_status_and_method(
-        "done", method, job_timestamp, db_session
-    )
-    ids_error = get_list_of_ids_by_status_and_method(
-        "error", method, job_timestamp, db_session
-    )
-    ids_new = get_list_of_ids_by_status_and_method(
-        "new", method, job_timestamp, db_session
+    try:
+        counts = get_job_summary(job_timestamp, db_session)
+    except ProgrammingError as error:
+        logger.warning(f"Could not read job_summary: {error.orig}")
+        db_session.rollback()
+        counts = {}
+
+    if not counts:
+        counts = get_status_counts(job_timestamp, db_session)
+    method_counts = counts.get(method, {})
+
+    logger.info(f"{method} was done for {method_counts.get('done', 0)} "
+                f"record(s).")
+    logger.info(f"{method} was skipped for {method_counts.get('skip', 0)} "
+                f"record(s), as nothing would have changed.")
+    logger.info(f"{method} had errors for {method_counts.get('error', 0)} "
+                f"record(s).")
+    logger.info(f"{method} was not handled for {method_counts.get('new', 0)} "
+                f"record(s).")
+
+    return method_counts
+
+
+def get_active_budget_shares(
+        limit_name: str,
+        active_seconds: int,
+        db_session: Session) -> List[Tuple[str, int, float]]:
+    """
+    Get all jobs of the current day (as per the database's clock) that made
+    a call for the limit within the last active_seconds.
+    :param limit_name: Name of the limit, e. g. one per API key
+    :param active_seconds: Jobs without calls for longer are left out
+    :param db_session: SQLAlchemy Session
+    :return: List of job_name, priority and weight of each active job
+    """
+
+    shares = db_session.query(
+        setup_db.BudgetShares.job_name,
+        setup_db.BudgetShares.priority,
+        setup_db.BudgetShares.weight
+    ).filter(
+        setup_db.BudgetShares.limit_name == limit_name,
+        setup_db.BudgetShares.budget_day == func.current_date(),
+        setup_db.BudgetShares.last_call >
+        func.clock_timestamp() - timedelta(seconds=active_seconds)
     )
 
-    logger.info(f"{method} was done for {ids_done.count()} record(s).")
-    logger.info(f"{method} had errors for {ids_error.count()} record(s).")
-    logger.info(f"{method} was not handled for {ids_new.count()} record(s).")
+    return [(job_name, priority, weight)
+            for job_name, priority, weight in shares]
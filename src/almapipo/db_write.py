@@ -1,20 +1,48 @@
 """ Write to DB
 
 The DB is intended to do the following:
-* Store CSV files used for API calls
+* Store CSV files used for API calls (COPY for large files)
 * Store the status of calls per almaids (new, done, error)
 * Store which start time of the job triggered the DB-entry
 * Store API response contents
 * Store data sent to the API
+* Store each distinct record only once (optional, see record_blobs)
+* Store duration and size of jobs
+* Hand out rows of job_status_per_id to workers (leases)
+* Count API calls for limits shared by several processes
+* Store which jobs of a workflow fed into which (lineage)
+* Share the daily API budget between jobs
+* Store errors of failed API calls
 """
 
-from datetime import datetime
-from typing import OrderedDict
+from datetime import date, datetime, timedelta
+from io import StringIO
+from json import dumps
+from logging import getLogger
+from time import monotonic
+from typing import Iterable, List, Optional, OrderedDict, Tuple
 from xml.etree.ElementTree import fromstring
 
+from sqlalchemy import (
+    BigInteger,
+    cast,
+    column,
+    func,
+    Integer,
+    or_,
+    select,
+    String,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
 
-from . import setup_db
+from . import setup_db, xml_extract
+
+# Logfile
+logger = getLogger(__name__)
 
 
 def update_job_status(status: str,
@@ -38,11 +66,102 @@ def update_job_status(status: str,
     db_session.commit()
 
 
+def update_job_statuses(
+        statuses: Iterable[Tuple[int, str]],
+        db_session: Session) -> None:
+    """
+    Update the job_status of several rows in job_status_per_id, each to its
+    own status, with one UPDATE ... FROM (VALUES ...) and one commit.
+    :param statuses: Primary key and new status of each row, each primary
+        key at most once
+    :param db_session: Session to be used for the manipulation
+    :return: None
+    """
+
+    statuses = list(statuses)
+
+    if not statuses:
+        return
+
+    status_table = setup_db.JobStatusPerId.__table__
+    new_statuses = values(
+        column("primary_key", Integer),
+        column("job_status", String),
+        name="new_statuses"
+    ).data(statuses)
+
+    db_session.execute(
+        update(status_table).where(
+            status_table.c.primary_key == new_statuses.c.primary_key
+        ).values(
+            job_status=new_statuses.c.job_status
+        )
+    )
+    db_session.commit()
+
+
+def set_job_status_for_rows(
+        status: str,
+        primary_keys: Iterable[int],
+        db_session: Session) -> None:
+    """
+    Set the job_status of several rows in job_status_per_id at once.
+    :param status: New status to be set
+    :param primary_keys: Primary keys of the rows to change the status for
+    :param db_session: Session to be used for the manipulation
+    :return: None
+    """
+
+    db_session.query(
+        setup_db.JobStatusPerId
+    ).filter(
+        setup_db.JobStatusPerId.primary_key.in_(list(primary_keys))
+    ).update(
+        {"job_status": status}, synchronize_session=False
+    )
+
+    db_session.commit()
+
+
+def add_api_error(
+        status_key: int,
+        job_timestamp: datetime,
+        http_status: int,
+        error_code: Optional[str],
+        error_message: Optional[str],
+        transient: bool,
+        db_session: Session) -> None:
+    """
+    Save the error of a failed API call, see setup_rest.parse_api_error.
+    :param status_key: Primary key of the row in job_status_per_id
+    :param job_timestamp: Timestamp to identify the job
+    :param http_status: HTTP status code of the response
+    :param error_code: Error code sent by Alma, if any
+    :param error_message: Error message sent by Alma, if any
+    :param transient: True if the call may succeed later
+    :param db_session: DB session to add the data to
+    :return: None
+    """
+
+    line_for_table_api_errors = setup_db.ApiErrors(
+        status_key=status_key,
+        job_timestamp=job_timestamp,
+        http_status=http_status,
+        error_code=error_code,
+        error_message=error_message,
+        transient=transient
+    )
+
+    db_session.add(line_for_table_api_errors)
+    db_session.commit()
+
+
 def add_put_post_response(
         almaid: str,
         record_data: str,
         job_timestamp: datetime,
-        db_session: Session) -> None:
+        db_session: Session,
+        store_record_blobs: bool = False) -> None:
     """
     Create an entry in the database that identifies the job
     responsible for the entry (job_timestamp).
@@ -51,15 +170,15 @@ def add_put_post_response(
     :param record_data: Response retrieved via Alma API.
     :param job_timestamp: Identifier of the job causing the DB-entry.
     :param db_session: DB session to add the lines to.
+    :param store_record_blobs: Store the record in record_blobs, see
+        config.JobContext.
     :return: None
     """
 
-    record_data_xml = fromstring(record_data)
-
     line_for_table_put_post_responses = setup_db.PutPostResponses(
         almaid=almaid,
-        alma_record=record_data_xml,
         job_timestamp=job_timestamp,
+        **_get_record_columns(record_data, db_session, store_record_blobs)
     )
 
     db_session.add(line_for_table_put_post_responses)
@@ -69,7 +188,8 @@ def add_sent_record(
         almaid: str,
         record_data: bytes,
         job_timestamp: datetime,
-        db_session: Session) -> None:
+        db_session: Session,
+        store_record_blobs: bool = False) -> None:
     """
     Create an entry in the database that identifies the job
     responsible for the entry (job_timestamp).
@@ -78,15 +198,15 @@ def add_sent_record(
     :param record_data: Record to be sent via Alma API.
     :param job_timestamp: Identifier of the job causing the DB-entry.
     :param db_session: DB session to add the lines to.
+    :param store_record_blobs: Store the record in record_blobs, see
+        config.JobContext.
     :return: None
     """
 
-    record_data_xml = fromstring(record_data)
-
     line_for_table_sent_records = setup_db.SentRecords(
         almaid=almaid,
-        alma_record=record_data_xml,
         job_timestamp=job_timestamp,
+        **_get_record_columns(record_data, db_session, store_record_blobs)
     )
 
     db_session.add(line_for_table_sent_records)
@@ -96,7 +216,8 @@ def add_response_content_to_fetched_records(
         almaid: str,
         record_data,
         job_timestamp: datetime,
-        db_session: Session) -> None:
+        db_session: Session,
+        store_record_blobs: bool = False) -> None:
     """
     Create an entry in the database that identifies the job
     responsible for the entry (job_timestamp).
@@ -105,18 +226,69 @@ def add_response_content_to_fetched_records(
     :param record_data: Record as retrieved via Alma API.
     :param job_timestamp: Identifier of the job causing the DB-entry.
     :param db_session: DB session to add the lines to.
+    :param store_record_blobs: Store the record in record_blobs, see
+        config.JobContext.
     :return: None
     """
 
+    if store_record_blobs:
+        record_columns = _get_record_columns(
+            record_data, db_session, store_record_blobs
+        )
+    else:
+        record_columns = {"alma_record": record_data}
+
     line_for_table_fetched_records = setup_db.FetchedRecords(
         almaid=almaid,
-        alma_record=record_data,
         job_timestamp=job_timestamp,
+        **record_columns
     )
 
     db_session.add(line_for_table_fetched_records)
 
 
+def add_record_blob(
+        content_hash: str,
+        record_data,
+        db_session: Session) -> None:
+    """
+    Add a record to record_blobs unless a record with the same content_hash
+    is stored already. Nothing is written for a record stored before.
+    :param content_hash: Hash of the record, see xml_extract.hash_record
+    :param record_data: XML of the record as string, bytes or Element
+    :param db_session: DB session to add the record to
+    :return: None
+    """
+
+    if isinstance(record_data, bytes):
+        record_data = record_data.decode("utf-8")
+
+    db_session.execute(
+        insert(setup_db.RecordBlobs).values(
+            content_hash=content_hash,
+            alma_record=record_data
+        ).on_conflict_do_nothing(
+            index_elements=["content_hash"]
+        )
+    )
+
+
+def _get_record_columns(
+        record_data,
+        db_session: Session,
+        store_record_blobs: bool) -> dict:
+    # Values of alma_record and content_hash for fetched_records,
+    # sent_records and put_post_responses
+    content_hash = xml_extract.hash_record(record_data)
+
+    if store_record_blobs:
+        add_record_blob(content_hash, record_data, db_session)
+        return {"alma_record": None, "content_hash": content_hash}
+
+    return {"alma_record": fromstring(record_data),
+            "content_hash": content_hash}
+
+
 def add_csv_line_to_source_csv_table(
         csv_line: OrderedDict,
         job_timestamp: datetime,
@@ -132,12 +304,81 @@ def add_csv_line_to_source_csv_table(
 
     line_for_table_source_csv = setup_db.SourceCsv(
         job_timestamp=job_timestamp,
+        almaid=next(iter(csv_line.values()), None),
         csv_line=csv_line
     )
 
     db_session.add(line_for_table_source_csv)
 
 
+def copy_csv_lines_to_source_csv(
+        csv_lines: Iterable[dict],
+        job_timestamp: datetime,
+        db_session: Session,
+        chunk_size: int = 10000) -> int:
+    """
+    Add lines retrieved from a csv/tsv file to source_csv with COPY instead
+    of one INSERT per line. The lines are consumed as they come, so a
+    generator (e.g. input_read.read_csv_contents) is never held in memory.
+    :param csv_lines: Dictionaries of values from the lines of the input file
+    :param job_timestamp: Timestamp to identify the job which created the lines
+    :param db_session: DB session to add the data to
+    :param chunk_size: Number of lines sent with one COPY
+    :return: Number of lines added
+    """
+
+    started = monotonic()
+    timestamp_text = job_timestamp.isoformat()
+    cursor = db_session.connection().connection.cursor()
+    line_count = 0
+    chunk = StringIO()
+
+    def copy_chunk() -> None:
+        chunk.seek(0)
+        cursor.copy_expert(
+            "COPY source_csv (job_timestamp, almaid, csv_line) FROM STDIN",
+            chunk
+        )
+        chunk.seek(0)
+        chunk.truncate()
+
+    try:
+        for csv_line in csv_lines:
+            almaid = next(iter(csv_line.values()), None)
+            chunk.write(f"{timestamp_text}\t{_copy_text(almaid)}\t"
+                        f"{_copy_text(dumps(csv_line))}\n")
+            line_count += 1
+
+            if line_count % chunk_size == 0:
+                copy_chunk()
+
+        if chunk.tell():
+            copy_chunk()
+    finally:
+        cursor.close()
+
+    db_session.commit()
+
+    seconds = monotonic() - started
+    logger.info(f"Added {line_count} line(s) to source_csv in "
+                f"{seconds:.1f} s ({line_count / max(seconds, 1e-6):.0f} "
+                f"lines/s).")
+
+    return line_count
+
+
+def _copy_text(value: Optional[str]) -> str:
+    """
+    Value as per the text format of COPY.
+    """
+
+    if value is None:
+        return "\\N"
+
+    return value.replace("\\", "\\\\").replace("\t", "\\t") \
+        .replace("\n", "\\n").replace("\r", "\\r")
+
+
 def add_almaid_to_job_status_per_id(
         almaid: str,
         method: str,
@@ -163,3 +404,443 @@ def add_almaid_to_job_status_per_id(
     db_session.flush()
     db_session.refresh(line_for_table_job_status_per_id)
     return line_for_table_job_status_per_id.primary_key
+
+
+def add_almaids_to_job_status_per_id(
+        almaids: Iterable[str],
+        method: str,
+        job_timestamp: datetime,
+        db_session: Session) -> List[Tuple[str, str, int]]:
+    """
+    For several strings of Alma IDs create entries in job_status_per_id with
+    one INSERT ... RETURNING instead of one round trip each.
+    :param almaids: IDs of the records to be manipulated
+    :param method: GET, PUT, POST or DELETE
+    :param job_timestamp: Timestamp to identify the job which created the lines
+    :param db_session: DB session to add the data to
+    :return: Almaid, method and primary key of each added row, in no
+        particular order
+    """
+
+    status_rows = [
+        {
+            "job_timestamp": job_timestamp,
+            "almaid": str(almaid),
+            "job_status": "new",
+            "job_action": method,
+        }
+        for almaid in almaids
+    ]
+
+    if not status_rows:
+        return []
+
+    status_table = setup_db.JobStatusPerId.__table__
+
+    added_rows = db_session.execute(
+        insert(status_table).values(status_rows).returning(
+            status_table.c.almaid,
+            status_table.c.job_action,
+            status_table.c.primary_key
+        )
+    )
+    added_rows = [tuple(added_row) for added_row in added_rows]
+    db_session.commit()
+
+    return added_rows
+
+
+def add_job_metrics(
+        method: str,
+        record_count: int,
+        workers: int,
+        duration_seconds: float,
+        job_timestamp: datetime,
+        db_session: Session) -> None:
+    """
+    Add one line to job_metrics with the number of records handled by a job
+    and how long it took. Used for estimating the duration of future jobs.
+    :param method: GET, PUT, POST or DELETE
+    :param record_count: Number of records handled
+    :param workers: Number of records handled at the same time
+    :param duration_seconds: Duration of the job in seconds
+    :param job_timestamp: Timestamp to identify the job which created the line
+    :param db_session: DB session to add the data to
+    :return: None
+    """
+
+    line_for_table_job_metrics = setup_db.JobMetrics(
+        job_timestamp=job_timestamp,
+        job_action=method,
+        record_count=record_count,
+        workers=workers,
+        duration_seconds=duration_seconds
+    )
+
+    db_session.add(line_for_table_job_metrics)
+    db_session.commit()
+
+
+def add_job_lineage(
+        workflow_timestamp: datetime,
+        step_name: str,
+        job_timestamp: datetime,
+        parent_job_timestamp: Optional[datetime],
+        db_session: Session) -> None:
+    """
+    Add one line to job_lineage for a step of a workflow, so it is known
+    which job's results were the input of which job.
+    :param workflow_timestamp: Timestamp to identify the workflow
+    :param step_name: Name of the step within the workflow
+    :param job_timestamp: Timestamp of the step's job
+    :param parent_job_timestamp: Job the step's input came from, if any
+    :param db_session: DB session to add the data to
+    :return: None
+    """
+
+    line_for_table_job_lineage = setup_db.JobLineage(
+        workflow_timestamp=workflow_timestamp,
+        step_name=step_name,
+        job_timestamp=job_timestamp,
+        parent_job_timestamp=parent_job_timestamp
+    )
+
+    db_session.add(line_for_table_job_lineage)
+    db_session.commit()
+
+
+def claim_job_status_rows(
+        method: str,
+        job_timestamp: datetime,
+        lease_owner: str,
+        batch_size: int,
+        lease_seconds: int,
+        db_engine: Engine) -> List[Tuple[int, str]]:
+    """
+    Claim rows with status "new" of a job for one worker. Rows that are
+    claimed by another worker are skipped, unless the lease has expired
+    (e. g. because the worker crashed). Uses SELECT ... FOR UPDATE SKIP
+    LOCKED, so any number of workers can claim rows at the same time.
+    :param method: GET, PUT, POST or DELETE
+    :param job_timestamp: Timestamp to identify the job
+    :param lease_owner: Name of the worker claiming the rows
+    :param batch_size: Maximum number of rows to claim
+    :param lease_seconds: Seconds until other workers may claim the rows
+    :param db_engine: Engine for a connection with its own transaction
+    :return: List of primary key and almaid of all claimed rows
+    """
+
+    status_table = setup_db.JobStatusPerId.__table__
+    leases_table = setup_db.JobLeases.__table__
+
+    claimable_rows = select(
+        status_table.c.primary_key,
+        status_table.c.almaid
+    ).select_from(
+        status_table.outerjoin(
+            leases_table,
+            leases_table.c.status_key == status_table.c.primary_key
+        )
+    ).where(
+        status_table.c.job_timestamp == job_timestamp,
+        status_table.c.job_action == method,
+        status_table.c.job_status == "new",
+        or_(
+            leases_table.c.lease_expires.is_(None),
+            leases_table.c.lease_expires < func.now()
+        )
+    ).order_by(
+        status_table.c.primary_key
+    ).limit(
+        batch_size
+    ).with_for_update(
+        of=status_table, skip_locked=True
+    )
+
+    with db_engine.connect() as connection:
+        connection = connection.execution_options(
+            isolation_level="READ COMMITTED"
+        )
+        with connection.begin():
+            claimed_rows = connection.execute(claimable_rows).all()
+
+            if claimed_rows:
+                leases = insert(leases_table).values([
+                    {
+                        "status_key": primary_key,
+                        "lease_owner": lease_owner,
+                        "lease_expires":
+                            func.now() + timedelta(seconds=lease_seconds),
+                    }
+                    for primary_key, _ in claimed_rows
+                ])
+                connection.execute(
+                    leases.on_conflict_do_update(
+                        index_elements=[leases_table.c.status_key],
+                        set_={
+                            "lease_owner": leases.excluded.lease_owner,
+                            "lease_expires": leases.excluded.lease_expires,
+                        }
+                    )
+                )
+
+    return [(primary_key, almaid) for primary_key, almaid in claimed_rows]
+
+
+def release_job_status_rows(
+        primary_keys: Iterable[int],
+        db_session: Session) -> None:
+    """
+    Remove the leases of rows in job_status_per_id after a worker is done.
+    :param primary_keys: Primary keys of the rows in job_status_per_id
+    :param db_session: DB session to remove the leases with
+    :return: None
+    """
+
+    db_session.query(
+        setup_db.JobLeases
+    ).filter(
+        setup_db.JobLeases.status_key.in_(list(primary_keys))
+    ).delete(synchronize_session=False)
+
+    db_session.commit()
+
+
+def count_api_call(
+        limit_name: str,
+        max_calls: float,
+        db_engine: Engine) -> Optional[Tuple[int, int]]:
+    """
+    Count one API call for the current second as per the database's clock,
+    unless max_calls were already counted for it. Calls not admitted are
+    not counted, so callers waiting for the next second do not use up its
+    limit.
+    :param limit_name: Name of the limit, e. g. one per API key
+    :param max_calls: Maximum number of calls per second
+    :param db_engine: Engine to connect to
+    :return: Current second (since epoch) and the number of calls in it,
+        None if the call is not admitted
+    """
+
+    calls_table = setup_db.ApiCallCounts.__table__
+    epoch_second = cast(
+        func.floor(func.extract("epoch", func.clock_timestamp())),
+        BigInteger
+    )
+
+    call_count = insert(calls_table).values(
+        limit_name=limit_name,
+        epoch_second=epoch_second,
+        calls=1
+    )
+    call_count = call_count.on_conflict_do_update(
+        index_elements=[calls_table.c.limit_name, calls_table.c.epoch_second],
+        set_={"calls": calls_table.c.calls + 1},
+        where=calls_table.c.calls + 1 <= max_calls
+    ).returning(
+        calls_table.c.epoch_second,
+        calls_table.c.calls
+    )
+
+    with db_engine.connect() as connection:
+        counted_call = connection.execute(call_count).one_or_none()
+
+        if counted_call is None:
+            return None
+
+        current_second, calls = counted_call
+
+        if calls == 1:
+            connection.execute(
+                calls_table.delete().where(
+                    calls_table.c.limit_name == limit_name,
+                    calls_table.c.epoch_second < current_second - 60
+                )
+            )
+
+    return current_second, calls
+
+
+def set_daily_budget(
+        limit_name: str,
+        budget_day: Optional[date],
+        daily_calls: int,
+        db_session: Session) -> None:
+    """
+    Set the number of API calls all jobs sharing a limit may make in a day.
+    :param limit_name: Name of the limit, e. g. one per API key
+    :param budget_day: Day the budget is for, None for today as per the
+        database's clock
+    :param daily_calls: Number of API calls for the day
+    :param db_session: DB session to add the data to
+    :return: None
+    """
+
+    budgets_table = setup_db.DailyBudgets.__table__
+
+    if budget_day is None:
+        budget_day = func.current_date()
+
+    budget = insert(budgets_table).values(
+        limit_name=limit_name,
+        budget_day=budget_day,
+        daily_calls=daily_calls
+    )
+
+    db_session.execute(
+        budget.on_conflict_do_update(
+            index_elements=[budgets_table.c.limit_name,
+                            budgets_table.c.budget_day],
+            set_={"daily_calls": budget.excluded.daily_calls}
+        )
+    )
+    db_session.commit()
+
+
+def add_budget_share(
+        limit_name: str,
+        budget_day: Optional[date],
+        job_name: str,
+        priority: int,
+        weight: float,
+        reserved_calls: Optional[int],
+        db_session: Session) -> None:
+    """
+    Add or change the share of a job in the daily budget of a limit.
+    :param limit_name: Name of the limit, e. g. one per API key
+    :param budget_day: Day the share is for, None for today as per the
+        database's clock
+    :param job_name: Name of the job, unique for the limit and day
+    :param priority: Jobs with lower priority wait for those with higher
+    :param weight: Share of the calls per second compared to other jobs of
+        the same priority
+    :param reserved_calls: Calls of the daily budget only this job may use,
+        None to keep an existing reservation
+    :param db_session: DB session to add the data to
+    :return: None
+    """
+
+    shares_table = setup_db.BudgetShares.__table__
+    changes = {"priority": priority, "weight": weight}
+
+    if reserved_calls is not None:
+        changes["reserved_calls"] = reserved_calls
+
+    if budget_day is None:
+        budget_day = func.current_date()
+
+    share = insert(shares_table).values(
+        limit_name=limit_name,
+        budget_day=budget_day,
+        job_name=job_name,
+        priority=priority,
+        weight=weight,
+        reserved_calls=reserved_calls or 0,
+        calls_used=0
+    )
+
+    db_session.execute(
+        share.on_conflict_do_update(
+            index_elements=[shares_table.c.limit_name,
+                            shares_table.c.budget_day,
+                            shares_table.c.job_name],
+            set_=changes
+        )
+    )
+    db_session.commit()
+
+
+def use_budget_share(
+        limit_name: str,
+        job_name: str,
+        priority: int,
+        weight: float,
+        db_engine: Engine) -> bool:
+    """
+    Count one API call of a job against the daily budget of the current day
+    as per the database's clock. The call is allowed if the job has reserved
+    calls left or if there are calls left that no job reserved. The row of
+    the day in daily_budgets is locked, so processes count one at a time.
+    Days without a row in daily_budgets have no limit.
+    If the job has no share of the day yet (e. g. after midnight), it is
+    added with the job's priority and weight.
+    :param limit_name: Name of the limit, e. g. one per API key
+    :param job_name: Name of the job as in budget_shares
+    :param priority: Priority of the job, see add_budget_share
+    :param weight: Weight of the job, see add_budget_share
+    :param db_engine: Engine for a connection with its own transaction
+    :return: True if the call may be made, False if the budget is used up
+    """
+
+    budgets_table = setup_db.DailyBudgets.__table__
+    shares_table = setup_db.BudgetShares.__table__
+    today = func.current_date()
+
+    with db_engine.connect() as connection:
+        connection = connection.execution_options(
+            isolation_level="READ COMMITTED"
+        )
+        with connection.begin():
+            daily_calls = connection.execute(
+                select(budgets_table.c.daily_calls).where(
+                    budgets_table.c.limit_name == limit_name,
+                    budgets_table.c.budget_day == today
+                ).with_for_update()
+            ).scalar()
+
+            own_share = connection.execute(
+                select(
+                    shares_table.c.reserved_calls,
+                    shares_table.c.calls_used
+                ).where(
+                    shares_table.c.limit_name == limit_name,
+                    shares_table.c.budget_day == today,
+                    shares_table.c.job_name == job_name
+                )
+            ).one_or_none()
+
+            if own_share is None:
+                connection.execute(
+                    insert(shares_table).values(
+                        limit_name=limit_name,
+                        budget_day=today,
+                        job_name=job_name,
+                        priority=priority,
+                        weight=weight,
+                        reserved_calls=0,
+                        calls_used=0
+                    ).on_conflict_do_nothing()
+                )
+                reserved_calls, calls_used = 0, 0
+            else:
+                reserved_calls, calls_used = own_share
+
+            if daily_calls is not None and calls_used >= reserved_calls:
+                # reserved calls count as claimed, used or not
+                claimed_calls = connection.execute(
+                    select(
+                        func.coalesce(func.sum(func.greatest(
+                            shares_table.c.reserved_calls,
+                            shares_table.c.calls_used
+                        )), 0)
+                    ).where(
+                        shares_table.c.limit_name == limit_name,
+                        shares_table.c.budget_day == today
+                    )
+                ).scalar()
+
+                if claimed_calls >= daily_calls:
+                    return False
+
+            connection.execute(
+                shares_table.update().where(
+                    shares_table.c.limit_name == limit_name,
+                    shares_table.c.budget_day == today,
+                    shares_table.c.job_name == job_name
+                ).values(
+                    calls_used=shares_table.c.calls_used + 1,
+                    last_call=func.clock_timestamp()
+                )
+            )
+
+    return True
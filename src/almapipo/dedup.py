@@ -0,0 +1,146 @@
+"""Skip almaids that were handled before
+
+If the same CSV is run twice or a set overlaps a previous run, almaids that
+were already done do not need to be handled again. skip_done_almaids
+filters an iterable of almaids:
+* Almaids repeated within the input are only handed on once
+* Almaids with status "done" for the same action in any job since a given
+  time are skipped
+
+To keep memory low for long histories, the almaids done are loaded into a
+BloomFilter first. Only almaids the filter reports as (probably) done are
+looked up exactly in job_status_per_id, in batches.
+"""
+
+from datetime import datetime
+from hashlib import blake2b
+from logging import getLogger
+from math import log
+from typing import Iterable, Iterator, List
+
+from sqlalchemy.orm import Session
+
+from . import db_read
+
+# Logfile
+logger = getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    Set of strings that only answers "probably in it" or "surely not in it",
+    using about 1.2 bytes per item for an error_rate of 1 %.
+    :param capacity: Number of items expected
+    :param error_rate: Share of items wrongly reported as contained
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        if not 0 < error_rate < 1:
+            logger.error("Error rate needs to be between 0 and 1.")
+            raise ValueError
+
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * log(error_rate) / log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def add(self, item: str) -> None:
+        """
+        :param item: String to add to the filter
+        :return: None
+        """
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(item))
+
+    def _positions(self, item: str) -> Iterator[int]:
+        digest = blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+
+        return ((first + number * second) % self.size
+                for number in range(self.hash_count))
+
+
+def create_done_filter(
+        method: str,
+        done_since: datetime,
+        db_session: Session,
+        error_rate: float = 0.01) -> BloomFilter:
+    """
+    Load all almaids with status "done" for the method since done_since into
+    a BloomFilter.
+    :param method: "DELETE", "GET", "POST" or "PUT"
+    :param done_since: Only jobs with a job_timestamp since then count
+    :param db_session: SQLAlchemy session for DB connection
+    :param error_rate: See BloomFilter
+    :return: BloomFilter of the almaids done
+    """
+
+    done_filter = BloomFilter(
+        db_read.count_done_almaids(method, done_since, db_session),
+        error_rate
+    )
+
+    for almaid in db_read.get_done_almaids(method, done_since, db_session):
+        done_filter.add(almaid)
+
+    return done_filter
+
+
+def skip_done_almaids(
+        almaids: Iterable[str],
+        method: str,
+        done_since: datetime,
+        db_session: Session,
+        batch_size: int = 1000) -> Iterator[str]:
+    """
+    Hand on almaids only once and only if they were not done since
+    done_since, in the order of the input.
+    :param almaids: Iterable of almaids, e. g. a list or generator
+    :param method: "DELETE", "GET", "POST" or "PUT"
+    :param done_since: Only jobs with a job_timestamp since then count
+    :param db_session: SQLAlchemy session for DB connection
+    :param batch_size: Number of almaids looked up in the database at once
+    :return: Generator of almaids to handle
+    """
+
+    done_filter = create_done_filter(method, done_since, db_session)
+    seen = set()
+    batch = []
+    skipped_repeated = 0
+    skipped_done = 0
+
+    def handle_batch(almaid_batch: List[str]) -> Iterator[str]:
+        nonlocal skipped_done
+        candidates = [almaid for almaid in almaid_batch
+                      if almaid in done_filter]
+        done = db_read.get_done_almaids_among(
+            candidates, method, done_since, db_session
+        ) if candidates else set()
+        skipped_done += len(done)
+
+        for almaid in almaid_batch:
+            if almaid not in done:
+                yield almaid
+
+    for almaid in almaids:
+        if almaid in seen:
+            skipped_repeated += 1
+            continue
+
+        seen.add(almaid)
+        batch.append(almaid)
+
+        if len(batch) >= batch_size:
+            yield from handle_batch(batch)
+            batch = []
+
+    yield from handle_batch(batch)
+
+    logger.info(f"Skipped {skipped_repeated} repeated almaid(s) and "
+                f"{skipped_done} almaid(s) done for {method} since "
+                f"{done_since}.")
@@ -9,3 +9,7 @@ class ApiException(RequestException):
 
 class ThresholdException(ApiException):
     """One of the API's thresholds was exceeded."""
+
+
+class CanaryException(Exception):
+    """A staged job was aborted because of too many errors or mismatches."""
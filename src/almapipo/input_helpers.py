@@ -2,15 +2,23 @@
 Helper functions for handling csv/tsv inputs. Mostly writing to the dedicated
 db-table source_csv and creating a generator for almaids as per first column
 of the file.
+
+To look up other columns of a record (e.g. in manipulate_xml), use a
+CsvIndex (from CsvHelper.create_index or CsvIndex.from_source_csv) or, for
+very large files, a MmapCsvIndex instead of one query per record via
+db_read.get_value_from_source_csv. Both are built once, are read-only
+afterwards and can be shared by threads and handed to processes.
 """
 
+import csv
 from datetime import datetime
 from logging import getLogger
-from typing import Iterable
+from mmap import ACCESS_READ, mmap
+from typing import Iterable, List, Optional
 
 from sqlalchemy.orm import Session
 
-from almapipo import db_write, input_read
+from almapipo import db_read, db_write, input_read
 
 logger = getLogger(__name__)
 
@@ -41,6 +49,13 @@ class CsvHelper:
         for csv_line in self.csv_line_list:
             yield list(csv_line.values())[0]
 
+    def create_index(self) -> "CsvIndex":
+        """
+        Index of the lines by almaid (first column).
+        :return: CsvIndex of all lines
+        """
+        return CsvIndex(self.csv_line_list)
+
     def add_to_source_csv_table(
             self,
             job_timestamp: datetime,
@@ -51,9 +66,181 @@ class CsvHelper:
         File existence check is done within almapipo.input_read.
         :param job_timestamp: Timestamp as set in almapipo.almapipo
         :param db_session: SQLAlchemy Session
-        :return: Generator of Alma IDs
+        :return: Number of lines added
         """
-        for csv_line in self.csv_line_list:
-            db_write.add_csv_line_to_source_csv_table(
-                csv_line, job_timestamp, db_session
-            )
+        return db_write.copy_csv_lines_to_source_csv(
+            self.csv_line_list, job_timestamp, db_session
+        )
+
+
+def import_csv_to_source_csv(
+        csv_path: str,
+        job_timestamp: datetime,
+        db_session: Session,
+        validation: bool = False,
+        chunk_size: int = 10000) -> int:
+    """
+    Import a csv or tsv file to the table source_csv line by line as it is
+    read, without keeping the file in memory. Use this for very large files
+    that would not fit into a CsvHelper.
+    :param csv_path: Path to the CSV file to be imported
+    :param job_timestamp: Timestamp as set in almapipo.almapipo
+    :param db_session: SQLAlchemy Session
+    :param validation: Check ID structure of first column, default is False
+    :param chunk_size: Number of lines sent to the database at once
+    :return: Number of lines added
+    """
+    return db_write.copy_csv_lines_to_source_csv(
+        input_read.read_csv_contents(csv_path, validation), job_timestamp,
+        db_session, chunk_size
+    )
+
+
+class CsvIndex:
+    """
+    Read-only lookup of csv lines by the almaid in their first column. If an
+    almaid is in several lines, the first one counts.
+    :param csv_lines: Lines as dictionaries, e.g. as per
+        input_read.read_csv_contents
+    """
+
+    def __init__(self, csv_lines: Iterable[dict]):
+        self._lines = {}
+
+        for csv_line in csv_lines:
+            self._lines.setdefault(next(iter(csv_line.values())), csv_line)
+
+    @classmethod
+    def from_source_csv(
+            cls,
+            job_timestamp: datetime,
+            db_session: Session) -> "CsvIndex":
+        """
+        Index of the lines a job saved in the table source_csv.
+        :param job_timestamp: Job that created the entries in source_csv
+        :param db_session: SQLAlchemy Session
+        :return: CsvIndex of all lines of the job
+        """
+        csv_index = cls([])
+
+        for almaid, csv_line in db_read.get_source_csv_rows(
+                job_timestamp, db_session):
+            csv_index._lines.setdefault(almaid, csv_line)
+
+        return csv_index
+
+    def get_line(self, almaid: str) -> Optional[dict]:
+        """
+        :param almaid: Value of the first column
+        :return: Whole line as dictionary, None if there is no such line
+        """
+        return self._lines.get(str(almaid))
+
+    def get_value(self, almaid: str, column: str) -> str:
+        """
+        :param almaid: Value of the first column
+        :param column: Heading of the column with the desired information
+        :return: Value of the column, raises KeyError if there is no line
+            for the almaid or no such column
+        """
+        return self._lines[str(almaid)][column]
+
+    def __contains__(self, almaid: str) -> bool:
+        return str(almaid) in self._lines
+
+    def __len__(self) -> int:
+        return len(self._lines)
+
+
+class MmapCsvIndex:
+    """
+    Read-only lookup of csv lines by the almaid in their first column for
+    files too large to keep in memory. Only the offset of each line is kept,
+    lines are read from the memory-mapped file when looked up. Values must
+    not contain line breaks. If an almaid is in several lines, the first one
+    counts. When handed to another process the file is mapped again there.
+    :param csv_path: Path to the csv or tsv file
+    """
+
+    def __init__(self, csv_path: str):
+        if not input_read.check_file_path(csv_path):
+            logger.error("No valid file path provided.")
+            raise ValueError
+
+        self.csv_path = csv_path
+        self._delimiter = input_read.get_delimiter(csv_path)
+        self._open()
+
+        self._mmap.seek(0)
+        self._header = self._parse(self._mmap.readline())
+        self._offsets = {}
+
+        while True:
+            offset = self._mmap.tell()
+            line = self._mmap.readline()
+            if not line:
+                break
+            fields = self._parse(line)
+            if fields:
+                self._offsets.setdefault(fields[0], offset)
+
+        logger.info(f"Indexed {len(self._offsets)} lines of {csv_path}.")
+
+    def get_line(self, almaid: str) -> Optional[dict]:
+        """
+        :param almaid: Value of the first column
+        :return: Whole line as dictionary, None if there is no such line
+        """
+        offset = self._offsets.get(str(almaid))
+
+        if offset is None:
+            return None
+
+        end = self._mmap.find(b"\n", offset)
+        line = self._mmap[offset:end if end != -1 else len(self._mmap)]
+
+        return dict(zip(self._header, self._parse(line)))
+
+    def get_value(self, almaid: str, column: str) -> str:
+        """
+        :param almaid: Value of the first column
+        :param column: Heading of the column with the desired information
+        :return: Value of the column, raises KeyError if there is no line
+            for the almaid or no such column
+        """
+        csv_line = self.get_line(almaid)
+
+        if csv_line is None:
+            raise KeyError(almaid)
+
+        return csv_line[column]
+
+    def close(self) -> None:
+        """
+        Unmap the file.
+        :return: None
+        """
+        self._mmap.close()
+
+    def __contains__(self, almaid: str) -> bool:
+        return str(almaid) in self._offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["_mmap"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._open()
+
+    def _open(self) -> None:
+        with open(self.csv_path, "rb") as csv_file:
+            self._mmap = mmap(csv_file.fileno(), 0, access=ACCESS_READ)
+
+    def _parse(self, line: bytes) -> List[str]:
+        text = line.decode("utf-8-sig").rstrip("\r\n")
+        return next(csv.reader([text], delimiter=self._delimiter), [])
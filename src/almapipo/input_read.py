@@ -41,14 +41,7 @@ def read_csv_contents(
         logger.error("No valid file path provided.")
         raise ValueError
 
-    if csv_path[-4:] in [".csv", ".CSV"]:
-        delimit = ";"
-    elif csv_path[-4:] in [".tsv", ".TSV"]:
-        delimit = "\t"
-    else:
-        logger.error(f"Extension of the given file not expected (csv for"
-                     f" semicolon, tsv for tabs).")
-        raise ValueError
+    delimit = get_delimiter(csv_path)
 
     with open(csv_path, newline="") as csv_file:
 
@@ -66,6 +59,22 @@ def read_csv_contents(
                 logger.warning(f"The following row was discarded: {row}")
 
 
+def get_delimiter(csv_path: str) -> str:
+    """
+    :param csv_path: Relative or absolute path to a csv or tsv file
+    :return: Semicolon for csv, tab for tsv, raises ValueError otherwise
+    """
+
+    if csv_path[-4:] in [".csv", ".CSV"]:
+        return ";"
+    if csv_path[-4:] in [".tsv", ".TSV"]:
+        return "\t"
+
+    logger.error(f"Extension of the given file not expected (csv for"
+                 f" semicolon, tsv for tabs).")
+    raise ValueError
+
+
 def check_file_path(file_path: str) -> bool:
     """
     Checks file path for existence, readability and whether the file is
@@ -0,0 +1,297 @@
+"""Staged processing with bounded queues
+
+Items are handed through a chain of stages. Each stage has its own number of
+worker threads and reads from its own bounded queue, so a slow stage (e.g.
+waiting for the API) does not keep a fast stage (e.g. XML manipulation) from
+working on the next items, while the bounded queues keep memory usage flat.
+
+For tuning, every stage keeps track of its queue depth, the number of items
+processed and its throughput. These are logged periodically while the
+pipeline runs and can be retrieved via Pipeline.stats().
+
+CPU-bound stages can hand their work to a pool of processes, see
+create_process_pool.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+from math import ceil
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Callable, Dict, Iterable, List, Sequence
+
+# Logfile
+logger = getLogger(__name__)
+
+# Marks the end of the input for one worker of a stage
+_END_OF_INPUT = object()
+
+
+class Stage:
+    """
+    One step of a pipeline with its own worker threads and input queue.
+    The function is called with one item and returns the item to be handed
+    over to the next stage. If it returns None, the item leaves the pipeline.
+    With batch_size > 1 the function is called with a list of up to
+    batch_size items and has to return a list.
+    :param name: Name of the stage, used for logging and stats
+    :param function: Function to call for each item (or batch of items)
+    :param workers: Number of threads working on this stage
+    :param queue_size: Maximum number of items waiting for this stage
+    :param batch_size: Number of items handed to the function at once
+    """
+
+    def __init__(
+            self,
+            name: str,
+            function: Callable,
+            workers: int = 1,
+            queue_size: int = 100,
+            batch_size: int = 1):
+        if workers < 1 or queue_size < 1 or batch_size < 1:
+            logger.error(f"Stage {name} needs at least one worker, a queue "
+                         f"size of at least one and a batch size of at "
+                         f"least one.")
+            raise ValueError
+
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue = Queue(maxsize=queue_size)
+        self.processed = 0
+        self.busy_seconds = 0.0
+        self.started = None
+        self._lock = Lock()
+
+    def stats(self) -> dict:
+        """
+        Current state of the stage.
+        :return: Dictionary with queue_depth, processed and per_second
+        """
+        with self._lock:
+            processed = self.processed
+            busy_seconds = self.busy_seconds
+
+        elapsed = monotonic() - self.started if self.started else 0.0
+
+        return {
+            "workers": self.workers,
+            "queue_depth": self.queue.qsize(),
+            "processed": processed,
+            "busy_seconds": round(busy_seconds, 3),
+            "per_second": round(processed / elapsed, 3) if elapsed else 0.0,
+        }
+
+    def _take_batch(self) -> List:
+        """
+        Wait for the next item and add any items that are already waiting,
+        up to batch_size.
+        :return: List of items, possibly ending with _END_OF_INPUT
+        """
+        batch = [self.queue.get()]
+
+        while len(batch) < self.batch_size \
+                and batch[-1] is not _END_OF_INPUT:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+
+        return batch
+
+    def _process(self, batch: List) -> List:
+        start = monotonic()
+
+        if self.batch_size > 1:
+            results = list(self.function(batch))
+        else:
+            results = [self.function(batch[0])]
+
+        with self._lock:
+            self.processed += len(batch)
+            self.busy_seconds += monotonic() - start
+
+        return [result for result in results if result is not None]
+
+
+class Pipeline:
+    """
+    Chain of stages joined by bounded queues. Every item put into the
+    pipeline passes the stages in the given order.
+
+    If a stage raises an exception no more items are fed into the pipeline,
+    the items already inside are finished and the first exception is raised
+    again by run().
+    :param stages: Stages in the order items pass through them
+    :param stats_interval: Seconds between two log entries of the stats
+    """
+
+    def __init__(self, stages: List[Stage], stats_interval: float = 60):
+        if not stages:
+            logger.error("A pipeline needs at least one stage.")
+            raise ValueError
+
+        self.stages = stages
+        self.stats_interval = stats_interval
+        self._abort = Event()
+        self._finished = Event()
+        self._error = None
+        self._error_lock = Lock()
+        self._workers_left = {stage.name: stage.workers for stage in stages}
+
+    def run(self, items: Iterable) -> None:
+        """
+        Feed all items into the pipeline and wait for all stages to finish.
+        :param items: Iterable of items, e. g. a generator of almaids
+        :return: None
+        """
+        threads = []
+        started = monotonic()
+
+        for index, stage in enumerate(self.stages):
+            stage.started = started
+            for number in range(stage.workers):
+                thread = Thread(
+                    target=self._work,
+                    args=(index,),
+                    name=f"{stage.name}_{number}",
+                    daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+
+        monitor = Thread(target=self._monitor, name="pipeline_stats",
+                         daemon=True)
+        monitor.start()
+
+        first_stage = self.stages[0]
+
+        try:
+            for item in items:
+                if self._abort.is_set():
+                    logger.warning("Pipeline was aborted. No more items will "
+                                   "be added.")
+                    break
+                first_stage.queue.put(item)
+        finally:
+            for _ in range(first_stage.workers):
+                first_stage.queue.put(_END_OF_INPUT)
+
+            for thread in threads:
+                thread.join()
+
+            self._finished.set()
+            monitor.join()
+            self.log_stats()
+
+        if self._error:
+            raise self._error
+
+    def stats(self) -> Dict[str, dict]:
+        """
+        Queue depth, items processed and throughput for all stages.
+        :return: Dictionary with the stage names as keys
+        """
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    def log_stats(self) -> None:
+        """
+        Add the current stats of all stages to the logfile.
+        :return: None
+        """
+        for name, stage_stats in self.stats().items():
+            logger.info(f"Stage {name}: {stage_stats}")
+
+    def _work(self, index: int) -> None:
+        stage = self.stages[index]
+        next_stage = None
+
+        if index + 1 < len(self.stages):
+            next_stage = self.stages[index + 1]
+
+        while True:
+            batch = stage._take_batch()
+            end_of_input = batch[-1] is _END_OF_INPUT
+
+            if end_of_input:
+                batch = batch[:-1]
+
+            if batch:
+                try:
+                    results = stage._process(batch)
+                except Exception as error:
+                    self._set_error(stage, error)
+                    results = []
+
+                if next_stage:
+                    for result in results:
+                        next_stage.queue.put(result)
+
+            if end_of_input:
+                break
+
+        self._finish_worker(stage, next_stage)
+
+    def _finish_worker(self, stage: Stage, next_stage: Stage) -> None:
+        with self._error_lock:
+            self._workers_left[stage.name] -= 1
+            last_worker = self._workers_left[stage.name] == 0
+
+        if last_worker and next_stage:
+            for _ in range(next_stage.workers):
+                next_stage.queue.put(_END_OF_INPUT)
+
+    def _set_error(self, stage: Stage, error: Exception) -> None:
+        logger.error(f"Stage {stage.name} failed: {error!r}")
+
+        with self._error_lock:
+            if not self._error:
+                self._error = error
+
+        self._abort.set()
+
+    def _monitor(self) -> None:
+        while not self._finished.wait(self.stats_interval):
+            self.log_stats()
+
+
+def create_process_pool(processes: int) -> ProcessPoolExecutor:
+    """
+    Create a pool of processes and make sure all of them are started, so the
+    first items do not have to wait for processes being spawned.
+    :param processes: Number of processes, e. g. os.cpu_count()
+    :return: ProcessPoolExecutor with all processes running
+    """
+    logger.info(f"Starting pool of {processes} processes.")
+
+    process_pool = ProcessPoolExecutor(max_workers=processes)
+    list(process_pool.map(_warm_up, range(processes)))
+
+    return process_pool
+
+
+def map_in_process_pool(
+        process_pool: ProcessPoolExecutor,
+        processes: int,
+        function: Callable,
+        *iterables: Sequence) -> List:
+    """
+    Like map, but run in the process pool. The items are sent to the
+    processes in chunks, so there is only one round of pickling per process
+    and not one per item. The function needs to be picklable, so it has to be
+    defined on module level (or be a functools.partial of such a function).
+    :param process_pool: Pool as created by create_process_pool
+    :param processes: Number of processes in the pool
+    :param function: Function to call for each item
+    :param iterables: Sequences of arguments, as for map
+    :return: List of results in the order of the input
+    """
+    chunksize = max(1, ceil(len(iterables[0]) / processes))
+
+    return list(process_pool.map(function, *iterables, chunksize=chunksize))
+
+
+def _warm_up(number: int) -> int:
+    return number
@@ -0,0 +1,154 @@
+"""Plan jobs before making any changes
+
+Estimate how many API calls a job will need and how long it will take,
+without making any calls that change data in Alma:
+* Count the input (almaids or members of a set)
+* Apply the number of calls per record for the method (GET before
+  PUT/DELETE)
+* Compare with the number of calls remaining for today
+* Estimate the duration from previous jobs as saved in job_metrics
+"""
+
+from logging import getLogger
+from math import ceil
+from typing import Iterable, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from . import config, db_read, rest_conf, setup_rest
+
+# Logfile
+logger = getLogger(__name__)
+
+# Every call other than POST is preceded by a GET for the backup
+CALLS_PER_RECORD = {"DELETE": 2, "GET": 1, "POST": 1, "PUT": 2}
+
+
+class JobPlan(NamedTuple):
+    """Result of planning a job, see plan_job_for_list."""
+    method: str
+    record_count: int
+    api_calls: int
+    calls_remaining: Optional[int]
+    fits_threshold: Optional[bool]
+    workers: int
+    seconds_per_record: Optional[float]
+    estimated_seconds: Optional[float]
+
+
+def plan_job_for_list(
+        almaids: Iterable[str],
+        method: str,
+        db_session: Session,
+        workers: int = 1,
+        check_threshold: bool = True,
+        additional_calls: int = 0,
+        job_context: config.JobContext = None) -> JobPlan:
+    """
+    Plan a job as it would be done by almapipo.call_api_for_list. Note that
+    a generator of almaids is used up by this, so create a new one for the
+    actual job.
+    :param almaids: Iterable of almaids, e. g. a list or generator
+    :param method: "DELETE", "GET", "POST" or "PUT"
+    :param db_session: SQLAlchemy session for reading previous jobs
+    :param workers: Number of records that will be handled at the same time
+    :param check_threshold: Make one GET call to check the remaining calls
+    :param additional_calls: Calls needed for the input, e. g. for sets
+    :param job_context: Institution to check the threshold for
+    :return: JobPlan with number of calls and estimated duration
+    """
+
+    if method not in CALLS_PER_RECORD:
+        logger.error(f"Provided method {method} not known.")
+        raise ValueError
+
+    record_count = sum(1 for _ in almaids)
+    api_calls = record_count * CALLS_PER_RECORD[method] + additional_calls
+
+    calls_remaining = None
+    fits_threshold = None
+
+    if check_threshold:
+        remaining = setup_rest.test_calls_remaining_today(job_context)
+        if remaining is not None:
+            calls_remaining = int(remaining)
+            fits_threshold = api_calls <= calls_remaining
+
+    seconds_per_record = db_read.get_seconds_per_record(method, db_session)
+    estimated_seconds = None
+
+    if seconds_per_record is not None:
+        estimated_seconds = record_count * seconds_per_record / workers
+
+    job_plan = JobPlan(
+        method, record_count, api_calls, calls_remaining, fits_threshold,
+        workers, seconds_per_record, estimated_seconds
+    )
+    log_job_plan(job_plan)
+
+    return job_plan
+
+
+def plan_job_for_alma_set(
+        set_id: str,
+        method: str,
+        db_session: Session,
+        workers: int = 1,
+        check_threshold: bool = True,
+        job_context: config.JobContext = None) -> JobPlan:
+    """
+    Plan a job as it would be done by almapipo.call_api_for_alma_set. The
+    number of records is taken from the set's total_record_count, which
+    needs one GET call.
+    :param set_id: In the Alma UI go to "Set Details" and look for "Set ID"
+    :param method: "DELETE", "GET", "POST" or "PUT"
+    :param db_session: SQLAlchemy session for reading previous jobs
+    :param workers: Number of records that will be handled at the same time
+    :param check_threshold: Make one GET call to check the remaining calls
+    :param job_context: Institution to make the calls for
+    :return: JobPlan with number of calls and estimated duration
+    """
+
+    record_count = rest_conf.retrieve_set_total_record_count(
+        set_id, job_context
+    )
+
+    if record_count is None:
+        logger.error(f"Could not retrieve number of members for set "
+                     f"{set_id}.")
+        raise ValueError
+
+    # retrieving the members takes one call for the count and one per 100
+    set_calls = 1 + record_count // 100 + 1
+
+    return plan_job_for_list(
+        range(record_count), method, db_session, workers, check_threshold,
+        set_calls, job_context
+    )
+
+
+def log_job_plan(job_plan: JobPlan) -> None:
+    """
+    Add the plan of a job to the logfile.
+    :param job_plan: JobPlan as returned by plan_job_for_list
+    :return: None
+    """
+
+    logger.info(f"Job with {job_plan.method} for {job_plan.record_count} "
+                f"record(s) needs {job_plan.api_calls} API calls.")
+
+    if job_plan.calls_remaining is None:
+        logger.info("Number of calls remaining for today is unknown.")
+    elif job_plan.fits_threshold:
+        logger.info(f"{job_plan.calls_remaining} calls are remaining for "
+                    f"today, the job fits the daily threshold.")
+    else:
+        logger.warning(f"Only {job_plan.calls_remaining} calls are remaining "
+                       f"for today, the job exceeds the daily threshold.")
+
+    if job_plan.estimated_seconds is None:
+        logger.info(f"No previous jobs with {job_plan.method} to estimate "
+                    f"the duration from.")
+    else:
+        logger.info(f"Estimated duration with {job_plan.workers} worker(s): "
+                    f"{ceil(job_plan.estimated_seconds)} seconds.")
@@ -0,0 +1,91 @@
+"""Limit the number of API calls per second
+
+Alma limits the number of API calls per second for each institution. To stay
+below that limit, set setup_rest.rate_limiter (or the rate_limiter of a
+config.JobContext) to one of the following:
+* RateLimiter for the calls made by one process
+* DbRateLimiter for calls made by any number of processes on any number of
+  hosts, counted in the database
+* scheduler.FairShareLimiter for jobs sharing the calls per second and a
+  daily budget by priority and weight
+"""
+
+from logging import getLogger
+from threading import Lock
+from time import monotonic, sleep, time
+
+from sqlalchemy.engine import Engine
+
+from . import db_write
+
+# Logfile
+logger = getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Spread calls evenly so there are no more than calls_per_second calls
+    per second within this process. Thread-safe.
+    :param calls_per_second: Maximum number of calls per second
+    """
+
+    def __init__(self, calls_per_second: float):
+        if calls_per_second <= 0:
+            logger.error("Calls per second need to be more than zero.")
+            raise ValueError
+
+        self.calls_per_second = calls_per_second
+        self._interval = 1 / calls_per_second
+        self._next_call = monotonic()
+        self._lock = Lock()
+
+    def acquire(self) -> None:
+        """
+        Wait until the next call is allowed.
+        :return: None
+        """
+        with self._lock:
+            now = monotonic()
+            wait_seconds = self._next_call - now
+            self._next_call = max(self._next_call, now) + self._interval
+
+        if wait_seconds > 0:
+            sleep(wait_seconds)
+
+
+class DbRateLimiter:
+    """
+    Allow no more than calls_per_second calls per second for all processes
+    using the same limit_name and database. Every call admitted is counted
+    in the table api_call_counts as per the database's clock.
+    :param calls_per_second: Maximum number of calls per second
+    :param db_engine: Engine to connect to the database
+    :param limit_name: Name of the limit, e. g. one per API key
+    """
+
+    def __init__(
+            self,
+            calls_per_second: int,
+            db_engine: Engine,
+            limit_name: str = "alma"):
+        if calls_per_second <= 0:
+            logger.error("Calls per second need to be more than zero.")
+            raise ValueError
+
+        self.calls_per_second = calls_per_second
+        self.db_engine = db_engine
+        self.limit_name = limit_name
+
+    def acquire(self) -> None:
+        """
+        Wait until the next call is allowed.
+        :return: None
+        """
+        while True:
+            if db_write.count_api_call(
+                    self.limit_name, self.calls_per_second, self.db_engine):
+                return
+
+            logger.debug(f"Limit {self.limit_name} reached, waiting for the "
+                         f"next second.")
+            sleep(1 - time() % 1)
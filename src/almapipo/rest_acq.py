@@ -4,7 +4,7 @@ Query the Alma API for vendors
 
 from logging import getLogger
 
-from . import setup_rest
+from . import config, setup_rest
 
 # Logfile
 logger = getLogger(__name__)
@@ -14,12 +14,13 @@ class VendorsApi(setup_rest.GenericApi):
     """
     Make calls for acq records.
     """
-    def __init__(self):
+    def __init__(self, job_context: config.JobContext = None):
         """
         Initialize API calls for bibliographic records.
+        :param job_context: Context to make the calls for, defaults to env vars
         """
         base_path = "/acq/vendors/"
 
-        logger.info(f"Instantiating {type(self).__name__}.")
+        logger.debug(f"Instantiating {type(self).__name__}.")
 
-        super().__init__(base_path)
+        super().__init__(base_path, job_context)
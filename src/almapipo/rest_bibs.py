@@ -6,7 +6,7 @@ See https://developers.exlibrisgroup.com/console/?url=/wp-content/uploads/alma/o
 from logging import getLogger
 from urllib import parse
 
-from . import setup_rest
+from . import config, setup_rest
 
 # Logfile
 logger = getLogger(__name__)
@@ -16,15 +16,16 @@ class BibsApi(setup_rest.GenericApi):
     """
     Make calls for bibliographic records. Here the record_id is the MMS ID.
     """
-    def __init__(self):
+    def __init__(self, job_context: config.JobContext = None):
         """
         Initialize API calls for bibliographic records.
+        :param job_context: Context to make the calls for, defaults to env vars
         """
         base_path = "/bibs/"
 
-        logger.info(f"Instantiating {type(self).__name__}.")
+        logger.debug(f"Instantiating {type(self).__name__}.")
 
-        super().__init__(base_path)
+        super().__init__(base_path, job_context)
 
     def retrieve_bib_by_query(self, url_parameters: dict) -> str:
         """
@@ -114,19 +115,23 @@ class HoldingsApi(setup_rest.GenericApi):
     """
     Make calls for holding records. Here the record_id is the Holding PID.
     """
-    def __init__(self, mms_id: str):
+    def __init__(
+            self,
+            mms_id: str,
+            job_context: config.JobContext = None):
         """
         Initialize API calls for holdings connected to a bibliographic record.
         :param mms_id: Unique ID of BIB record the holdings are connected to
+        :param job_context: Context to make the calls for, defaults to env vars
         """
         self.mms_id = mms_id
 
         base_path = f"/bibs/{self.mms_id}/holdings/"
 
-        logger.info(f"Instantiating {type(self).__name__} with mms_id "
-                    f"{self.mms_id}.")
+        logger.debug(f"Instantiating {type(self).__name__} with mms_id "
+                     f"{self.mms_id}.")
 
-        super().__init__(base_path)
+        super().__init__(base_path, job_context)
 
     def retrieve_all_items(self, hol_id: str) -> str:
         """
@@ -146,40 +151,49 @@ class ItemsApi(setup_rest.GenericApi):
     """
     Make calls for item records. Here the record_id is the Item PID.
     """
-    def __init__(self, mms_id: str, hol_id: str):
+    def __init__(
+            self,
+            mms_id: str,
+            hol_id: str,
+            job_context: config.JobContext = None):
         """
         Initialize API calls for items connected to a bibliographic record.
         :param mms_id: MMS ID of bibliographic record the item is connected to
         :param hol_id: Holding PID of the holding the item is connected to
+        :param job_context: Context to make the calls for, defaults to env vars
         """
         self.mms_id = mms_id
         self.hol_id = hol_id
 
         base_path = f"/bibs/{self.mms_id}/holdings/{self.hol_id}/items/"
 
-        logger.info(f"Instantiating {type(self).__name__} with mms_id "
-                    f"{self.mms_id} and hol_id {self.hol_id}.")
+        logger.debug(f"Instantiating {type(self).__name__} with mms_id "
+                     f"{self.mms_id} and hol_id {self.hol_id}.")
 
-        super().__init__(base_path)
+        super().__init__(base_path, job_context)
 
 
 class PortfoliosApi(setup_rest.GenericApi):
     """
     Make calls for portfolio records. Here the record_id is the Portfolio PID.
     """
-    def __init__(self, mms_id: str):
+    def __init__(
+            self,
+            mms_id: str,
+            job_context: config.JobContext = None):
         """
         Initialize API calls for portfolios connected to a BIB record.
         :param mms_id: ID of BIB record the portfolio is connected to
+        :param job_context: Context to make the calls for, defaults to env vars
         """
         self.mms_id = mms_id
 
         base_path = f"/bibs/{self.mms_id}/portfolios/"
 
-        logger.info(f"Instantiating {type(self).__name__} with mms_id "
-                    f"{self.mms_id}.")
+        logger.debug(f"Instantiating {type(self).__name__} with mms_id "
+                     f"{self.mms_id}.")
 
-        super().__init__(base_path)
+        super().__init__(base_path, job_context)
 
 
 # Not strictly part of the bibs API, but definitely related to it.
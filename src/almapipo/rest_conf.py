@@ -8,7 +8,7 @@ from logging import getLogger
 from typing import Iterable
 from xml.etree.ElementTree import fromstring, tostring
 
-from . import setup_rest
+from . import config, setup_rest
 
 # Logfile
 logger = getLogger(__name__)
@@ -86,7 +86,9 @@ def retrieve_locations(library: str, lang: str = None) -> str:
     return locations_record
 
 
-def retrieve_set_member_almaids(set_id: str) -> Iterable[str]:
+def retrieve_set_member_almaids(
+        set_id: str,
+        job_context: config.JobContext = None) -> Iterable[str]:
     """
     For a given set retrieve the almaid for all members from their link
     attribute. If the link is not available, this function will return
@@ -100,6 +102,7 @@ def retrieve_set_member_almaids(set_id: str) -> Iterable[str]:
     this function must return a comma-separated string of those three IDs!
 
     :param set_id: Set ID as given in Set Details in the Alma UI
+    :param job_context: Context to make the calls for, defaults to env vars
     :return: Generator of almaid
     """
 
@@ -108,15 +111,16 @@ def retrieve_set_member_almaids(set_id: str) -> Iterable[str]:
     re_prefix = r"^/?\w+/"
     regex_path = r"/\w+/"
     has_url = False
+    _, context_base_url, _ = setup_rest.resolve_context(job_context)
 
-    member_urls_and_ids = retrieve_set_member_link_and_id(set_id)
+    member_urls_and_ids = retrieve_set_member_link_and_id(set_id, job_context)
 
     for member_url, member_id in member_urls_and_ids:
 
         if member_url:
 
             has_url = True
-            member_url_path = member_url.replace(setup_rest.api_base_url, "")
+            member_url_path = member_url.replace(context_base_url, "")
 
             if member_url == member_url_path:
                 logger.error(f"Could not remove base_url as per env var from "
@@ -137,16 +141,19 @@ def retrieve_set_member_almaids(set_id: str) -> Iterable[str]:
                     "yields member/id instead.")
 
 
-def retrieve_set_member_link_and_id(set_id: str) -> Iterable[Iterable[str]]:
+def retrieve_set_member_link_and_id(
+        set_id: str,
+        job_context: config.JobContext = None) -> Iterable[Iterable[str]]:
     """
     For a given set retrieve the URLs and IDs for all members.
     :param set_id: Set ID as given in Set Details in the Alma UI
+    :param job_context: Context to make the calls for, defaults to env vars
     :return: Generator of list of two values: member/@link and member/id/text()
     """
 
     logger.info(f"Trying to fetch URLs for all members of {set_id}.")
 
-    num_members = retrieve_set_total_record_count(set_id)
+    num_members = retrieve_set_total_record_count(set_id, job_context)
 
     api_url_path = f"/conf/sets/{set_id}/members"
     api_url_parameters = {"limit": 100}
@@ -156,7 +163,9 @@ def retrieve_set_member_link_and_id(set_id: str) -> Iterable[Iterable[str]]:
         api_url_parameters["offset"] = page * 100
         api_url = setup_rest.add_parameters(api_url_path, api_url_parameters)
 
-        set_response = setup_rest.call_api(api_url, "GET", 200)
+        set_response = setup_rest.call_api(
+            api_url, "GET", 200, job_context=job_context
+        )
         set_response_xml = fromstring(set_response)
 
         for member in set_response_xml.findall("member"):
@@ -169,17 +178,21 @@ def retrieve_set_member_link_and_id(set_id: str) -> Iterable[Iterable[str]]:
             yield [link, member.find("id").text]
 
 
-def retrieve_set_total_record_count(set_id: str) -> int:
+def retrieve_set_total_record_count(
+        set_id: str,
+        job_context: config.JobContext = None) -> int:
     """
     For a given Set retrieve the number of members in the set.
     :param set_id: Set ID as given in Set Details in the Alma UI
+    :param job_context: Context to make the calls for, defaults to env vars
     :return: Number of members as int (total_record_count)
     """
 
     logger.info(f"Trying to fetch number of members for set {set_id}.")
 
     members_in_set = setup_rest.call_api(
-        f"/conf/sets/{set_id}/members?limit=1", "GET", 200
+        f"/conf/sets/{set_id}/members?limit=1", "GET", 200,
+        job_context=job_context
     )
     try:
         response_xml = fromstring(members_in_set)
@@ -5,7 +5,7 @@ See https://developers.exlibrisgroup.com/console/?url=/wp-content/uploads/alma/o
 
 from logging import getLogger
 
-from . import setup_rest
+from . import config, setup_rest
 
 # Logfile
 logger = getLogger(__name__)
@@ -15,33 +15,38 @@ class EcollectionsApi(setup_rest.GenericApi):
     """
     Make API calls for e-collections.
     """
-    def __init__(self):
+    def __init__(self, job_context: config.JobContext = None):
         """
         Initialize API for e-collections.
+        :param job_context: Context to make the calls for, defaults to env vars
         """
         base_path = "/electronic/e-collections/"
 
-        logger.info(f"Instantiating {type(self).__name__}.")
+        logger.debug(f"Instantiating {type(self).__name__}.")
 
-        super().__init__(base_path)
+        super().__init__(base_path, job_context)
 
 
 class EservicesApi(setup_rest.GenericApi):
     """
     Make API calls for e-services.
     """
-    def __init__(self, collection_id: str):
+    def __init__(
+            self,
+            collection_id: str,
+            job_context: config.JobContext = None):
         """
         Initialize API for e-collections.
+        :param job_context: Context to make the calls for, defaults to env vars
         """
         self.collection_id = collection_id
 
         base_path = f"/electronic/e-collections/{self.collection_id}/"
 
-        logger.info(f"Instantiating {type(self).__name__} with collection_id "
-                    f"{self.collection_id}.")
+        logger.debug(f"Instantiating {type(self).__name__} with collection_id "
+                     f"{self.collection_id}.")
 
-        super().__init__(base_path)
+        super().__init__(base_path, job_context)
 
 
 class PortfoliosApi(setup_rest.GenericApi):
@@ -49,9 +54,14 @@ class PortfoliosApi(setup_rest.GenericApi):
     Make API calls for portfolios.
     """
 
-    def __init__(self, collection_id: str, service_id: str):
+    def __init__(
+            self,
+            collection_id: str,
+            service_id: str,
+            job_context: config.JobContext = None):
         """
         Initialize API for portfolios.
+        :param job_context: Context to make the calls for, defaults to env vars
         """
         self.collection_id = collection_id
         self.service_id = service_id
@@ -59,8 +69,8 @@ class PortfoliosApi(setup_rest.GenericApi):
         base_path = f"/electronic/e-collections/{self.collection_id}" \
                     f"/e-services/{self.service_id}/"
 
-        logger.info(f"Instantiating {type(self).__name__} with "
-                    f"collection_id {self.collection_id} and service_id "
-                    f"{self.service_id}.")
+        logger.debug(f"Instantiating {type(self).__name__} with "
+                     f"collection_id {self.collection_id} and service_id "
+                     f"{self.service_id}.")
 
-        super().__init__(base_path)
+        super().__init__(base_path, job_context)
@@ -5,7 +5,7 @@ See https://developers.exlibrisgroup.com/console/?url=/wp-content/uploads/alma/o
 
 from logging import getLogger
 
-from . import setup_rest
+from . import config, setup_rest
 
 # Logfile
 logger = getLogger(__name__)
@@ -15,15 +15,16 @@ class UsersApi(setup_rest.GenericApi):
     """
     Make calls for bibliographic records. Here the record_id is the MMS ID.
     """
-    def __init__(self):
+    def __init__(self, job_context: config.JobContext = None):
         """
         Initialize API calls for bibliographic records.
+        :param job_context: Context to make the calls for, defaults to env vars
         """
         base_path = "/users/"
 
-        logger.info(f"Instantiating {type(self).__name__}.")
+        logger.debug(f"Instantiating {type(self).__name__}.")
 
-        super().__init__(base_path)
+        super().__init__(base_path, job_context)
 
     def retrieve_all_fees(self, user_id: str) -> str:
         """
@@ -0,0 +1,186 @@
+"""Roll back a job with the records saved in fetched_records
+
+Before every PUT or DELETE the record is retrieved and saved to
+fetched_records. To roll back a job, these versions are sent again:
+* Records changed via PUT are updated with the version fetched by the job.
+  The current version is retrieved first, so the rollback can itself be
+  rolled back. Records that are already the same are skipped.
+* Records deleted are created again via POST. Note that Alma gives the new
+  records new IDs, see put_post_responses for them.
+
+Only almaids with status "done" are rolled back. The rollback is a job of
+its own with the job_timestamp of the job_context, a line in job_lineage
+(step_name "rollback") links it to the job that was rolled back.
+
+The calls are made by almapipo.call_api_for_list with the records read by
+BackupReader.
+"""
+
+from datetime import datetime
+from logging import getLogger
+from threading import Lock, local
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from xml.etree.ElementTree import tostring
+
+from sqlalchemy.orm import Session
+
+from . import config, db_read, db_write
+
+# Logfile
+logger = getLogger(__name__)
+
+# Method of the job -> method to roll it back with
+ROLLBACK_METHODS = {"DELETE": "POST", "PUT": "PUT"}
+
+
+def register_rollback(
+        job_timestamp: datetime,
+        job_context: config.JobContext,
+        db_session: Session) -> None:
+    """
+    Add a line to job_lineage for the rollback.
+    :param job_timestamp: Job to roll back
+    :param job_context: Context of the rollback with its own job_timestamp
+    :param db_session: SQLAlchemy session for DB connection
+    :return: None
+    """
+
+    logger.info(f"Rolling back job {job_timestamp} with job "
+                f"{job_context.job_timestamp}.")
+
+    db_write.add_job_lineage(
+        job_context.job_timestamp, "rollback", job_context.job_timestamp,
+        job_timestamp, db_session
+    )
+
+
+def get_almaids_to_roll_back(
+        job_timestamp: datetime,
+        db_session: Session) -> Dict[str, List[str]]:
+    """
+    Get all almaids of a job that were changed or deleted successfully.
+    :param job_timestamp: Job to roll back
+    :param db_session: SQLAlchemy session for DB connection
+    :return: Lists of almaids by method of the job ("DELETE" or "PUT"),
+        methods without almaids are left out
+    """
+
+    almaids_by_method = {}
+
+    for method in ROLLBACK_METHODS:
+        almaids = [
+            almaid for almaid, in
+            db_read.get_list_of_ids_by_status_and_method(
+                "done", method, job_timestamp, db_session
+            )
+        ]
+        if almaids:
+            almaids_by_method[method] = almaids
+
+    return almaids_by_method
+
+
+class BackupReader:
+    """
+    Read the versions of the records fetched by the job to roll back, each
+    thread with its own DB session, so it can be used by the stages of
+    almapipo.call_api_for_list:
+    * restore_record as manipulate_xml for PUT
+    * get_records_to_post as input for POST
+    Almaids without a version fetched by the job get status "error".
+    :param job_timestamp: Job to roll back
+    :param job_context: Context of the rollback with its own job_timestamp
+    """
+
+    def __init__(
+            self,
+            job_timestamp: datetime,
+            job_context: config.JobContext):
+        self.job_timestamp = job_timestamp
+        self.job_context = job_context
+        self._thread_data = local()
+        self._db_sessions = []
+        self._lock = Lock()
+
+    def get_backup(self, almaid: str) -> Optional[bytes]:
+        """
+        :param almaid: Comma-separated string of record-ids, most specific
+            last
+        :return: Version of the record fetched by the job or None
+        """
+
+        backup = db_read.get_fetched_xml_of_job(
+            almaid, self.job_timestamp, self._get_db_session()
+        )
+
+        if backup is None:
+            logger.error(f"No version of {almaid} was fetched by job "
+                         f"{self.job_timestamp}. Cannot roll back.")
+            return None
+
+        return tostring(backup)
+
+    def restore_record(
+            self,
+            almaid: str,
+            current_record_data: str) -> Optional[bytes]:
+        """
+        Used as manipulate_xml, ignores the current version of the record.
+        Without a backup the PUT gets status "error".
+        """
+
+        return self.get_backup(almaid)
+
+    def get_records_to_post(
+            self,
+            almaids: Iterable[str]) -> Iterator[Tuple[str, bytes]]:
+        """
+        Read the backups of deleted records one at a time. Rows with status
+        "error" for POST are added for all almaids without a backup, at once
+        after the last almaid.
+        :param almaids: Almaids deleted by the job
+        :return: Iterator of tuples of almaid and record data to POST
+        """
+
+        missing_almaids = []
+
+        try:
+            for almaid in almaids:
+                backup = self.get_backup(almaid)
+                if backup is None:
+                    missing_almaids.append(almaid)
+                else:
+                    yield almaid, backup
+        finally:
+            if missing_almaids:
+                db_session = self._get_db_session()
+                primary_keys = [
+                    primary_key for _, _, primary_key in
+                    db_write.add_almaids_to_job_status_per_id(
+                        missing_almaids, "POST",
+                        self.job_context.job_timestamp, db_session
+                    )
+                ]
+                db_write.set_job_status_for_rows(
+                    "error", primary_keys, db_session
+                )
+
+    def close(self) -> None:
+        """
+        Close the DB sessions of all threads.
+        :return: None
+        """
+
+        with self._lock:
+            for db_session in self._db_sessions:
+                db_session.close()
+            self._db_sessions = []
+
+    def _get_db_session(self) -> Session:
+        if not hasattr(self._thread_data, "db_session"):
+            self._thread_data.db_session = \
+                self.job_context.create_db_session()
+            with self._lock:
+                self._db_sessions.append(self._thread_data.db_session)
+
+        return self._thread_data.db_session
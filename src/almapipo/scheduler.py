@@ -0,0 +1,262 @@
+"""Share calls per second and the daily API budget between jobs
+
+Several jobs (in any number of processes) using the same API key share both
+Alma's limit of calls per second and its daily threshold. To make sure that
+time-critical jobs get their calls, each job gets a FairShareLimiter as
+rate_limiter of its config.JobContext (see schedule_job):
+* Priority: While a job with higher priority is making calls, jobs with
+  lower priority wait.
+* Weight: Jobs of the same priority share the calls per second in
+  proportion to their weights (weighted fair queuing). The calls of all jobs
+  together never exceed the calls per second.
+* Reserved calls: Calls of the daily budget (table daily_budgets) that only
+  one job may use, e. g. reserved ahead of time for a nightly update. All
+  other jobs only get the calls that nobody reserved. If a job's calls are
+  used up, exceptions.ThresholdException is raised, just as if Alma's
+  threshold was exceeded.
+
+All state is kept in the tables daily_budgets, budget_shares and
+api_call_counts, days are as per the database's clock.
+"""
+
+from datetime import date
+from dataclasses import replace
+from logging import getLogger
+from threading import Lock
+from time import monotonic, sleep, time
+from typing import List, Tuple
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from . import config, db_read, db_write, exceptions
+
+# Logfile
+logger = getLogger(__name__)
+
+# Alma's limit of calls per second per institution
+DEFAULT_CALLS_PER_SECOND = 25
+
+# Jobs without calls for longer than this do not get a share
+ACTIVE_SECONDS = 10
+
+
+class FairShareLimiter:
+    """
+    Rate limiter for one job sharing a limit with other jobs, see module
+    docstring. Can be used wherever a rate_limit.DbRateLimiter can be used.
+    :param calls_per_second: Calls per second for all jobs together
+    :param db_engine: Engine to connect to the database
+    :param job_name: Name of the job, unique for the limit and day
+    :param priority: Jobs with lower priority wait for those with higher
+    :param weight: Share of the calls per second compared to other jobs of
+        the same priority
+    :param limit_name: Name of the limit, e. g. one per API key
+    """
+
+    def __init__(
+            self,
+            calls_per_second: float,
+            db_engine: Engine,
+            job_name: str,
+            priority: int = 0,
+            weight: float = 1.0,
+            limit_name: str = "alma"):
+        if calls_per_second <= 0 or weight <= 0:
+            logger.error("Calls per second and weight need to be more than "
+                         "zero.")
+            raise ValueError
+
+        self.calls_per_second = calls_per_second
+        self.db_engine = db_engine
+        self.job_name = job_name
+        self.priority = priority
+        self.weight = weight
+        self.limit_name = limit_name
+        self._share_limit_name = f"{limit_name}/{job_name}"
+        self._calls_per_second_share = None
+        self._share_checked = None
+        self._lock = Lock()
+
+        with Session(bind=db_engine) as db_session:
+            db_write.add_budget_share(
+                limit_name, None, job_name, priority, weight, None,
+                db_session
+            )
+
+    def acquire(self) -> None:
+        """
+        Wait until the job's share allows the next call and count it against
+        the daily budget.
+        :return: None, raises exceptions.ThresholdException if the job may
+            not make any more calls today
+        """
+        while True:
+            calls_per_second_share = self._get_calls_per_second_share()
+
+            # The shares are rounded up to one call, so the calls of all
+            # jobs are counted against calls_per_second as well
+            if calls_per_second_share > 0 and db_write.count_api_call(
+                    self._share_limit_name, calls_per_second_share,
+                    self.db_engine) and db_write.count_api_call(
+                    self.limit_name, self.calls_per_second,
+                    self.db_engine):
+                break
+
+            sleep(1 - time() % 1)
+
+        if not db_write.use_budget_share(
+                self.limit_name, self.job_name, self.priority, self.weight,
+                self.db_engine):
+            logger.error(f"Daily budget of {self.limit_name} is used up for "
+                         f"job {self.job_name}.")
+            raise exceptions.ThresholdException(
+                f"Daily budget of {self.limit_name} is used up for job "
+                f"{self.job_name}."
+            )
+
+    def _get_calls_per_second_share(self) -> float:
+        """
+        Share of the job as per the jobs active in the last seconds, checked
+        at most once per second.
+        """
+        with self._lock:
+            now = monotonic()
+
+            if self._share_checked is None or now - self._share_checked >= 1:
+                with Session(bind=self.db_engine) as db_session:
+                    active_shares = db_read.get_active_budget_shares(
+                        self.limit_name, ACTIVE_SECONDS, db_session
+                    )
+                self._calls_per_second_share = calculate_fair_share(
+                    self.job_name, self.priority, self.weight,
+                    active_shares, self.calls_per_second
+                )
+                self._share_checked = now
+
+            return self._calls_per_second_share
+
+
+def calculate_fair_share(
+        job_name: str,
+        priority: int,
+        weight: float,
+        active_shares: List[Tuple[str, int, float]],
+        calls_per_second: float) -> float:
+    """
+    Calls per second a job may make while the other jobs are active.
+    :param job_name: Name of the job
+    :param priority: Priority of the job
+    :param weight: Weight of the job
+    :param active_shares: job_name, priority and weight of the active jobs
+        as per db_read.get_active_budget_shares
+    :param calls_per_second: Calls per second for all jobs together
+    :return: 0 if a job with higher priority is active, otherwise the job's
+        share of calls_per_second by weight (at least one call)
+    """
+
+    shares = {name: (share_priority, share_weight)
+              for name, share_priority, share_weight in active_shares}
+    shares[job_name] = (priority, weight)
+
+    top_priority = max(share_priority for share_priority, _ in
+                       shares.values())
+
+    if priority < top_priority:
+        return 0.0
+
+    total_weight = sum(share_weight for share_priority, share_weight in
+                       shares.values() if share_priority == top_priority)
+
+    return max(1.0, calls_per_second * weight / total_weight)
+
+
+def schedule_job(
+        job_name: str,
+        priority: int = 0,
+        weight: float = 1.0,
+        calls_per_second: float = DEFAULT_CALLS_PER_SECOND,
+        job_context: config.JobContext = None,
+        limit_name: str = "alma") -> config.JobContext:
+    """
+    Context for a job sharing the limit with other jobs, e. g. for
+    almapipo.call_api_for_list.
+    :param job_name: Name of the job, unique for the limit and day
+    :param priority: Jobs with lower priority wait for those with higher
+    :param weight: Share of the calls per second compared to other jobs of
+        the same priority
+    :param calls_per_second: Calls per second for all jobs together
+    :param job_context: Context to add the limiter to, defaults to
+        config.default_context
+    :param limit_name: Name of the limit, e. g. one per API key
+    :return: New JobContext with a FairShareLimiter
+    """
+
+    if job_context is None:
+        job_context = config.default_context
+
+    return replace(
+        job_context,
+        rate_limiter=FairShareLimiter(
+            calls_per_second, job_context.get_db_engine(), job_name,
+            priority, weight, limit_name
+        )
+    )
+
+
+def set_daily_budget(
+        daily_calls: int,
+        budget_day: date = None,
+        job_context: config.JobContext = None,
+        limit_name: str = "alma") -> None:
+    """
+    Set how many calls all jobs sharing the limit may make in a day, e. g.
+    somewhat below Alma's daily threshold.
+    :param daily_calls: Number of calls for the day
+    :param budget_day: Day of the budget, defaults to today
+    :param job_context: Context of the database, defaults to
+        config.default_context
+    :param limit_name: Name of the limit, e. g. one per API key
+    :return: None
+    """
+
+    if job_context is None:
+        job_context = config.default_context
+
+    with job_context.create_db_session() as db_session:
+        db_write.set_daily_budget(
+            limit_name, budget_day, daily_calls, db_session
+        )
+
+
+def reserve_calls(
+        job_name: str,
+        reserved_calls: int,
+        priority: int = 0,
+        weight: float = 1.0,
+        budget_day: date = None,
+        job_context: config.JobContext = None,
+        limit_name: str = "alma") -> None:
+    """
+    Reserve calls of the daily budget for a job, e. g. ahead of time for a
+    job that needs to run later in the day.
+    :param job_name: Name the job will use in schedule_job
+    :param reserved_calls: Number of calls only this job may use
+    :param priority: Jobs with lower priority wait for those with higher
+    :param weight: Share of the calls per second compared to other jobs of
+        the same priority
+    :param budget_day: Day of the reservation, defaults to today
+    :param job_context: Context of the database, defaults to
+        config.default_context
+    :param limit_name: Name of the limit, e. g. one per API key
+    :return: None
+    """
+
+    if job_context is None:
+        job_context = config.default_context
+
+    with job_context.create_db_session() as db_session:
+        db_write.add_budget_share(
+            limit_name, budget_day, job_name, priority, weight,
+            reserved_calls, db_session
+        )
@@ -0,0 +1,377 @@
+"""Long-running service for many small jobs
+
+Instead of starting a new process for every job, the service keeps
+connections to the database and to Alma open and accepts jobs via a local
+HTTP API. Each job is run by almapipo.call_api_for_list with its own
+pipeline, all jobs share one limit of calls per second. Each job gets its
+own job_timestamp in a config.JobContext. Finished jobs are forgotten by
+the service after keep_finished_seconds, their results stay in the
+database.
+
+HTTP API (JSON):
+* POST /jobs with a job description, returns the job's ID
+* GET /jobs for the progress of all jobs
+* GET /jobs/<job_id> for the progress of one job
+
+A job description needs "action" ("GET", "DELETE" or "PUT"), "api" and
+"record_type" as well as one input: "almaids" (list), "csv_path" or
+"set_id". For "PUT" also provide "xpath" and "text" and optionally
+"mode" ("replace", "append" or "prepend") for the element's text.
+"""
+
+import json
+from dataclasses import replace
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+from threading import Lock
+from time import monotonic
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from . import (
+    almapipo,
+    config,
+    csv_update,
+    db_read,
+    input_helpers,
+    input_read,
+    rate_limit,
+    rest_conf,
+)
+
+# Logfile
+logger = getLogger(__name__)
+
+
+class ServiceJob:
+    """
+    One job submitted to the service and its progress.
+    :param job_context: Context of the job with its own job_timestamp
+    :param description: Job description as submitted
+    """
+
+    def __init__(self, job_context: config.JobContext, description: dict):
+        self.job_context = job_context
+        self.job_timestamp = job_context.job_timestamp
+        self.description = description
+        self.state = "queued"
+        self.total = None
+        self.processed = 0
+        self.error_message = None
+        self.finished = None
+        self._lock = Lock()
+
+    @property
+    def job_id(self) -> str:
+        return self.job_timestamp.isoformat()
+
+    def add_processed(self, almaid: str = None) -> None:
+        with self._lock:
+            self.processed += 1
+
+    def finish(self, state: str) -> None:
+        """
+        Set the final state of the job ("done" or "failed").
+        :param state: Final state
+        :return: None
+        """
+        self.finished = monotonic()
+        self.state = state
+
+    def progress(self) -> dict:
+        """
+        Current state of the job.
+        :return: Dictionary that can be converted to JSON
+        """
+        return {
+            "job_id": self.job_id,
+            "action": self.description["action"],
+            "api": self.description["api"],
+            "record_type": self.description["record_type"],
+            "state": self.state,
+            "total": self.total,
+            "processed": self.processed,
+            "error": self.error_message,
+        }
+
+
+class JobService:
+    """
+    Run jobs in a pool of threads, each job with its own pipeline (see
+    almapipo.call_api_for_list) and database session.
+    :param db_sessionmaker: Creates sessions, e. g. db_connect.DBSession
+    :param workers: Number of threads fetching and sending records per job
+    :param max_jobs: Number of jobs running at the same time
+    :param calls_per_second: Limit of API calls per second for all jobs
+    :param job_context: Institution to make the calls for, defaults to
+        config.default_context
+    :param keep_finished_seconds: Seconds a finished job can still be
+        looked up via the HTTP API
+    """
+
+    def __init__(
+            self,
+            db_sessionmaker: sessionmaker,
+            workers: int = 8,
+            max_jobs: int = 4,
+            calls_per_second: float = None,
+            job_context: config.JobContext = None,
+            keep_finished_seconds: float = 86400):
+        self.workers = workers
+        self.db_sessionmaker = db_sessionmaker
+        self.keep_finished_seconds = keep_finished_seconds
+        self.jobs: Dict[str, ServiceJob] = {}
+        self._jobs_lock = Lock()
+        self._job_pool = ThreadPoolExecutor(
+            max_jobs, thread_name_prefix="job"
+        )
+        self._last_job_timestamp = None
+
+        if job_context is None:
+            job_context = config.default_context
+
+        if calls_per_second:
+            job_context = replace(
+                job_context,
+                rate_limiter=rate_limit.RateLimiter(calls_per_second)
+            )
+
+        self.job_context = job_context
+
+        # make sure the database can be reached before accepting jobs
+        with db_sessionmaker.kw["bind"].connect():
+            logger.info("Connection to the database established.")
+
+    def submit(self, description: dict) -> ServiceJob:
+        """
+        Check a job description and queue the job.
+        :param description: See module doc string
+        :return: The queued job
+        """
+        _check_description(description)
+
+        with self._jobs_lock:
+            self._drop_finished_jobs()
+            job_timestamp = datetime.now(timezone.utc)
+            if self._last_job_timestamp \
+                    and job_timestamp <= self._last_job_timestamp:
+                job_timestamp = \
+                    self._last_job_timestamp + timedelta(microseconds=1)
+            self._last_job_timestamp = job_timestamp
+
+            service_job = ServiceJob(
+                self.job_context.for_job(job_timestamp), description
+            )
+            self.jobs[service_job.job_id] = service_job
+
+        logger.info(f"Job {service_job.job_id} queued: {description}")
+        self._job_pool.submit(self._run_job, service_job)
+
+        return service_job
+
+    def get_job(self, job_id: str) -> Optional[ServiceJob]:
+        with self._jobs_lock:
+            self._drop_finished_jobs()
+            return self.jobs.get(job_id)
+
+    def get_jobs(self) -> List[ServiceJob]:
+        with self._jobs_lock:
+            self._drop_finished_jobs()
+            return list(self.jobs.values())
+
+    def shutdown(self) -> None:
+        """
+        Wait for all jobs to finish and stop the threads.
+        :return: None
+        """
+        self._job_pool.shutdown()
+
+    def _drop_finished_jobs(self) -> None:
+        """
+        Forget jobs finished more than keep_finished_seconds ago, so the
+        dict of jobs does not grow as long as the service runs. Needs
+        _jobs_lock.
+        """
+        finished_before = monotonic() - self.keep_finished_seconds
+
+        for job_id, service_job in list(self.jobs.items()):
+            if service_job.finished is not None \
+                    and service_job.finished < finished_before:
+                del self.jobs[job_id]
+
+    def _run_job(self, service_job: ServiceJob) -> None:
+        service_job.state = "running"
+        description = service_job.description
+        action = description["action"]
+
+        stage_workers = None
+        if self.workers > 1:
+            stage_workers = {"fetch": self.workers, "send": self.workers}
+
+        try:
+            with self._get_db_session() as db_session:
+                almapipo.call_api_for_list(
+                    self._get_almaids(service_job, db_session),
+                    description["api"],
+                    description["record_type"],
+                    action,
+                    db_session,
+                    _create_manipulation(description),
+                    stage_workers,
+                    job_context=service_job.job_context,
+                    record_handled=service_job.add_processed
+                )
+                if action != "GET":
+                    db_read.log_success_rate(
+                        "GET", service_job.job_timestamp, db_session
+                    )
+        except Exception as error:
+            logger.error(f"Job {service_job.job_id} failed: {error!r}")
+            service_job.error_message = repr(error)
+            service_job.finish("failed")
+            return
+
+        service_job.finish("done")
+        logger.info(f"Job {service_job.job_id} done.")
+
+    def _get_almaids(
+            self,
+            service_job: ServiceJob,
+            db_session: Session) -> Iterable[str]:
+        description = service_job.description
+
+        if "almaids" in description:
+            service_job.total = len(description["almaids"])
+            return description["almaids"]
+
+        if "csv_path" in description:
+            service_job.total = input_helpers.import_csv_to_source_csv(
+                description["csv_path"], service_job.job_timestamp,
+                db_session
+            )
+            return (next(iter(csv_line.values())) for csv_line in
+                    input_read.read_csv_contents(description["csv_path"]))
+
+        service_job.total = rest_conf.retrieve_set_total_record_count(
+            description["set_id"], service_job.job_context
+        )
+        return rest_conf.retrieve_set_member_almaids(
+            description["set_id"], service_job.job_context
+        )
+
+    def _get_db_session(self) -> Session:
+        return self.db_sessionmaker()
+
+
+def _check_description(description: dict) -> None:
+
+    for key in ["action", "api", "record_type"]:
+        if key not in description:
+            raise ValueError(f"Job description needs '{key}'.")
+
+    if description["action"] not in ["DELETE", "GET", "PUT"]:
+        raise ValueError("Action needs to be 'GET', 'DELETE' or 'PUT'.")
+
+    if sum(key in description
+           for key in ["almaids", "csv_path", "set_id"]) != 1:
+        raise ValueError("Job description needs exactly one of 'almaids', "
+                         "'csv_path' or 'set_id'.")
+
+    if description["action"] == "PUT" and (
+            "xpath" not in description or "text" not in description):
+        raise ValueError("Job description for PUT needs 'xpath' and 'text'.")
+
+    if description.get("mode", "replace") not in [
+            "replace", "append", "prepend"]:
+        raise ValueError("Mode needs to be 'replace', 'append' or "
+                         "'prepend'.")
+
+
+def _create_manipulation(
+        description: dict) -> Optional[Callable[[str, str], bytes]]:
+
+    if description["action"] != "PUT":
+        return None
+
+    return partial(
+        csv_update.apply_column_updates,
+        [csv_update.ColumnUpdate(
+            description["xpath"],
+            description.get("mode", "replace"),
+            description["text"]
+        )]
+    )
+
+
+class _ServiceRequestHandler(BaseHTTPRequestHandler):
+    """Translate HTTP requests to calls of the JobService."""
+
+    service: JobService = None
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") == "/jobs":
+            jobs = self.service.get_jobs()
+            self._send_json(200, [job.progress() for job in jobs])
+            return
+
+        if self.path.startswith("/jobs/"):
+            service_job = self.service.get_job(self.path[len("/jobs/"):])
+            if service_job:
+                self._send_json(200, service_job.progress())
+                return
+
+        self._send_json(404, {"error": "Not found."})
+
+    def do_POST(self) -> None:
+        if self.path.rstrip("/") != "/jobs":
+            self._send_json(404, {"error": "Not found."})
+            return
+
+        try:
+            content_length = int(self.headers.get("Content-Length", 0))
+            description = json.loads(self.rfile.read(content_length))
+            service_job = self.service.submit(description)
+        except (ValueError, TypeError) as error:
+            self._send_json(400, {"error": str(error)})
+            return
+
+        self._send_json(201, service_job.progress())
+
+    def log_message(self, format_string: str, *args) -> None:
+        logger.info(format_string % args)
+
+    def _send_json(self, status_code: int, content) -> None:
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(
+        service: JobService,
+        port: int = 8765,
+        host: str = "127.0.0.1") -> None:
+    """
+    Accept jobs via HTTP until the process is stopped.
+    :param service: JobService to run the jobs with
+    :param port: Port to listen on
+    :param host: Address to listen on, defaults to localhost only
+    :return: None
+    """
+    request_handler = type(
+        "ServiceRequestHandler", (_ServiceRequestHandler,),
+        {"service": service}
+    )
+
+    with ThreadingHTTPServer((host, port), request_handler) as http_server:
+        logger.info(f"Accepting jobs on http://{host}:{port}/jobs")
+        try:
+            http_server.serve_forever()
+        finally:
+            service.shutdown()
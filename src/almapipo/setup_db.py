@@ -1,15 +1,32 @@
 """Setup of DB tables
 
 Table definitions necessary for use of almapipo
+
+The indexes are named, so module db_migrate can add them to databases
+created before they were defined.
 """
 
 from logging import getLogger
 import xml.etree.ElementTree as etree
 
-from sqlalchemy import Column, DateTime, Integer, MetaData, String
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    Date,
+    DateTime,
+    Float,
+    ForeignKey,
+    func,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Text,
+)
 from sqlalchemy.types import UserDefinedType
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy.dialects.postgresql import JSONB
 
 # Logfile
 logger = getLogger(__name__)
@@ -54,13 +71,45 @@ class JobStatusPerId(Base):
     job_status = Column(String(5))
     job_action = Column(String(6))
 
+    __table_args__ = (
+        Index("ix_job_status_per_id_job", "job_timestamp", "job_action",
+              "job_status"),
+        Index("ix_job_status_per_id_almaid", "almaid", "job_action",
+              "job_status"),
+    )
+
+
+class JobSummary(Base):
+    __tablename__ = "job_summary"
+
+    job_timestamp = Column(DateTime(timezone=True), primary_key=True)
+    job_action = Column(String(6), primary_key=True)
+    job_status = Column(String(5), primary_key=True)
+    record_count = Column(Integer)
+
 
 class SourceCsv(Base):
     __tablename__ = "source_csv"
 
     primary_key = Column(Integer, primary_key=True)
     job_timestamp = Column(DateTime(timezone=True))
-    csv_line = Column(JSON)
+    # Value of the first column, as JSONB does not keep the order of keys
+    almaid = Column(String(100))
+    csv_line = Column(JSONB)
+
+    __table_args__ = (
+        Index("ix_source_csv_job_almaid", "job_timestamp", "almaid"),
+        Index("ix_source_csv_csv_line", "csv_line", postgresql_using="gin",
+              postgresql_ops={"csv_line": "jsonb_path_ops"}),
+    )
+
+
+class RecordBlobs(Base):
+    __tablename__ = "record_blobs"
+
+    # SHA-256 of the canonical form, see xml_extract.hash_record
+    content_hash = Column(String(64), primary_key=True)
+    alma_record = Column(XMLType, nullable=False)
 
 
 class FetchedRecords(Base):
@@ -69,7 +118,13 @@ class FetchedRecords(Base):
     primary_key = Column(Integer, primary_key=True)
     job_timestamp = Column(DateTime(timezone=True))
     almaid = Column(String(100))
+    # NULL if the record is stored in record_blobs, see db_write
     alma_record = Column(XMLType)
+    content_hash = Column(String(64))
+
+    __table_args__ = (
+        Index("ix_fetched_records_almaid", "almaid", "job_timestamp"),
+    )
 
 
 class SentRecords(Base):
@@ -78,7 +133,16 @@ class SentRecords(Base):
     primary_key = Column(Integer, primary_key=True)
     job_timestamp = Column(DateTime(timezone=True))
     almaid = Column(String(100))
+    # NULL if the record is stored in record_blobs, see db_write
     alma_record = Column(XMLType)
+    # SHA-256 of the canonical form, see xml_extract.hash_record
+    content_hash = Column(String(64))
+
+    __table_args__ = (
+        Index("ix_sent_records_job_almaid", "job_timestamp", "almaid"),
+        Index("ix_sent_records_job_hash", "job_timestamp", "almaid",
+              "content_hash"),
+    )
 
 
 class PutPostResponses(Base):
@@ -87,4 +151,99 @@ class PutPostResponses(Base):
     primary_key = Column(Integer, primary_key=True)
     job_timestamp = Column(DateTime(timezone=True))
     almaid = Column(String(100))
+    # NULL if the record is stored in record_blobs, see db_write
     alma_record = Column(XMLType)
+    # SHA-256 of the canonical form, see xml_extract.hash_record
+    content_hash = Column(String(64))
+
+    __table_args__ = (
+        Index("ix_put_post_responses_job_almaid", "job_timestamp", "almaid"),
+        Index("ix_put_post_responses_job_hash", "job_timestamp", "almaid",
+              "content_hash"),
+    )
+
+
+class JobMetrics(Base):
+    __tablename__ = "job_metrics"
+
+    primary_key = Column(Integer, primary_key=True)
+    job_timestamp = Column(DateTime(timezone=True))
+    job_action = Column(String(6))
+    record_count = Column(Integer)
+    workers = Column(Integer)
+    duration_seconds = Column(Float)
+
+
+class JobLeases(Base):
+    __tablename__ = "job_leases"
+
+    status_key = Column(
+        Integer,
+        ForeignKey("job_status_per_id.primary_key"),
+        primary_key=True
+    )
+    lease_owner = Column(String(100))
+    lease_expires = Column(DateTime(timezone=True))
+
+
+class ApiCallCounts(Base):
+    __tablename__ = "api_call_counts"
+
+    limit_name = Column(String(100), primary_key=True)
+    epoch_second = Column(BigInteger, primary_key=True)
+    calls = Column(Integer)
+
+
+class ApiErrors(Base):
+    __tablename__ = "api_errors"
+
+    primary_key = Column(Integer, primary_key=True)
+    status_key = Column(
+        Integer,
+        ForeignKey("job_status_per_id.primary_key"),
+        index=True
+    )
+    job_timestamp = Column(DateTime(timezone=True), index=True)
+    http_status = Column(Integer)
+    error_code = Column(String(100), index=True)
+    error_message = Column(Text)
+    transient = Column(Boolean)
+
+
+class DailyBudgets(Base):
+    __tablename__ = "daily_budgets"
+
+    limit_name = Column(String(100), primary_key=True)
+    budget_day = Column(Date, primary_key=True)
+    daily_calls = Column(Integer)
+
+
+class BudgetShares(Base):
+    __tablename__ = "budget_shares"
+
+    limit_name = Column(String(100), primary_key=True)
+    budget_day = Column(Date, primary_key=True)
+    job_name = Column(String(100), primary_key=True)
+    priority = Column(Integer)
+    weight = Column(Float)
+    reserved_calls = Column(Integer)
+    calls_used = Column(Integer)
+    last_call = Column(DateTime(timezone=True))
+
+
+class JobLineage(Base):
+    __tablename__ = "job_lineage"
+
+    primary_key = Column(Integer, primary_key=True)
+    workflow_timestamp = Column(DateTime(timezone=True))
+    step_name = Column(String(100))
+    job_timestamp = Column(DateTime(timezone=True))
+    parent_job_timestamp = Column(DateTime(timezone=True))
+
+
+class SchemaVersions(Base):
+    __tablename__ = "schema_versions"
+
+    version = Column(Integer, primary_key=True)
+    description = Column(String(200))
+    applied = Column(DateTime(timezone=True), server_default=func.now())
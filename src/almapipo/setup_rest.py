@@ -15,10 +15,13 @@ from importlib import metadata
 from logging import getLogger
 from os import environ
 from requests import Session, Response
+from threading import local
+from typing import NamedTuple, Optional
 from urllib import parse
 import warnings
+from xml.etree.ElementTree import ParseError, fromstring
 
-from . import exceptions
+from . import config, exceptions
 
 
 # Logfile
@@ -31,18 +34,46 @@ except KeyError:
     warnings.warn("One of the env vars necessary for API calls are "
                   "missing. Please check the README for further info.")
 
+# Optional limit of calls per second, see module rate_limit
+rate_limiter = None
 
-def test_calls_remaining_today():
+# One session per thread, so connections to Alma are reused between calls
+_thread_sessions = local()
+
+# Error of the last call per thread, see pop_last_error
+_thread_errors = local()
+
+# Errors worth retrying later, see parse_api_error
+TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+TRANSIENT_ERROR_CODES = {"DAILY_THRESHOLD", "PER_SECOND_THRESHOLD"}
+
+
+class ApiError(NamedTuple):
+    """Failed API call, see parse_api_error."""
+    http_status: int
+    error_code: Optional[str]
+    error_message: Optional[str]
+    transient: bool
+
+
+def test_calls_remaining_today(job_context: config.JobContext = None):
     """
     Make a test call to the bibs API to see how many API calls are remaining
     for the day.
+    :param job_context: Context to make the call for, defaults to env vars
     :return: Number of calls left according to daily API Request Threshold
     """
 
-    with create_alma_api_session("xml") as session:
+    context_api_key, context_base_url, context_limiter = \
+        resolve_context(job_context)
+
+    with create_alma_api_session("xml", context_api_key) as session:
+
+        if context_limiter:
+            context_limiter.acquire()
 
         alma_response = switch_api_method(
-            f"{api_base_url}/bibs/test", "GET", session
+            f"{context_base_url}/bibs/test", "GET", session
         )
         alma_response_headers = alma_response.headers
 
@@ -62,12 +93,17 @@ class GenericApi:
     """
     Make generic calls to an API that supports all aspects of CRUD.
     """
-    def __init__(self, base_path: str):
+    def __init__(
+            self,
+            base_path: str,
+            job_context: config.JobContext = None):
         """
         Initialize API calls.
         :param base_path: Path used for API calls
+        :param job_context: Context to make the calls for, defaults to env vars
         """
         self.base_path = base_path
+        self.job_context = job_context
 
     def create(self, record_data: bytes, url_parameters: dict = None) -> str:
         """
@@ -88,7 +124,9 @@ class GenericApi:
         if url_parameters:
             full_path = add_parameters(self.base_path, url_parameters)
 
-        response_content = call_api(full_path, "POST", 200, record_data)
+        response_content = call_api(
+            full_path, "POST", 200, record_data, self.job_context
+        )
 
         return response_content
 
@@ -114,7 +152,9 @@ class GenericApi:
         if url_parameters:
             full_path = add_parameters(full_path, url_parameters)
 
-        delete_response = call_api(full_path, "DELETE", 204)
+        delete_response = call_api(
+            full_path, "DELETE", 204, job_context=self.job_context
+        )
 
         return delete_response
 
@@ -137,7 +177,9 @@ class GenericApi:
         if url_parameters:
             full_path = add_parameters(full_path, url_parameters)
 
-        response_content = call_api(full_path, "GET", 200)
+        response_content = call_api(
+            full_path, "GET", 200, job_context=self.job_context
+        )
 
         return response_content
 
@@ -165,7 +207,9 @@ class GenericApi:
         if url_parameters:
             full_path = add_parameters(full_path, url_parameters)
 
-        response_content = call_api(full_path, "PUT", 200, record_data)
+        response_content = call_api(
+            full_path, "PUT", 200, record_data, self.job_context
+        )
 
         return response_content
 
@@ -190,7 +234,8 @@ def call_api(
         url_parameters: str,
         method: str,
         status_code: int,
-        record_data: bytes = None) -> str:
+        record_data: bytes = None,
+        job_context: config.JobContext = None) -> str:
     """
     Generic function for all API calls.
 
@@ -207,48 +252,113 @@ def call_api(
     :param method: DELETE, GET, POST or PUT
     :param status_code: Status code of a successful API call for given method
     :param record_data: Necessary input for POST and PUT, defaults to None
+    :param job_context: Context to make the call for, defaults to env vars
     :return: The API response's content in XML format as a string
     """
 
-    with create_alma_api_session("xml") as session:
+    context_api_key, context_base_url, context_limiter = \
+        resolve_context(job_context)
 
-        alma_url = api_base_url + url_parameters
-        alma_response = switch_api_method(
-            alma_url, method, session, record_data
+    session = get_alma_api_session(context_api_key)
+
+    alma_url = context_base_url + url_parameters
+    _thread_errors.last_error = None
+
+    if context_limiter:
+        context_limiter.acquire()
+
+    alma_response = switch_api_method(
+        alma_url, method, session, record_data
+    )
+
+    if alma_response.status_code == status_code:
+
+        alma_response_content = alma_response.content.decode("utf-8")
+
+        logger.info(f"{method} for '{url_parameters}' completed.")
+
+        if "<errorList>" in alma_response_content:
+
+            logger.warning(f"The response contained an error, even though "
+                           f"it had status code {status_code}. Reason: "
+                           f"{alma_response.status_code} - "
+                           f"{alma_response.content}")
+
+        elif not alma_response_content.startswith("<?xml") \
+                and status_code != 204:
+
+            logger.error(f"The response retrieved does not seem to be "
+                         f"valid xml - startswith('<?xml') -- "
+                         f"{alma_response_content}")
+
+        return alma_response_content
+
+    error_text = alma_response.content.decode('utf-8')
+
+    logger.error(f"{method} for '{alma_url}' failed. Reason: "
+                 f"{alma_response.status_code} - "
+                 f"{error_text}")
+
+    _thread_errors.last_error = parse_api_error(
+        alma_response.status_code, error_text
+    )
+
+    if "DAILY_THRESHOLD" in error_text:
+        raise exceptions.ThresholdException(
+            "Daily API threshold exceeded. No more API calls possible until midnight."
         )
 
-        if alma_response.status_code == status_code:
 
-            alma_response_content = alma_response.content.decode("utf-8")
+def parse_api_error(status_code: int, error_text: str) -> ApiError:
+    """
+    Take error code and message from the errorList Alma sends with failed
+    calls. Errors are transient if the same call may succeed later, e. g.
+    because of a threshold or a server error.
+    :param status_code: HTTP status code of the response
+    :param error_text: Content of the response
+    :return: ApiError, error_code and error_message are None if the
+        response has no errorList
+    """
 
-            logger.info(f"{method} for '{url_parameters}' completed.")
+    error_code = None
+    error_message = None
 
-            if "<errorList>" in alma_response_content:
+    try:
+        error_xml = fromstring(error_text)
+    except ParseError:
+        error_xml = None
 
-                logger.warning(f"The response contained an error, even though "
-                               f"it had status code {status_code}. Reason: "
-                               f"{alma_response.status_code} - "
-                               f"{alma_response.content}")
+    if error_xml is not None:
+        for element in error_xml.iter():
+            tag = element.tag.rpartition("}")[2]
+            if tag == "errorCode" and error_code is None:
+                error_code = element.text
+            elif tag == "errorMessage" and error_message is None:
+                error_message = element.text
 
-            elif not alma_response_content.startswith("<?xml") \
-                    and status_code != 204:
+    if error_code is None:
+        # thresholds are not always sent as XML
+        error_code = next((threshold_code for threshold_code in
+                           sorted(TRANSIENT_ERROR_CODES)
+                           if threshold_code in error_text), None)
 
-                logger.error(f"The response retrieved does not seem to be "
-                             f"valid xml - startswith('<?xml') -- "
-                             f"{alma_response_content}")
+    transient = status_code in TRANSIENT_STATUS_CODES \
+        or error_code in TRANSIENT_ERROR_CODES
 
-            return alma_response_content
+    return ApiError(status_code, error_code, error_message, transient)
 
-        error_text = alma_response.content.decode('utf-8')
 
-        logger.error(f"{method} for '{alma_url}' failed. Reason: "
-                     f"{alma_response.status_code} - "
-                     f"{error_text}")
+def pop_last_error() -> Optional[ApiError]:
+    """
+    Error of the last call made with call_api in this thread.
+    :return: ApiError or None if the last call did not fail (or the error
+        was popped already)
+    """
 
-        if "DAILY_THRESHOLD" in error_text:
-            raise exceptions.ThresholdException(
-                "Daily API threshold exceeded. No more API calls possible until midnight."
-            )
+    last_error = getattr(_thread_errors, "last_error", None)
+    _thread_errors.last_error = None
+
+    return last_error
 
 
 def switch_api_method(
@@ -278,19 +388,68 @@ def switch_api_method(
     raise ValueError
 
 
-def create_alma_api_session(session_format) -> Session:
+def create_alma_api_session(
+        session_format: str,
+        session_api_key: str = None) -> Session:
     """Create a Session with parameters from env vars
     :param session_format: Format in which records are sent and retrieved.
+    :param session_api_key: API key to use instead of the one from env vars
     :return: Session object for connections to Alma
     """
 
+    if session_api_key is None:
+        session_api_key = api_key
+
     session = Session()
 
     session.headers.update({
         "accept": "application/" + session_format,
         "Content-Type": f"application/{session_format}; charset=utf-8",
-        "authorization": f"apikey {api_key}",
+        "authorization": f"apikey {session_api_key}",
         "User-Agent": f"almapipo/{metadata.version('almapipo')}"
     })
 
     return session
+
+
+def get_alma_api_session(session_api_key: str = None) -> Session:
+    """
+    Return the Session of the current thread for xml calls to Alma. The
+    session is created on first use and kept open, so the connections are
+    reused by all further calls of the thread with the same API key.
+    :param session_api_key: API key to use instead of the one from env vars
+    :return: Session object for connections to Alma
+    """
+
+    if session_api_key is None:
+        session_api_key = api_key
+
+    try:
+        sessions = _thread_sessions.sessions
+    except AttributeError:
+        sessions = _thread_sessions.sessions = {}
+
+    if session_api_key not in sessions:
+        sessions[session_api_key] = create_alma_api_session(
+            "xml", session_api_key
+        )
+
+    return sessions[session_api_key]
+
+
+def resolve_context(job_context: config.JobContext = None) -> tuple:
+    """
+    API key, base URL and rate limiter of the context, falling back to the
+    module-level defaults for anything not set.
+    :param job_context: Context of the job, None for the defaults
+    :return: Tuple of api_key, api_base_url and rate_limiter
+    """
+
+    if job_context is None:
+        return api_key, api_base_url, rate_limiter
+
+    return (
+        job_context.api_key or api_key,
+        job_context.api_base_url or api_base_url,
+        job_context.rate_limiter or rate_limiter
+    )
@@ -0,0 +1,88 @@
+"""Buffer changes of job_status and write them in batches
+
+Setting the status of a row in job_status_per_id one by one takes a query,
+an update and a commit each. For a remote database this can take longer
+than the API calls themselves. A StatusWriter keeps the changes in memory
+and writes them with one UPDATE and one commit (see
+db_write.update_job_statuses) once max_rows changes are waiting or
+max_seconds passed since the last write.
+
+Use it as a context manager: the changes still waiting are written when the
+block is left, also if it is left by an exception (e. g. when the daily
+threshold is exceeded). Whoever reads job_status_per_id for the rows (e. g.
+canary checks or log_success_rate) has to do so after the block.
+"""
+
+from logging import getLogger
+from threading import Lock
+from time import monotonic
+
+from sqlalchemy.orm import Session
+
+from . import db_write
+
+# Logfile
+logger = getLogger(__name__)
+
+
+class StatusWriter:
+    """
+    Buffer for changes of job_status, see module docstring. Thread-safe, but
+    db_session must only be used by one thread at a time.
+    :param db_session: Session to write the changes with
+    :param max_rows: Write once this many changes are waiting
+    :param max_seconds: Write once this many seconds passed since the last
+        write (checked when a change is added)
+    """
+
+    def __init__(
+            self,
+            db_session: Session,
+            max_rows: int = 500,
+            max_seconds: float = 2.0):
+        self.db_session = db_session
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self._statuses = {}
+        self._last_flush = monotonic()
+        self._lock = Lock()
+
+    def update_job_status(self, status: str, primary_key: int) -> None:
+        """
+        Set the status of a row, written with the next batch. If the row gets
+        several statuses before that, the last one counts.
+        :param status: New status to be set
+        :param primary_key: Primary key of the row in job_status_per_id
+        :return: None
+        """
+        with self._lock:
+            self._statuses[primary_key] = status
+
+            if len(self._statuses) >= self.max_rows \
+                    or monotonic() - self._last_flush >= self.max_seconds:
+                self._flush()
+
+    def flush(self) -> None:
+        """
+        Write all changes waiting.
+        :return: None
+        """
+        with self._lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        self._last_flush = monotonic()
+
+        if not self._statuses:
+            return
+
+        statuses = list(self._statuses.items())
+        db_write.update_job_statuses(statuses, self.db_session)
+        self._statuses.clear()
+        logger.debug(f"Wrote {len(statuses)} job status(es).")
+
+    def __enter__(self) -> "StatusWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.flush()
@@ -0,0 +1,149 @@
+"""Share the work of one job between several processes
+
+The table job_status_per_id is used as a work queue:
+* seed_job adds one row with status "new" per almaid to the job
+* Any number of processes on any number of hosts can then call run_worker
+  for the same job. Each worker claims a batch of rows, makes the calls via
+  almapipo.call_api_for_record and claims the next batch until no rows with
+  status "new" are left.
+
+Claimed rows are leased for lease_seconds. If a worker crashes, its rows
+will be claimed by other workers once the lease has expired.
+
+To keep all workers together below Alma's limit of calls per second, use
+a rate_limit.DbRateLimiter in each worker, either as setup_rest.rate_limiter
+or in the job_context.
+"""
+
+from datetime import datetime
+from itertools import islice
+from logging import getLogger
+from os import getpid
+from socket import gethostname
+from time import monotonic
+from typing import Callable, Iterable
+
+from sqlalchemy.orm import Session
+
+from . import almapipo, config, db_read, db_write
+
+# Logfile
+logger = getLogger(__name__)
+
+
+def seed_job(
+        almaids: Iterable[str],
+        method: str,
+        job_timestamp: datetime,
+        db_session: Session,
+        batch_size: int = 1000) -> int:
+    """
+    For each almaid add a row with status "new" to job_status_per_id, so
+    workers can claim them. The rows are added batch_size at a time.
+    :param almaids: Iterable of almaids, e. g. a list or generator
+    :param method: "DELETE", "GET" or "PUT"
+    :param job_timestamp: Timestamp to identify the job
+    :param db_session: SQLAlchemy session for DB connection
+    :param batch_size: Number of rows added with one INSERT
+    :return: Number of rows added
+    """
+
+    almaids = iter(almaids)
+    number_of_rows = 0
+
+    while True:
+        batch = list(islice(almaids, batch_size))
+
+        if not batch:
+            break
+
+        number_of_rows += len(db_write.add_almaids_to_job_status_per_id(
+            batch, method, job_timestamp, db_session
+        ))
+
+    logger.info(f"Added {number_of_rows} almaids for {method} to job "
+                f"{job_timestamp}.")
+
+    return number_of_rows
+
+
+def run_worker(
+        job_timestamp: datetime,
+        api: str,
+        record_type: str,
+        method: str,
+        db_session: Session,
+        manipulate_xml: Callable[[str, str], bytes] = None,
+        batch_size: int = 50,
+        lease_seconds: int = 900,
+        worker_id: str = None,
+        job_context: config.JobContext = None) -> int:
+    """
+    Claim rows with status "new" of a job and make the calls for them until
+    no unclaimed rows are left. See call_api_for_record for details on the
+    calls. Make sure lease_seconds is long enough for a whole batch.
+    :param job_timestamp: Timestamp to identify the job, see seed_job
+    :param api: First path-argument after "almaws/v1" (e. g. "bibs")
+    :param record_type: Type of record to call the API for (e. g. "holdings")
+    :param method: "DELETE", "GET" or "PUT"
+    :param db_session: SQLAlchemy session for DB connection
+    :param manipulate_xml: Function with arguments almaid and data_retrieved
+    :param batch_size: Number of rows claimed at once
+    :param lease_seconds: Seconds until other workers may claim the rows
+    :param worker_id: Name of the worker, defaults to host and process ID
+    :param job_context: Institution to make the calls for, defaults to
+        config.default_context. Its job_timestamp is replaced by
+        job_timestamp.
+    :return: Number of almaids handled by this worker
+    """
+
+    if job_context is None:
+        job_context = config.default_context
+
+    job_context = job_context.for_job(job_timestamp)
+
+    if not worker_id:
+        worker_id = f"{gethostname()}-{getpid()}"
+
+    logger.info(f"Worker {worker_id} joining job {job_timestamp} for "
+                f"{method}.")
+
+    db_engine = db_session.get_bind()
+    number_of_almaids = 0
+    started = monotonic()
+
+    while True:
+        claimed_rows = db_write.claim_job_status_rows(
+            method, job_timestamp, worker_id, batch_size, lease_seconds,
+            db_engine
+        )
+
+        if not claimed_rows:
+            break
+
+        logger.info(f"Worker {worker_id} claimed {len(claimed_rows)} "
+                    f"almaids.")
+
+        for primary_key, almaid in claimed_rows:
+            almapipo.call_api_for_record(
+                almaid, api, record_type, method, db_session, manipulate_xml,
+                job_context=job_context,
+                primary_keys={method: primary_key}
+            )
+            number_of_almaids += 1
+
+        db_write.release_job_status_rows(
+            [primary_key for primary_key, _ in claimed_rows], db_session
+        )
+
+    logger.info(f"Worker {worker_id} handled {number_of_almaids} almaids. "
+                f"No more unclaimed almaids in job {job_timestamp}.")
+
+    # one line per worker, each handles one record after the other
+    db_write.add_job_metrics(
+        method, number_of_almaids, 1, monotonic() - started, job_timestamp,
+        db_session
+    )
+    db_read.log_success_rate(method, job_timestamp, db_session)
+
+    return number_of_almaids
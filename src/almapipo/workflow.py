@@ -0,0 +1,287 @@
+"""Workflows of several jobs that feed into each other
+
+A workflow consists of steps, each of which is a job of its own (with its
+own job_timestamp) for one api, record_type and method. A step either gets
+the almaids given to the workflow or depends on another step. As soon as a
+record is done in a step, the almaids derived from it are handed to the
+steps depending on it, so all steps work at the same time and there is no
+waiting for a whole step to finish.
+
+By default the almaid itself is handed on, e. g. to GET records, DELETE
+them and GET them again to verify the deletion. With derive_almaids other
+almaids can be taken from the record retrieved, e. g. the holdings of a bib.
+
+All steps share one config.JobContext (institution, database, rate
+limiter). For every step a line is added to job_lineage with the job it
+got its almaids from.
+"""
+
+from datetime import datetime, timedelta
+from logging import getLogger
+from queue import Queue
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from . import almapipo, config, db_read, db_write
+
+# Logfile
+logger = getLogger(__name__)
+
+# Marks the end of the input for one worker of a step
+_END_OF_INPUT = object()
+
+
+class WorkflowStep(NamedTuple):
+    """
+    One step of a workflow, see run_workflow.
+    :param name: Unique name of the step within the workflow
+    :param api: First path-argument after "almaws/v1" (e. g. "bibs")
+    :param record_type: Type of record to call the API for (e. g. "holdings")
+    :param method: "DELETE", "GET" or "PUT"
+    :param depends_on: Name of the step this step gets its almaids from,
+        None for the almaids given to the workflow
+    :param derive_almaids: Function with arguments almaid and the record
+        retrieved, returning the almaids for steps depending on this one.
+        Defaults to handing on the almaid itself.
+    :param manipulate_xml: Function with arguments almaid and data_retrieved
+    :param workers: Number of records handled at the same time
+    """
+    name: str
+    api: str
+    record_type: str
+    method: str
+    depends_on: Optional[str] = None
+    derive_almaids: Optional[Callable[[str, str], Iterable[str]]] = None
+    manipulate_xml: Optional[Callable[[str, str], bytes]] = None
+    workers: int = 1
+
+
+class _StepRun:
+    """
+    State of one step while the workflow is running.
+    """
+
+    def __init__(self, step: WorkflowStep, job_context: config.JobContext):
+        self.step = step
+        self.job_context = job_context
+        self.queue = Queue(maxsize=100)
+        self.children: List["_StepRun"] = []
+        self.seen = set()
+        self.processed = 0
+        self.workers_left = step.workers
+        self.finished = None
+        self.lock = Lock()
+
+
+def run_workflow(
+        steps: List[WorkflowStep],
+        almaids: Iterable[str],
+        job_context: config.JobContext = None) -> Dict[str, datetime]:
+    """
+    Run all steps of a workflow at the same time, handing almaids from each
+    step to the steps depending on it as soon as they are done. Every almaid
+    is handled at most once per step. If a step raises an exception (e. g.
+    exceptions.ThresholdException), no more calls are made and the first
+    exception is raised again once all threads have stopped.
+    :param steps: Steps of the workflow, each depending on at most one other
+    :param almaids: Iterable of almaids for the steps without depends_on
+    :param job_context: Institution, database and limits for all steps,
+        defaults to config.default_context
+    :return: job_timestamp of each step by name
+    """
+
+    if job_context is None:
+        job_context = config.default_context
+
+    step_runs = _create_step_runs(steps, job_context)
+    workflow_timestamp = job_context.job_timestamp
+
+    with job_context.create_db_session() as db_session:
+        for step_run in step_runs.values():
+            parent = step_runs.get(step_run.step.depends_on)
+            db_write.add_job_lineage(
+                workflow_timestamp,
+                step_run.step.name,
+                step_run.job_context.job_timestamp,
+                parent.job_context.job_timestamp if parent else None,
+                db_session
+            )
+
+    abort = Event()
+    errors = []
+    threads = []
+    started = monotonic()
+
+    for step_run in step_runs.values():
+        for number in range(step_run.step.workers):
+            thread = Thread(
+                target=_work,
+                args=(step_run, abort, errors),
+                name=f"{step_run.step.name}_{number}",
+                daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+
+    root_runs = [step_run for step_run in step_runs.values()
+                 if step_run.step.depends_on is None]
+
+    try:
+        for almaid in almaids:
+            if abort.is_set():
+                logger.warning("Workflow was aborted. No more almaids will "
+                               "be added.")
+                break
+            for step_run in root_runs:
+                _hand_on(step_run, almaid)
+    finally:
+        for step_run in root_runs:
+            for _ in range(step_run.step.workers):
+                step_run.queue.put(_END_OF_INPUT)
+
+        for thread in threads:
+            thread.join()
+
+    with job_context.create_db_session() as db_session:
+        for step_run in step_runs.values():
+            logger.info(f"Step {step_run.step.name} handled "
+                        f"{step_run.processed} almaid(s).")
+            db_write.add_job_metrics(
+                step_run.step.method, step_run.processed,
+                step_run.step.workers, step_run.finished - started,
+                step_run.job_context.job_timestamp, db_session
+            )
+            db_read.log_success_rate(
+                step_run.step.method,
+                step_run.job_context.job_timestamp,
+                db_session
+            )
+
+    if errors:
+        raise errors[0]
+
+    return {name: step_run.job_context.job_timestamp
+            for name, step_run in step_runs.items()}
+
+
+def _create_step_runs(
+        steps: List[WorkflowStep],
+        job_context: config.JobContext) -> Dict[str, _StepRun]:
+    """
+    Check the steps and give each its own job_timestamp.
+    """
+
+    step_names = [step.name for step in steps]
+
+    if len(set(step_names)) != len(step_names):
+        logger.error("Names of workflow steps need to be unique.")
+        raise ValueError
+
+    step_runs = {}
+
+    for index, step in enumerate(steps):
+        if step.depends_on is not None and step.depends_on not in step_names:
+            logger.error(f"Step {step.name} depends on unknown step "
+                         f"{step.depends_on}.")
+            raise ValueError
+
+        if step.method not in ["DELETE", "GET", "PUT"] or step.workers < 1:
+            logger.error(f"Step {step.name} needs method DELETE, GET or PUT "
+                         f"and at least one worker.")
+            raise ValueError
+
+        # steps are started at the same time, so make their timestamps unique
+        step_runs[step.name] = _StepRun(
+            step,
+            job_context.for_job(
+                job_context.job_timestamp + timedelta(microseconds=index + 1)
+            )
+        )
+
+    for step_run in step_runs.values():
+        parent_name = step_run.step.depends_on
+        visited = {step_run.step.name}
+
+        while parent_name is not None:
+            if parent_name in visited:
+                logger.error(f"Steps {visited} depend on each other.")
+                raise ValueError
+            visited.add(parent_name)
+            parent_name = step_runs[parent_name].step.depends_on
+
+        if step_run.step.depends_on is not None:
+            step_runs[step_run.step.depends_on].children.append(step_run)
+
+    if not any(step.depends_on is None for step in steps):
+        logger.error("At least one step needs to use the workflow's almaids.")
+        raise ValueError
+
+    return step_runs
+
+
+def _hand_on(step_run: _StepRun, almaid: str) -> None:
+    """
+    Add the almaid to the step's queue, unless the step already had it.
+    """
+
+    with step_run.lock:
+        if almaid in step_run.seen:
+            return
+        step_run.seen.add(almaid)
+
+    step_run.queue.put(almaid)
+
+
+def _work(step_run: _StepRun, abort: Event, errors: List[Exception]) -> None:
+    step = step_run.step
+
+    def record_done(almaid: str, record_data: str) -> None:
+        if not step_run.children:
+            return
+
+        if step.derive_almaids:
+            next_almaids = step.derive_almaids(almaid, record_data)
+        else:
+            next_almaids = [almaid]
+
+        for next_almaid in next_almaids:
+            for child in step_run.children:
+                _hand_on(child, next_almaid)
+
+    with step_run.job_context.create_db_session() as db_session:
+
+        while True:
+            almaid = step_run.queue.get()
+
+            if almaid is _END_OF_INPUT:
+                break
+
+            if abort.is_set():
+                continue
+
+            try:
+                almapipo.call_api_for_record(
+                    almaid, step.api, step.record_type, step.method,
+                    db_session, step.manipulate_xml,
+                    job_context=step_run.job_context,
+                    record_done=record_done
+                )
+            except Exception as error:
+                logger.error(f"Step {step.name} failed for {almaid}: "
+                             f"{error!r}")
+                errors.append(error)
+                abort.set()
+            else:
+                with step_run.lock:
+                    step_run.processed += 1
+
+    with step_run.lock:
+        step_run.workers_left -= 1
+        last_worker = step_run.workers_left == 0
+
+    if last_worker:
+        step_run.finished = monotonic()
+        for child in step_run.children:
+            for _ in range(child.step.workers):
+                child.queue.put(_END_OF_INPUT)
@@ -4,10 +4,11 @@ handling of the record.
 """
 
 from datetime import datetime
+from hashlib import sha256
 from logging import getLogger
-from typing import Iterable
+from typing import Iterable, Union
 from xml.etree import ElementTree
-from xml.etree.ElementTree import Element
+from xml.etree.ElementTree import canonicalize, Element
 
 from sqlalchemy.orm import Session
 
@@ -30,11 +31,30 @@ def extract_response_from_fetched_records(
     """
     logger.info(f"Extracting most recent response for almaid {almaid} from "
                 f"table fetched_records.")
-    response_query = db_read.get_most_recent_fetched_xml(
-        almaid, db_session
-    )
-    response = response_query.alma_record
-    return response
+    return db_read.get_most_recent_fetched_xml(almaid, db_session)
+
+
+def canonicalize_record(record_data: Union[str, bytes]) -> str:
+    """
+    Bring a record into canonical form (C14N 2.0), so two records can be
+    compared regardless of XML declaration, order of attributes or
+    serialization of empty elements.
+    :param record_data: XML of the record as string or bytes
+    :return: Canonical form of the record as string
+    """
+    return canonicalize(xml_data=record_data)
+
+
+def hash_record(record_data: Union[str, bytes]) -> str:
+    """
+    Hash of the canonical form of a record (see canonicalize_record), so
+    records can be compared in the database without comparing their XML.
+    :param record_data: XML of the record as string or bytes
+    :return: SHA-256 of the canonical form as hex string
+    """
+    return sha256(
+        canonicalize_record(record_data).encode("utf-8")
+    ).hexdigest()
 
 
 def extract_marc_for_job_timestamp(
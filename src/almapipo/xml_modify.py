@@ -130,7 +130,8 @@ def update_element(
 def remove_element_by_path(xml: ElementTree, element_tag: str) -> ElementTree:
     """
     From an xml given as ElementTree, remove all elements with the given path.
-    This operation is based on Element.findall().
+    This operation is based on Element.findall(), the path may include
+    ancestors (e. g. "item_data/description").
     The original xml will be left untouched by this operation.
     :param xml: ElementTree of the xml to be manipulated
     :param element_tag: Type of tag to be removed from the XML
@@ -138,9 +139,16 @@ def remove_element_by_path(xml: ElementTree, element_tag: str) -> ElementTree:
     """
 
     manipulated_xml = deepcopy(xml)
+    parent_path, _, child_tag = element_tag.rpartition("/")
 
-    for element in manipulated_xml.findall(element_tag):
-        manipulated_xml.remove(element)
+    if parent_path:
+        parents = manipulated_xml.findall(parent_path)
+    else:
+        parents = [manipulated_xml]
+
+    for parent in parents:
+        for element in parent.findall(child_tag):
+            parent.remove(element)
 
     return manipulated_xml
 
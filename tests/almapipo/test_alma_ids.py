@@ -0,0 +1,33 @@
+"""Tests for almapipo.alma_ids"""
+
+import pytest
+
+from almapipo.alma_ids import AlmaId
+
+
+class TestAlmaId:
+
+    def test_parts(self):
+        almaid = AlmaId("9981093873901234,22447985240001234,23447985190001234")
+        assert almaid.record_id == "23447985190001234" \
+            and almaid.parent_ids == ("9981093873901234", "22447985240001234")
+
+    def test_equals_string(self):
+        almaid = AlmaId("9981093873901234,22447985240001234")
+        assert almaid == "9981093873901234,22447985240001234" \
+            and {almaid} == {"9981093873901234,22447985240001234"} \
+            and str(almaid) == "9981093873901234,22447985240001234"
+
+    def test_parse_keeps_object(self):
+        almaid = AlmaId("9981093873901234")
+        assert AlmaId.parse(almaid) is almaid
+
+    def test_shared_parent_ids(self):
+        first = AlmaId("9981093873901234,22447985240001234")
+        second = AlmaId(",".join(["9981093873901234", "22447985240005678"]))
+        assert first.parent_ids[0] is second.parent_ids[0]
+
+    def test_immutable(self):
+        almaid = AlmaId("9981093873901234")
+        with pytest.raises(AttributeError):
+            almaid.text = "123"
@@ -1,13 +1,18 @@
 """Tests for almapipo.almapipo"""
 
+from dataclasses import replace
 from unittest import mock
 
 import pytest
 from sqlalchemy.orm import Session
 
 from almapipo import (
+    alma_ids,
     almapipo,
+    canary,
+    config,
     db_write,
+    exceptions,
     rest_acq,
     rest_bibs,
     rest_electronic,
@@ -29,6 +34,17 @@ def db_add_status_writer(monkeypatch):
     return add_status_writer
 
 
+@pytest.fixture
+def db_bulk_status_writer(monkeypatch):
+    bulk_status_writer = mock.MagicMock(
+        side_effect=lambda almaids, action, *_: [
+            (almaid, action, number) for number, almaid in enumerate(almaids)
+        ]
+    )
+    monkeypatch.setattr("almapipo.db_write.add_almaids_to_job_status_per_id", bulk_status_writer)
+    return bulk_status_writer
+
+
 @pytest.fixture
 def db_update_status_writer(monkeypatch):
     update_status_writer = mock.MagicMock()
@@ -36,6 +52,13 @@ def db_update_status_writer(monkeypatch):
     return update_status_writer
 
 
+@pytest.fixture
+def db_batch_status_writer(monkeypatch):
+    batch_status_writer = mock.MagicMock()
+    monkeypatch.setattr("almapipo.db_write.update_job_statuses", batch_status_writer)
+    return batch_status_writer
+
+
 @pytest.fixture
 def db_fetched_writer(monkeypatch):
     fetched_writer = mock.MagicMock()
@@ -206,17 +229,36 @@ class TestCallApi:
                 db_session,
                 db_update_status_writer,
                 response_bib_record_retrieved,
-                response_bib_record_updated
+                response_bib_record_updated,
+                monkeypatch
         ):
-            def dont_manipulate(id_list, input):
-                return input
+            def change_title(id_list, input):
+                return input.replace(b"Book of books", b"Book of records")
 
-            almapipo.call_api_for_record('991430610000121', 'bibs', 'bibs', 'PUT', db_session, dont_manipulate)
+            monkeypatch.setattr("almapipo.db_write.add_sent_record", mock.MagicMock())
+            almapipo.call_api_for_record('991430610000121', 'bibs', 'bibs', 'PUT', db_session, change_title)
             assert db_add_status_writer.call_count == 2 \
                    and db_fetched_writer.call_count == 1 \
                    and db_put_post_response_writer.call_count == 1 \
                    and db_update_status_writer.call_count == 2
 
+        def test_call_api_for_record_update_bib_unchanged(
+                self,
+                db_add_status_writer,
+                db_fetched_writer,
+                db_put_post_response_writer,
+                db_session,
+                db_update_status_writer,
+                response_bib_record_retrieved,
+                response_bib_record_updated
+        ):
+            def dont_manipulate(id_list, input):
+                return input
+
+            almapipo.call_api_for_record('991430610000121', 'bibs', 'bibs', 'PUT', db_session, dont_manipulate)
+            assert db_put_post_response_writer.call_count == 0 \
+                   and db_update_status_writer.call_args.args[0] == "skip"
+
         def test_call_api_for_record_create_bib(
                 self,
                 db_add_status_writer,
@@ -234,6 +276,384 @@ class TestCallApi:
                    and db_update_status_writer.call_count == 1
 
 
+        def test_call_api_for_record_get_fails_with_primary_keys(
+                self,
+                db_add_status_writer,
+                db_session,
+                db_update_status_writer,
+                monkeypatch
+        ):
+            monkeypatch.setattr(setup_rest.GenericApi, "retrieve", lambda *_: None)
+            almapipo.call_api_for_record(
+                '991430610000121', 'bibs', 'bibs', 'DELETE', db_session,
+                primary_keys={"DELETE": 42}
+            )
+            assert db_add_status_writer.call_count == 1 \
+                   and db_update_status_writer.call_args.args == ("error", 42, db_session)
+
+        def test_call_api_for_record_saves_api_error(
+                self,
+                db_add_status_writer,
+                db_session,
+                db_update_status_writer,
+                monkeypatch
+        ):
+            api_error_writer = mock.MagicMock()
+            monkeypatch.setattr("almapipo.db_write.add_api_error", api_error_writer)
+            monkeypatch.setattr(setup_rest.GenericApi, "retrieve", lambda *_: None)
+            monkeypatch.setattr(
+                "almapipo.setup_rest.pop_last_error",
+                lambda: setup_rest.ApiError(503, None, None, True)
+            )
+            almapipo.call_api_for_record(
+                '991430610000121', 'bibs', 'bibs', 'GET', db_session
+            )
+            assert api_error_writer.call_args.args[2:6] == (503, None, None, True)
+
+    class TestCallApiForListPipelined:
+
+        def test_call_api_for_list_pipelined_update_bib(
+                self,
+                db_bulk_status_writer,
+                db_batch_status_writer,
+                db_fetched_writer,
+                db_put_post_response_writer,
+                db_session,
+                db_update_status_writer,
+                response_bib_record_retrieved,
+                response_bib_record_updated,
+                monkeypatch
+        ):
+            def change_title(id_list, input):
+                return input.replace(b"Book of books", b"Book of records")
+
+            monkeypatch.setattr("almapipo.db_write.add_sent_record", mock.MagicMock())
+            monkeypatch.setattr("almapipo.db_write.add_job_metrics", mock.MagicMock())
+            monkeypatch.setattr("almapipo.db_read.log_success_rate", mock.MagicMock())
+            almaids = ['991430610000121', '991430610000122', '991430610000123']
+            almapipo.call_api_for_list(
+                almaids, 'bibs', 'bibs', 'PUT', db_session, change_title,
+                {"fetch": 2, "transform": 2, "send": 2}
+            )
+            registered = sorted((call.args[1], almaid)
+                                for call in db_bulk_status_writer.call_args_list
+                                for almaid in call.args[0])
+            statuses_written = [status for call in db_batch_status_writer.call_args_list
+                                for status in call.args[0]]
+            assert registered == sorted((action, almaid) for action in ["GET", "PUT"]
+                                        for almaid in almaids) \
+                   and db_fetched_writer.call_count == 3 \
+                   and db_put_post_response_writer.call_count == 3 \
+                   and db_update_status_writer.call_count == 0 \
+                   and len(statuses_written) == 6
+
+        def test_call_api_for_list_pipelined_record_blobs_of_context(
+                self,
+                db_bulk_status_writer,
+                db_batch_status_writer,
+                db_fetched_writer,
+                db_put_post_response_writer,
+                db_session,
+                response_bib_record_retrieved,
+                response_bib_record_updated,
+                monkeypatch
+        ):
+            def change_title(id_list, input):
+                return input.replace(b"Book of books", b"Book of records")
+
+            sent_record_writer = mock.MagicMock()
+            monkeypatch.setattr("almapipo.db_write.add_sent_record", sent_record_writer)
+            monkeypatch.setattr("almapipo.db_write.add_job_metrics", mock.MagicMock())
+            monkeypatch.setattr("almapipo.db_read.log_success_rate", mock.MagicMock())
+            job_context = replace(config.default_context, store_record_blobs=True)
+            almapipo.call_api_for_list(
+                ['991430610000121'], 'bibs', 'bibs', 'PUT', db_session,
+                change_title, job_context=job_context
+            )
+            assert all(writer.call_args.args[-1] is True for writer in
+                       [db_fetched_writer, db_put_post_response_writer, sent_record_writer])
+
+        def test_call_api_for_list_pipelined_backup_before_send(
+                self,
+                db_bulk_status_writer,
+                db_batch_status_writer,
+                db_fetched_writer,
+                db_session,
+                response_bib_record_retrieved,
+                monkeypatch
+        ):
+            def fail_to_send(method, job):
+                assert db_fetched_writer.call_count == 1
+                raise RuntimeError
+
+            monkeypatch.setattr("almapipo.almapipo._send_stage", fail_to_send)
+            with pytest.raises(RuntimeError):
+                almapipo.call_api_for_list(
+                    ['991430610000121'], 'bibs', 'bibs', 'DELETE', db_session,
+                    stage_workers={}
+                )
+            registered = [call.args[1] for call in db_bulk_status_writer.call_args_list]
+            statuses_written = [status for call in db_batch_status_writer.call_args_list
+                                for status in call.args[0]]
+            assert registered == ["GET", "DELETE"] \
+                and db_fetched_writer.call_args.args[0] == '991430610000121' \
+                and statuses_written == [(0, "done")]
+
+        @pytest.mark.parametrize("stage_workers", [None, {"send": 2}])
+        def test_call_api_for_list_post(
+                self,
+                db_bulk_status_writer,
+                db_batch_status_writer,
+                db_fetched_writer,
+                db_put_post_response_writer,
+                db_session,
+                db_update_status_writer,
+                response_bib_record_created,
+                monkeypatch,
+                stage_workers
+        ):
+            sent_record_writer = mock.MagicMock()
+            record_handled = mock.MagicMock()
+            monkeypatch.setattr("almapipo.db_write.add_sent_record", sent_record_writer)
+            monkeypatch.setattr("almapipo.db_write.add_job_metrics", mock.MagicMock())
+            monkeypatch.setattr("almapipo.db_read.log_success_rate",
+                                mock.MagicMock(return_value={"done": 2}))
+            records = [('991430610000121', b"<bib/>"), ('991430610000122', b"<bib/>")]
+            status_counts = almapipo.call_api_for_list(
+                records, 'bibs', 'bibs', 'POST', db_session,
+                stage_workers=stage_workers, record_handled=record_handled
+            )
+            statuses_written = [status for call in db_batch_status_writer.call_args_list
+                                for _, status in call.args[0]]
+            assert [call.args[1] for call in db_bulk_status_writer.call_args_list] == ["POST"] \
+                and db_fetched_writer.call_count == 0 \
+                and db_put_post_response_writer.call_count == 2 \
+                and sent_record_writer.call_args.args[1] == b"<bib/>" \
+                and statuses_written == ["done", "done"] \
+                and db_update_status_writer.call_count == 0 \
+                and sorted(call.args[0] for call in record_handled.call_args_list) \
+                == ['991430610000121', '991430610000122'] \
+                and status_counts == {"done": 2}
+
+    class TestCallApiForListProcesses:
+
+        @pytest.mark.parametrize("method, pool_started", [
+            ("GET", False), ("DELETE", False), ("PUT", True)
+        ])
+        def test_process_pool_only_for_put(self, db_session, monkeypatch, method, pool_started):
+            create_process_pool = mock.MagicMock()
+            pipelined_caller = mock.MagicMock()
+            monkeypatch.setattr("almapipo.pipeline.create_process_pool", create_process_pool)
+            monkeypatch.setattr("almapipo.almapipo._call_api_for_list_pipelined", pipelined_caller)
+            monkeypatch.setattr("almapipo.db_write.add_job_metrics", mock.MagicMock())
+            monkeypatch.setattr("almapipo.db_read.log_success_rate", mock.MagicMock())
+            almapipo.call_api_for_list(
+                ['991430610000121'], 'bibs', 'bibs', method, db_session,
+                transform_processes=2
+            )
+            assert create_process_pool.called == pool_started \
+                and pipelined_caller.called
+
+    class TestCallApiForListCanary:
+
+        def test_call_api_for_list_canary_aborts_after_sample(
+                self,
+                db_session,
+                db_bulk_status_writer,
+                monkeypatch
+        ):
+            record_caller = mock.MagicMock()
+            monkeypatch.setattr("almapipo.almapipo.call_api_for_record", record_caller)
+            monkeypatch.setattr(
+                "almapipo.db_read.get_job_status_rows",
+                lambda action, *_: [(str(number), "error", number) for number in range(100)]
+            )
+            with pytest.raises(exceptions.CanaryException):
+                almapipo.call_api_for_list(
+                    [str(number) for number in range(100)], 'bibs', 'bibs',
+                    'DELETE', db_session,
+                    canary_settings=canary.CanarySettings(sample_size=5)
+                )
+            assert record_caller.call_count == 5
+
+    class TestCallApiForListStatusRows:
+
+        def test_status_rows_added_per_batch(
+                self,
+                db_session,
+                db_bulk_status_writer,
+                monkeypatch
+        ):
+            record_caller = mock.MagicMock()
+            monkeypatch.setattr("almapipo.almapipo.call_api_for_record", record_caller)
+            monkeypatch.setattr("almapipo.db_write.add_job_metrics", mock.MagicMock())
+            monkeypatch.setattr("almapipo.db_read.log_success_rate", mock.MagicMock())
+            almapipo.call_api_for_list(
+                [str(number) for number in range(150)], 'bibs', 'bibs',
+                'DELETE', db_session
+            )
+            assert db_bulk_status_writer.call_count == 4 \
+                and record_caller.call_args.kwargs["primary_keys"] \
+                == {"GET": 49, "DELETE": 49}
+
+        def test_status_rows_mapped_by_almaid(
+                self,
+                db_session,
+                db_bulk_status_writer,
+                monkeypatch
+        ):
+            record_caller = mock.MagicMock()
+            monkeypatch.setattr("almapipo.almapipo.call_api_for_record", record_caller)
+            monkeypatch.setattr("almapipo.db_write.add_job_metrics", mock.MagicMock())
+            monkeypatch.setattr("almapipo.db_read.log_success_rate", mock.MagicMock())
+            db_bulk_status_writer.side_effect = lambda almaids, action, *_: [
+                (almaid, action, f"{action}-{almaid}") for almaid in reversed(almaids)
+            ]
+            almapipo.call_api_for_list(
+                ['1', '2', '3'], 'bibs', 'bibs', 'DELETE', db_session,
+                primary_keys_by_almaid={'2': {"DELETE": 42}}
+            )
+            primary_keys = {call.args[0]: call.kwargs["primary_keys"]
+                            for call in record_caller.call_args_list}
+            assert primary_keys == {
+                '1': {"GET": "GET-1", "DELETE": "DELETE-1"},
+                '2': {"GET": "GET-2", "DELETE": 42},
+                '3': {"GET": "GET-3", "DELETE": "DELETE-3"},
+            } and db_bulk_status_writer.call_args.args[0] == ['1', '3']
+
+
+class TestResumeJob:
+    """
+    Tests for almapipo.almapipo.resume_job
+    """
+
+    @pytest.fixture
+    def job_in_db(self, monkeypatch):
+        csv_lines = [
+            {"MMS-ID": "9981093873901234"},
+            {"MMS-ID": "9981093873911234"},
+            {"MMS-ID": "9981093873921234"},
+            {"MMS-ID": "9981093873931234"},
+        ]
+        status_rows = [
+            ("9981093873901234", "done", 1),
+            ("9981093873911234", "new", 2),
+            ("9981093873921234", "error", 3),
+        ]
+        monkeypatch.setattr(
+            "almapipo.db_read.get_source_csv_rows",
+            lambda *_: [(csv_line["MMS-ID"], csv_line) for csv_line in csv_lines]
+        )
+        monkeypatch.setattr("almapipo.db_read.get_job_status_rows", lambda *_: status_rows)
+        monkeypatch.setattr("almapipo.db_read.log_success_rate", mock.MagicMock())
+        monkeypatch.setattr("almapipo.db_write.add_job_metrics", mock.MagicMock())
+
+    @pytest.fixture
+    def record_caller(self, monkeypatch):
+        caller = mock.MagicMock()
+        monkeypatch.setattr("almapipo.almapipo.call_api_for_record", caller)
+        return caller
+
+    @pytest.fixture(autouse=True)
+    def status_rows_added(self, db_bulk_status_writer):
+        return db_bulk_status_writer
+
+    def test_resume_job_skips_done_and_error(self, db_session, job_in_db, record_caller):
+        assert almapipo.resume_job("1970-01-01 00:00:00+00:00", 'bibs', 'bibs', 'DELETE', db_session)
+        calls = [(call.args[0], call.kwargs["primary_keys"]) for call in record_caller.call_args_list]
+        assert calls == [
+            ("9981093873911234", {"GET": 0, "DELETE": 2}),
+            ("9981093873931234", {"GET": 1, "DELETE": 0}),
+        ]
+
+    def test_resume_job_retries_errors(self, db_session, job_in_db, record_caller):
+        almapipo.resume_job("1970-01-01 00:00:00+00:00", 'bibs', 'bibs', 'DELETE', db_session, retry_errors=True)
+        assert record_caller.call_count == 3
+
+    def test_resume_job_threshold(self, db_session, job_in_db, record_caller):
+        record_caller.side_effect = exceptions.ThresholdException
+        assert not almapipo.resume_job("1970-01-01 00:00:00+00:00", 'bibs', 'bibs', 'DELETE', db_session)
+
+    def test_resume_job_without_csv(self, db_session, monkeypatch):
+        monkeypatch.setattr("almapipo.db_read.get_source_csv_rows", lambda *_: [])
+        assert not almapipo.resume_job("1970-01-01 00:00:00+00:00", 'bibs', 'bibs', 'DELETE', db_session)
+
+
+class TestRetryTransientErrors:
+    """
+    Tests for almapipo.almapipo.retry_transient_errors
+    """
+
+    def test_retry_transient_errors_in_batches(self, db_session, monkeypatch):
+        error_rows = [
+            ("9981093873901234", "GET", 1),
+            ("9981093873911234", "DELETE", 3),
+            ("9981093873921234", "PUT", 5),
+        ]
+        requeue = mock.MagicMock()
+        record_caller = mock.MagicMock()
+        method_rows = [
+            ("9981093873901234", "error", 2),
+            ("9981093873911234", "error", 3),
+        ]
+        monkeypatch.setattr("almapipo.db_read.get_transient_error_rows", lambda *_: error_rows)
+        monkeypatch.setattr("almapipo.db_read.get_job_status_rows", lambda *_: method_rows)
+        monkeypatch.setattr("almapipo.db_read.log_success_rate", mock.MagicMock())
+        monkeypatch.setattr("almapipo.db_write.set_job_status_for_rows", requeue)
+        monkeypatch.setattr("almapipo.almapipo.call_api_for_record", record_caller)
+        retried = almapipo.retry_transient_errors(
+            "1970-01-01 00:00:00+00:00", 'bibs', 'bibs', 'DELETE', db_session, batch_size=1
+        )
+        assert retried == 2 \
+            and [call.args[1] for call in requeue.call_args_list] == [[1, 2], [3]] \
+            and [call.kwargs["primary_keys"] for call in record_caller.call_args_list] \
+            == [{"GET": 1, "DELETE": 2}, {"DELETE": 3}]
+
+    def test_retry_failed_get_leaves_no_error(
+            self,
+            db_fetched_writer,
+            db_put_post_response_writer,
+            db_session,
+            response_bib_record_retrieved,
+            response_bib_record_updated,
+            monkeypatch
+    ):
+        def change_title(id_list, input):
+            return input.replace(b"Book of books", b"Book of records")
+
+        # job_status_per_id after the GET failed with a transient error
+        rows = {
+            1: ["991430610000121", "GET", "error"],
+            2: ["991430610000121", "PUT", "error"],
+        }
+
+        def add_row(almaid, action, *_):
+            rows[len(rows) + 1] = [almaid, action, "new"]
+            return len(rows)
+
+        def set_status(status, primary_keys, *_):
+            for primary_key in primary_keys:
+                rows[primary_key][2] = status
+
+        monkeypatch.setattr("almapipo.db_read.get_transient_error_rows",
+                            lambda *_: [("991430610000121", "GET", 1)])
+        monkeypatch.setattr("almapipo.db_read.get_job_status_rows", lambda method, *_: [
+            (almaid, status, primary_key) for primary_key, (almaid, action, status)
+            in rows.items() if action == method
+        ])
+        monkeypatch.setattr("almapipo.db_read.log_success_rate", mock.MagicMock())
+        monkeypatch.setattr("almapipo.db_write.add_almaid_to_job_status_per_id", add_row)
+        monkeypatch.setattr("almapipo.db_write.set_job_status_for_rows", set_status)
+        monkeypatch.setattr("almapipo.db_write.update_job_status",
+                            lambda status, primary_key, *_: set_status(status, [primary_key]))
+        monkeypatch.setattr("almapipo.db_write.add_sent_record", mock.MagicMock())
+        almapipo.retry_transient_errors(
+            "1970-01-01 00:00:00+00:00", 'bibs', 'bibs', 'PUT', db_session, change_title
+        )
+        assert [status for _, action, status in rows.values() if action == "PUT"] == ["done"] \
+            and all(status == "done" for _, _, status in rows.values())
+
+
 class TestInstantiateApiClass:
     """
     Tests for almapipo.almapipo.instantiate_api_class
@@ -246,6 +666,49 @@ class TestInstantiateApiClass:
         with pytest.raises(NotImplementedError):
             almapipo.instantiate_api_class("123", "nonexistent", "bibs")
 
+    def test_instantiate_api_class_with_job_context(self):
+        job_context = config.JobContext(
+            api_key="SANDBOX", api_base_url="https://sandbox/almaws/v1"
+        )
+        current_api = almapipo.instantiate_api_class(
+            "9981093873901234,22447985240001234", "bibs", "holdings",
+            job_context
+        )
+        assert current_api.job_context.api_key == "SANDBOX" \
+            and setup_rest.resolve_context(current_api.job_context)[:2] \
+            == ("SANDBOX", "https://sandbox/almaws/v1")
+
+    def test_instantiate_api_class_shared_by_jobs(self):
+        job_context = config.JobContext(api_key="SANDBOX")
+        apis = [
+            almapipo.instantiate_api_class(
+                "9981093873901234,22447985240001234", "bibs", "holdings",
+                job_context.for_job()
+            )
+            for _ in range(2)
+        ]
+        assert apis[0] is apis[1] and apis[0].job_context.job_timestamp is None
+
+    def test_instantiate_api_class_shares_route(self):
+        first_item_api = almapipo.instantiate_api_class(
+            "9981093873901234,22447985240001234,23447985190001234", "bibs", "items"
+        )
+        second_item_api = almapipo.instantiate_api_class(
+            alma_ids.AlmaId("9981093873901234,22447985240001234,23447985190005678"),
+            "bibs", "items"
+        )
+        other_holding_api = almapipo.instantiate_api_class(
+            "9981093873901234,22447985240005678,23447985190001234", "bibs", "items"
+        )
+        assert first_item_api is second_item_api \
+            and first_item_api is not other_holding_api
+
+    def test_instantiate_api_class_post_with_parent_only(self):
+        current_api = almapipo.instantiate_api_class(
+            "9981093873901234", "bibs", "holdings"
+        )
+        assert current_api.base_path == "/bibs/9981093873901234/holdings/"
+
     class TestInstantiateApiClassAcq:
 
         def test_instantiate_api_class_acq_vendors(self):
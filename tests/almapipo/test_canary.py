@@ -0,0 +1,63 @@
+"""Tests for almapipo.canary"""
+
+from datetime import datetime, timezone
+
+import pytest
+
+from almapipo import canary, exceptions
+
+job_timestamp = datetime(2020, 2, 2, 20, 2, 2, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def job_status_rows(monkeypatch):
+    rows = {"GET": [], "PUT": []}
+    monkeypatch.setattr(
+        "almapipo.db_read.get_job_status_rows",
+        lambda action, *_: rows[action]
+    )
+    return rows
+
+
+class TestSplitIntoStages:
+
+    def test_stages_grow(self):
+        settings = canary.CanarySettings(sample_size=2, growth_factor=3,
+                                         random_seed=1)
+        stages = list(canary.split_into_stages(list(range(30)), settings))
+        assert [len(stage) for stage in stages] == [2, 6, 18, 4]
+
+    def test_all_items_once(self):
+        settings = canary.CanarySettings(sample_size=5, random_seed=1)
+        stages = canary.split_into_stages(list(range(100)), settings)
+        assert sorted(item for stage in stages for item in stage) \
+            == list(range(100))
+
+    def test_invalid_settings(self):
+        with pytest.raises(ValueError):
+            list(canary.split_into_stages([1], canary.CanarySettings(0)))
+
+
+class TestCheckStage:
+
+    def test_error_rate_exceeded(self, job_status_rows):
+        job_status_rows["GET"] = [("1", "done", 1), ("2", "error", 2)]
+        with pytest.raises(exceptions.CanaryException):
+            canary.check_stage(["1", "2"], "GET", job_timestamp, None,
+                               canary.CanarySettings())
+
+    def test_match_rate_too_low(self, job_status_rows, monkeypatch):
+        job_status_rows["GET"] = [("1", "done", 1), ("2", "done", 2)]
+        job_status_rows["PUT"] = [("1", "done", 3), ("2", "done", 4)]
+        monkeypatch.setattr(
+            "almapipo.db_read.get_mismatched_almaids", lambda *_: ["2"]
+        )
+        with pytest.raises(exceptions.CanaryException):
+            canary.check_stage(["1", "2"], "PUT", job_timestamp, None,
+                               canary.CanarySettings())
+
+    def test_stage_passes(self, job_status_rows):
+        job_status_rows["GET"] = [("1", "done", 1), ("2", "done", 2),
+                                  ("3", "error", 3)]
+        canary.check_stage(["1", "2"], "GET", job_timestamp, None,
+                           canary.CanarySettings())
@@ -0,0 +1,174 @@
+"""Tests for almapipo.cli"""
+
+from io import StringIO
+from unittest import mock
+
+import pytest
+
+from almapipo import cli, config, exceptions, planner
+
+job_context = config.JobContext(db_engine=mock.MagicMock())
+
+
+@pytest.fixture
+def list_caller(monkeypatch):
+    """call_api_for_list taking all almaids, returns the status counts."""
+    list_caller = mock.MagicMock()
+    list_caller.handled = []
+
+    def call_api_for_list(almaids, *args, **kwargs):
+        list_caller.handled.extend(almaids)
+        return {"error": 0}
+
+    list_caller.side_effect = call_api_for_list
+    monkeypatch.setattr("almapipo.almapipo.call_api_for_list", list_caller)
+    monkeypatch.setattr("almapipo.db_read.log_success_rate",
+                        lambda *_: {"error": 0})
+    return list_caller
+
+
+class TestCli:
+
+    def test_parser_alias_arguments(self):
+        args = cli.create_parser().parse_args(
+            ["delete", "bibs", "holdings", "hols.csv", "--workers", "3"]
+        )
+        assert args.method == "DELETE" and args.workers == 3 \
+            and str(args.input_file) == "hols.csv" and args.set_id is None
+
+    def test_parser_needs_one_input(self):
+        with pytest.raises(SystemExit) as system_exit:
+            cli.create_parser().parse_args(
+                ["get", "bibs", "holdings", "hols.csv", "--set-id", "1"]
+            )
+        assert system_exit.value.code == 2
+
+    def test_progress_line(self):
+        progress = cli.ProgressLine(200, stream=StringIO())
+        progress.done = 50
+        assert progress.format_line(10.0) == \
+            "50/200 records, 5.0/s, ETA 0:00:30"
+
+    def test_progress_line_without_total(self):
+        progress = cli.ProgressLine(None, stream=StringIO())
+        progress.done = 50
+        assert progress.format_line(10.0) == "50 records, 5.0/s"
+
+    def test_all_records_done(self, list_caller):
+        exit_code = cli.run_job(
+            ["1", "2", "3"], "GET", "bibs", "holdings", job_context,
+            cli.RunSettings(workers=2, batch_size=20)
+        )
+        assert exit_code == cli.EXIT_OK and list_caller.handled == ["1", "2", "3"] \
+            and list_caller.call_args.args[6] == {"fetch": 2, "send": 2} \
+            and list_caller.call_args.kwargs["queue_size"] == 20
+
+    def test_one_worker_is_sequential(self, list_caller):
+        cli.run_job(["1"], "GET", "bibs", "holdings", job_context,
+                    cli.RunSettings(workers=1))
+        assert list_caller.call_args.args[6] is None
+
+    def test_record_errors(self, list_caller):
+        list_caller.side_effect = lambda *args, **kwargs: {"error": 1}
+        exit_code = cli.run_job(
+            ["1"], "DELETE", "bibs", "holdings", job_context, cli.RunSettings()
+        )
+        assert exit_code == cli.EXIT_RECORD_ERRORS
+
+    def test_max_calls(self, list_caller):
+        exit_code = cli.run_job(
+            [str(number) for number in range(10)], "PUT", "bibs", "holdings",
+            job_context, cli.RunSettings(max_calls=10)
+        )
+        assert exit_code == cli.EXIT_ABORTED and len(list_caller.handled) == 5
+
+    def test_threshold_stops_job(self, list_caller):
+        list_caller.side_effect = exceptions.ThresholdException
+        exit_code = cli.run_job(
+            ["1", "2", "3"], "GET", "bibs", "holdings", job_context,
+            cli.RunSettings(workers=1)
+        )
+        assert exit_code == cli.EXIT_ABORTED
+
+    def test_progress_counts_records_handled(self, list_caller, monkeypatch):
+        progress_line = mock.MagicMock()
+        monkeypatch.setattr("almapipo.cli.ProgressLine", progress_line)
+
+        def call_api_for_list(almaids, *args, **kwargs):
+            for almaid in almaids:
+                kwargs["record_handled"](almaid)
+            return {}
+
+        list_caller.side_effect = call_api_for_list
+        cli.run_job(["1", "2"], "GET", "bibs", "holdings", job_context,
+                    cli.RunSettings(show_progress=True), total=2)
+        assert progress_line.call_args.args == (2,) \
+            and progress_line.return_value.advance.call_count == 2 \
+            and progress_line.return_value.finish.called
+
+    def test_skip_done_streams_almaids(self, list_caller, monkeypatch):
+        def skip_done_almaids(almaids, *_):
+            return (almaid for almaid in almaids if almaid != "2")
+
+        monkeypatch.setattr("almapipo.dedup.skip_done_almaids", skip_done_almaids)
+        cli.run_job(["1", "2", "3"], "GET", "bibs", "holdings", job_context,
+                    cli.RunSettings(skip_done_days=1))
+        assert not isinstance(list_caller.call_args.args[0], list) \
+            and list_caller.handled == ["1", "3"]
+
+    def test_input_file_is_streamed(self, list_caller, monkeypatch):
+        def read_csv_contents(csv_path):
+            for almaid in ["99,22", "99,23"]:
+                yield {"bibs,holdings": almaid}
+
+        monkeypatch.setattr("almapipo.input_read.read_csv_contents", read_csv_contents)
+        monkeypatch.setattr("almapipo.db_write.copy_csv_lines_to_source_csv",
+                            lambda csv_lines, *_: len(list(csv_lines)))
+        args = cli.create_parser().parse_args(["get", "bibs", "holdings", "hols.csv"])
+        cli._run_get_or_delete(args, job_context)
+        assert not isinstance(list_caller.call_args.args[0], list) \
+            and list_caller.handled == ["99,22", "99,23"]
+
+    @pytest.mark.parametrize("fits_threshold, expected_exit_code", [
+        (True, cli.EXIT_OK), (None, cli.EXIT_OK), (False, cli.EXIT_ABORTED)
+    ])
+    def test_plan_makes_no_calls(self, list_caller, monkeypatch, fits_threshold, expected_exit_code):
+        job_planner = mock.MagicMock(return_value=planner.JobPlan(
+            "DELETE", 2, 4, 3, fits_threshold, 8, None, None
+        ))
+        copier = mock.MagicMock()
+        monkeypatch.setattr("almapipo.planner.plan_job_for_list", job_planner)
+        monkeypatch.setattr("almapipo.db_write.copy_csv_lines_to_source_csv", copier)
+        monkeypatch.setattr("almapipo.input_read.read_csv_contents",
+                            lambda _: iter([{"bibs,holdings": "99,22"}]))
+        args = cli.create_parser().parse_args(
+            ["delete", "bibs", "holdings", "hols.csv", "--plan"]
+        )
+        exit_code = cli._run_get_or_delete(args, job_context)
+        assert exit_code == expected_exit_code and not list_caller.called \
+            and not copier.called and job_planner.call_args.args[1:2] == ("DELETE",)
+
+    def test_plan_set_without_members(self, list_caller, monkeypatch):
+        set_planner = mock.MagicMock(return_value=planner.JobPlan(
+            "DELETE", 250, 503, 1000, True, 8, None, None
+        ))
+        member_retriever = mock.MagicMock()
+        monkeypatch.setattr("almapipo.planner.plan_job_for_alma_set", set_planner)
+        monkeypatch.setattr("almapipo.rest_conf.retrieve_set_member_almaids",
+                            member_retriever)
+        args = cli.create_parser().parse_args(
+            ["delete", "bibs", "holdings", "--set-id", "123", "--plan"]
+        )
+        exit_code = cli._run_get_or_delete(args, job_context)
+        assert exit_code == cli.EXIT_OK and not member_retriever.called \
+            and not list_caller.called and set_planner.call_args.args[:2] == ("123", "DELETE")
+
+    def test_set_calls_count_against_max_calls(self, list_caller, monkeypatch):
+        monkeypatch.setattr("almapipo.rest_conf.retrieve_set_member_almaids",
+                            lambda *_, **__: iter(["1", "2", "3", "4"]))
+        exit_code = cli.run_set_job(
+            "123", "GET", "bibs", "holdings", job_context,
+            cli.RunSettings(max_calls=4)
+        )
+        # two calls to retrieve the members, two left for the records
+        assert exit_code == cli.EXIT_ABORTED and list_caller.handled == ["1", "2"]
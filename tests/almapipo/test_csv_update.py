@@ -0,0 +1,59 @@
+"""Tests for almapipo.csv_update"""
+
+from collections import OrderedDict
+
+import pytest
+
+from almapipo import csv_update
+
+item_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<item><item_data><description>v.1</description><public_note>old</public_note>
+<fulfillment_note>note</fulfillment_note></item_data></item>"""
+
+heading = "bibs,holdings,items"
+
+
+def csv_line(almaid, description="", public_note="", fulfillment_note=""):
+    return OrderedDict([
+        (heading, almaid),
+        ("item_data/description", description),
+        ("append:item_data/public_note", public_note),
+        ("remove:item_data/fulfillment_note", fulfillment_note),
+    ])
+
+
+class TestCsvUpdate:
+
+    def test_parse_column_heading(self):
+        assert csv_update.parse_column_heading("prepend:a/b") == ("prepend", "a/b") \
+            and csv_update.parse_column_heading("a/b", "append") == ("append", "a/b") \
+            and csv_update.parse_column_heading("x:a/b") == ("replace", "x:a/b")
+
+    def test_rows_are_merged(self):
+        updates = csv_update.group_updates_by_almaid([
+            csv_line("99,22,23", description="v.2"),
+            csv_line("99,22,24", public_note=" new"),
+            csv_line("99,22,23", fulfillment_note="x"),
+        ])
+        assert list(updates) == ["99,22,23", "99,22,24"] \
+            and [update.mode for update in updates["99,22,23"]] == ["replace", "remove"]
+
+    def test_apply_column_updates(self):
+        updates = csv_update.group_updates_by_almaid(
+            [csv_line("99,22,23", "v.2", " new", "x")]
+        )["99,22,23"]
+        manipulated_xml = csv_update.apply_column_updates(updates, "99,22,23", item_xml)
+        assert b"<description>v.2</description>" in manipulated_xml \
+            and b"<public_note>old new</public_note>" in manipulated_xml \
+            and b"fulfillment_note" not in manipulated_xml
+
+    def test_apply_updates_of_almaid(self):
+        updates_by_almaid = csv_update.group_updates_by_almaid(
+            [csv_line("99,22,23", description="v.2")]
+        )
+        assert b"<description>v.2</description>" in \
+            csv_update.apply_updates_of_almaid(updates_by_almaid, "99,22,23", item_xml)
+
+    def test_unknown_default_mode(self):
+        with pytest.raises(ValueError):
+            csv_update.group_updates_by_almaid([], "insert")
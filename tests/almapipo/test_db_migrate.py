@@ -0,0 +1,103 @@
+"""Tests for almapipo.db_migrate"""
+
+from unittest import mock
+
+from sqlalchemy import MetaData, Table
+from sqlalchemy.dialects import postgresql
+
+from almapipo import db_migrate, setup_db
+
+
+def executed_statements(connection: mock.MagicMock) -> list:
+    return [str(call.args[0]) for call in connection.execute.call_args_list]
+
+
+class TestDbMigrate:
+
+    def test_versions_increase(self):
+        versions = [migration.version for migration in db_migrate.MIGRATIONS]
+        assert versions == sorted(set(versions))
+
+    def test_index_built_concurrently(self):
+        connection = mock.MagicMock(dialect=postgresql.dialect())
+        connection.execute.return_value.scalar.return_value = None
+        index = next(iter(setup_db.FetchedRecords.__table__.indexes))
+        db_migrate.create_index(connection, index)
+        assert executed_statements(connection)[-1].startswith(
+            "CREATE INDEX CONCURRENTLY ix_fetched_records_almaid"
+        )
+
+    def test_valid_index_kept(self):
+        connection = mock.MagicMock(dialect=postgresql.dialect())
+        connection.execute.return_value.scalar.return_value = True
+        index = next(iter(setup_db.FetchedRecords.__table__.indexes))
+        db_migrate.create_index(connection, index)
+        assert connection.execute.call_count == 1
+
+    def test_invalid_index_rebuilt(self):
+        connection = mock.MagicMock(dialect=postgresql.dialect())
+        connection.execute.return_value.scalar.return_value = False
+        index = next(iter(setup_db.FetchedRecords.__table__.indexes))
+        db_migrate.create_index(connection, index)
+        assert executed_statements(connection)[1] \
+            == "DROP INDEX CONCURRENTLY ix_fetched_records_almaid"
+
+    def test_upgrade_applies_pending(self, monkeypatch):
+        applied_migration = mock.MagicMock()
+        pending_migration = mock.MagicMock()
+        monkeypatch.setattr(db_migrate, "MIGRATIONS", [
+            db_migrate.Migration(1, "applied", applied_migration),
+            db_migrate.Migration(2, "pending", pending_migration),
+        ])
+        db_engine = mock.MagicMock()
+        db_engine.connect.return_value.__enter__.return_value.execute \
+            .return_value.scalars.return_value = [1]
+        assert db_migrate.upgrade(db_engine) == [2] \
+            and not applied_migration.called and pending_migration.called
+
+    def test_lookup_indexes_without_content_hash(self, monkeypatch):
+        built = []
+        monkeypatch.setattr(db_migrate, "create_index",
+                            lambda _, index: built.append(index.name))
+        db_migrate._add_lookup_indexes(mock.MagicMock())
+        assert "ix_sent_records_job_almaid" in built \
+            and not any(name.endswith("_job_hash") for name in built)
+
+    def test_migrations_complete_baseline_schema(self, monkeypatch):
+        # Tables of the first release of almapipo
+        existing = {"job_status_per_id", "source_csv", "fetched_records",
+                    "sent_records", "put_post_responses"}
+
+        def create_table(table, bind=None, checkfirst=False):
+            existing.add(table.name)
+
+        def create_all(metadata, bind=None, tables=None, checkfirst=True):
+            existing.update(table.name for table in tables)
+
+        monkeypatch.setattr(Table, "create", create_table)
+        monkeypatch.setattr(MetaData, "create_all", create_all)
+        monkeypatch.setattr(db_migrate, "inspect", lambda _: mock.MagicMock(
+            get_columns=mock.MagicMock(return_value=[
+                {"name": "csv_line", "type": postgresql.JSON()}
+            ])
+        ))
+        db_engine = mock.MagicMock()
+        db_engine.connect.return_value.__enter__.return_value.execute \
+            .return_value.scalars.return_value = []
+
+        assert db_migrate.upgrade(db_engine) \
+            == [migration.version for migration in db_migrate.MIGRATIONS]
+        assert existing == set(setup_db.Base.metadata.tables)
+
+    def test_job_summary_counted_per_statement(self):
+        connection = mock.MagicMock()
+        db_migrate._count_job_statuses_per_statement(connection)
+        transaction_connection = connection.engine.connect.return_value \
+            .__enter__.return_value.execution_options.return_value
+        statements = executed_statements(transaction_connection)
+        created = [statement for statement in statements
+                   if statement.startswith("CREATE TRIGGER")]
+        assert "DROP TRIGGER IF EXISTS job_status_summary " \
+            "ON job_status_per_id" in statements \
+            and len(created) == 3 \
+            and all("FOR EACH STATEMENT" in statement for statement in created)
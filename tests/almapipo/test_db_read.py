@@ -0,0 +1,48 @@
+"""Tests for almapipo.db_read"""
+
+from unittest import mock
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.orm import Session
+
+from almapipo import db_read, setup_db
+
+
+class TestLogSuccessRate:
+
+    def test_counts_from_summary(self, monkeypatch):
+        status_counts = mock.MagicMock()
+        monkeypatch.setattr("almapipo.db_read.get_job_summary",
+                            lambda *_: {"GET": {"done": 3, "error": 1}})
+        monkeypatch.setattr("almapipo.db_read.get_status_counts", status_counts)
+        assert db_read.log_success_rate("GET", None, mock.MagicMock()) \
+            == {"done": 3, "error": 1} and not status_counts.called
+
+    def test_counts_without_summary(self, monkeypatch):
+        monkeypatch.setattr("almapipo.db_read.get_job_summary", lambda *_: {})
+        monkeypatch.setattr("almapipo.db_read.get_status_counts",
+                            lambda *_: {"GET": {"done": 3}})
+        assert db_read.log_success_rate("PUT", None, mock.MagicMock()) == {}
+
+    def test_counts_without_summary_table(self, monkeypatch):
+        def get_job_summary(*_):
+            raise ProgrammingError("SELECT", {}, Exception("no job_summary"))
+
+        monkeypatch.setattr("almapipo.db_read.get_job_summary",
+                            get_job_summary)
+        monkeypatch.setattr("almapipo.db_read.get_status_counts",
+                            lambda *_: {"GET": {"done": 3}})
+        db_session = mock.MagicMock()
+        assert db_read.log_success_rate("GET", None, db_session) \
+            == {"done": 3} and db_session.rollback.called
+
+
+class TestQueryRecordXml:
+
+    def test_blobs_joined(self):
+        query = db_read.query_record_xml(setup_db.FetchedRecords, Session())
+        sql = str(query.statement.compile(dialect=postgresql.dialect()))
+        assert "coalesce(fetched_records.alma_record, " \
+               "record_blobs.alma_record)" in sql \
+            and "LEFT OUTER JOIN record_blobs" in sql
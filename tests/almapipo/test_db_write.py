@@ -0,0 +1,80 @@
+"""Tests for almapipo.db_write"""
+
+from datetime import datetime
+from unittest import mock
+
+from sqlalchemy.dialects import postgresql
+
+from almapipo import db_write, xml_extract
+
+RECORD = "<bib><mms_id>991234</mms_id></bib>"
+
+job_timestamp = datetime(2026, 1, 1)
+
+
+class TestRecordBlobs:
+
+    def test_record_kept_in_row(self):
+        db_session = mock.MagicMock()
+        db_write.add_sent_record("991234", RECORD, job_timestamp, db_session)
+        row = db_session.add.call_args[0][0]
+        assert row.alma_record is not None \
+            and row.content_hash == xml_extract.hash_record(RECORD) \
+            and not db_session.execute.called
+
+    def test_record_moved_to_blob(self):
+        db_session = mock.MagicMock()
+        db_write.add_response_content_to_fetched_records(
+            "991234", RECORD, job_timestamp, db_session, True
+        )
+        row = db_session.add.call_args[0][0]
+        assert row.alma_record is None \
+            and row.content_hash == xml_extract.hash_record(RECORD)
+
+    def test_blob_stored_once(self):
+        db_session = mock.MagicMock()
+        db_write.add_record_blob("0" * 64, RECORD.encode(), db_session)
+        statement = db_session.execute.call_args[0][0]
+        sql = str(statement.compile(dialect=postgresql.dialect()))
+        assert "ON CONFLICT (content_hash) DO NOTHING" in sql
+
+
+class TestAddAlmaidsToJobStatusPerId:
+
+    def test_rows_returned_with_almaid(self):
+        db_session = mock.MagicMock()
+        db_session.execute.return_value = [("2", "GET", 8), ("1", "GET", 7)]
+        added_rows = db_write.add_almaids_to_job_status_per_id(
+            ["1", "2"], "GET", job_timestamp, db_session
+        )
+        assert added_rows == [("2", "GET", 8), ("1", "GET", 7)] \
+            and db_session.commit.called
+
+
+class TestCountApiCall:
+
+    def test_only_admitted_calls_counted(self):
+        db_engine = mock.MagicMock()
+        connection = db_engine.connect.return_value.__enter__.return_value
+        connection.execute.return_value.one_or_none.return_value = None
+        counted_call = db_write.count_api_call("alma", 25, db_engine)
+        statement = connection.execute.call_args[0][0]
+        sql = str(statement.compile(dialect=postgresql.dialect()))
+        assert counted_call is None \
+            and "WHERE api_call_counts.calls + %(calls_2)s <= %(param_1)s" in sql \
+            and connection.execute.call_count == 1
+
+
+class TestUseBudgetShare:
+
+    def test_share_of_new_day_keeps_priority(self):
+        db_engine = mock.MagicMock()
+        connection = db_engine.connect.return_value.__enter__.return_value \
+            .execution_options.return_value
+        # no daily budget and no share of the job for the new day yet
+        connection.execute.return_value.scalar.return_value = None
+        connection.execute.return_value.one_or_none.return_value = None
+        assert db_write.use_budget_share("alma", "update", 10, 2.0, db_engine)
+        statement = connection.execute.call_args_list[2][0][0]
+        values = statement.compile(dialect=postgresql.dialect()).params
+        assert values["priority"] == 10 and values["weight"] == 2.0
@@ -0,0 +1,60 @@
+"""Tests for almapipo.dedup"""
+
+from datetime import datetime, timezone
+from unittest import mock
+
+import pytest
+
+from almapipo import dedup
+
+done_since = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def done_almaids(monkeypatch):
+    """Almaids done as per job_status_per_id, the exact lookup as mock."""
+    done = {"990001", "990003"}
+    monkeypatch.setattr("almapipo.db_read.count_done_almaids",
+                        mock.MagicMock(return_value=len(done)))
+    monkeypatch.setattr("almapipo.db_read.get_done_almaids",
+                        mock.MagicMock(return_value=iter(done)))
+    get_done_almaids_among = mock.MagicMock(
+        side_effect=lambda almaids, *args: done.intersection(almaids)
+    )
+    monkeypatch.setattr("almapipo.db_read.get_done_almaids_among",
+                        get_done_almaids_among)
+    return get_done_almaids_among
+
+
+class TestBloomFilter:
+
+    def test_added_items_contained(self):
+        bloom_filter = dedup.BloomFilter(1000)
+        for number in range(1000):
+            bloom_filter.add(f"99{number}")
+        assert all(f"99{number}" in bloom_filter for number in range(1000))
+
+    def test_error_rate(self):
+        bloom_filter = dedup.BloomFilter(1000, 0.01)
+        for number in range(1000):
+            bloom_filter.add(f"99{number}")
+        false_positives = sum(f"22{number}" in bloom_filter
+                              for number in range(10000))
+        assert false_positives < 300
+
+
+class TestSkipDoneAlmaids:
+
+    def test_skips_done_and_repeated(self, done_almaids):
+        almaids = ["990001", "990002", "990002", "990003", "990004"]
+        assert list(dedup.skip_done_almaids(
+            almaids, "GET", done_since, mock.MagicMock()
+        )) == ["990002", "990004"]
+
+    def test_only_filter_hits_looked_up(self, done_almaids):
+        list(dedup.skip_done_almaids(
+            ["990001", "990002"], "GET", done_since, mock.MagicMock(),
+            batch_size=1
+        ))
+        looked_up = [call.args[0] for call in done_almaids.call_args_list]
+        assert looked_up == [["990001"]]
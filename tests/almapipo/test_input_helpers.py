@@ -2,6 +2,8 @@
 Tests for almapipo.input_helpers
 """
 
+import pickle
+from datetime import datetime, timezone
 from unittest import mock
 
 import pytest
@@ -39,9 +41,9 @@ def db_session(monkeypatch):
 
 @pytest.fixture
 def db_writer(monkeypatch):
-    writer = mock.MagicMock()
+    writer = mock.MagicMock(side_effect=lambda csv_lines, *_: len(csv_lines))
     monkeypatch.setattr("almapipo.db_write."
-                        "add_csv_line_to_source_csv_table", writer)
+                        "copy_csv_lines_to_source_csv", writer)
     return writer
 
 
@@ -86,10 +88,11 @@ class TestAddCsvToSourceCsvTable:
             db_writer,
             db_session
     ):
-        input_helpers.CsvHelper("/path/to/csv").add_to_source_csv_table(
+        assert input_helpers.CsvHelper(
+            "/path/to/csv"
+        ).add_to_source_csv_table(
             "1970-01-01 00:00:00+00:00", db_session
-        )
-        assert db_writer.call_count == 2
+        ) == 2
 
     def test_no_entries_added_to_db(
             self,
@@ -98,7 +101,66 @@ class TestAddCsvToSourceCsvTable:
             db_writer,
             db_session
     ):
-        input_helpers.CsvHelper("/path/to/tsv").add_to_source_csv_table(
+        assert input_helpers.CsvHelper(
+            "/path/to/tsv"
+        ).add_to_source_csv_table(
             "1970-01-01 00:00:00+00:00", db_session
+        ) == 0
+
+
+class TestCsvIndex:
+    """
+    Tests for almapipo.input_helpers.CsvIndex and MmapCsvIndex
+    """
+
+    def test_value_by_almaid(self, prevent_check_file_path, csv_with_contents):
+        csv_index = input_helpers.CsvHelper("/path/to/csv").create_index()
+        assert csv_index.get_value("9981093873911234", "Consortium-ID") \
+            == "XY0002" and "9981093873901234" in csv_index
+
+    def test_missing_almaid(self, prevent_check_file_path, csv_with_contents):
+        csv_index = input_helpers.CsvHelper("/path/to/csv").create_index()
+        assert csv_index.get_line("9900") is None
+        with pytest.raises(KeyError):
+            csv_index.get_value("9900", "Consortium-ID")
+
+    def test_mmap_value_by_almaid(self, tmp_path):
+        csv_path = tmp_path / "input.csv"
+        csv_path.write_text("MMS-ID;Title\n9981093873901234;A\n"
+                            "9981093873911234;\"B; C\"\n9981093873901234;D\n")
+        csv_index = input_helpers.MmapCsvIndex(str(csv_path))
+        assert len(csv_index) == 2 \
+            and csv_index.get_value("9981093873911234", "Title") == "B; C" \
+            and csv_index.get_value("9981093873901234", "Title") == "A"
+
+    def test_mmap_survives_pickling(self, tmp_path):
+        csv_path = tmp_path / "input.tsv"
+        csv_path.write_text("MMS-ID\tTitle\n9981093873901234\tA\n")
+        csv_index = pickle.loads(
+            pickle.dumps(input_helpers.MmapCsvIndex(str(csv_path)))
+        )
+        assert csv_index.get_line("9981093873901234") \
+            == {"MMS-ID": "9981093873901234", "Title": "A"}
+
+
+class TestImportCsvToSourceCsv:
+    """
+    Tests for almapipo.input_helpers.import_csv_to_source_csv
+    """
+
+    def test_lines_copied_in_chunks(self, tmp_path):
+        csv_path = tmp_path / "input.csv"
+        csv_path.write_text("MMS-ID;Note\n9981093873901234;C:\\temp\n"
+                            "9981093873911234;B\n")
+        copied = []
+        db_session = mock.MagicMock()
+        db_session.connection.return_value.connection.cursor.return_value \
+            .copy_expert.side_effect = lambda _, chunk: copied.append(chunk.read())
+        line_count = input_helpers.import_csv_to_source_csv(
+            str(csv_path), datetime(2020, 1, 1, tzinfo=timezone.utc),
+            db_session, chunk_size=1
+        )
+        assert line_count == 2 and len(copied) == 2 and copied[0] == (
+            '2020-01-01T00:00:00+00:00\t9981093873901234\t'
+            '{"MMS-ID": "9981093873901234", "Note": "C:\\\\\\\\temp"}\n'
         )
-        assert db_writer.call_count == 0
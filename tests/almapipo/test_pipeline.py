@@ -0,0 +1,80 @@
+"""Tests for almapipo.pipeline"""
+
+import pytest
+
+from almapipo import pipeline
+
+
+def double(number):
+    return number * 2
+
+
+def drop_odd(number):
+    if number % 2 == 0:
+        return number
+
+
+class TestPipeline:
+
+    def test_all_items_pass_all_stages(self):
+        results = []
+        stages = [
+            pipeline.Stage("double", double, workers=3, queue_size=2),
+            pipeline.Stage("collect", results.append),
+        ]
+        pipeline.Pipeline(stages).run(range(100))
+        assert sorted(results) == [number * 2 for number in range(100)]
+
+    def test_none_leaves_pipeline(self):
+        results = []
+        stages = [
+            pipeline.Stage("drop_odd", drop_odd, workers=2),
+            pipeline.Stage("collect", results.append),
+        ]
+        pipeline.Pipeline(stages).run(range(10))
+        assert sorted(results) == [0, 2, 4, 6, 8]
+
+    def test_batches(self):
+        batch_sizes = []
+
+        def count_batch(batch):
+            batch_sizes.append(len(batch))
+            return batch
+
+        stages = [pipeline.Stage("batch", count_batch, batch_size=5)]
+        pipeline.Pipeline(stages).run(range(23))
+        assert sum(batch_sizes) == 23 and max(batch_sizes) <= 5
+
+    def test_stats(self):
+        stages = [pipeline.Stage("double", double, workers=2)]
+        record_pipeline = pipeline.Pipeline(stages)
+        record_pipeline.run(range(10))
+        stats = record_pipeline.stats()["double"]
+        assert stats["processed"] == 10 and stats["queue_depth"] == 0
+
+    def test_error_is_raised_again(self):
+        def fail(number):
+            if number == 5:
+                raise ValueError
+            return number
+
+        stages = [
+            pipeline.Stage("fail", fail, workers=2),
+            pipeline.Stage("collect", lambda _: None),
+        ]
+        with pytest.raises(ValueError):
+            pipeline.Pipeline(stages).run(range(10))
+
+    def test_invalid_stage(self):
+        with pytest.raises(ValueError):
+            pipeline.Stage("invalid", double, workers=0)
+
+
+class TestProcessPool:
+
+    def test_map_in_process_pool(self):
+        with pipeline.create_process_pool(2) as process_pool:
+            results = pipeline.map_in_process_pool(
+                process_pool, 2, double, list(range(7))
+            )
+        assert results == [number * 2 for number in range(7)]
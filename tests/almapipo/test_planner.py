@@ -0,0 +1,53 @@
+"""Tests for almapipo.planner"""
+
+from unittest import mock
+
+import pytest
+from sqlalchemy.orm import Session
+
+from almapipo import planner
+
+
+@pytest.fixture()
+def db_session(monkeypatch):
+    db_session = mock.Mock(spec_set=Session)
+    return db_session
+
+
+@pytest.fixture
+def calls_remaining(monkeypatch):
+    monkeypatch.setattr("almapipo.setup_rest.test_calls_remaining_today",
+                        lambda job_context: "10")
+
+
+@pytest.fixture
+def previous_jobs(monkeypatch):
+    monkeypatch.setattr("almapipo.db_read.get_seconds_per_record", lambda *_: 0.5)
+
+
+@pytest.fixture
+def no_previous_jobs(monkeypatch):
+    monkeypatch.setattr("almapipo.db_read.get_seconds_per_record", lambda *_: None)
+
+
+class TestPlanJobForList:
+
+    def test_put_needs_two_calls_per_record(self, db_session, calls_remaining, previous_jobs):
+        job_plan = planner.plan_job_for_list(["1", "2", "3"], "PUT", db_session)
+        assert job_plan.api_calls == 6 and job_plan.fits_threshold
+
+    def test_exceeds_threshold(self, db_session, calls_remaining, previous_jobs):
+        job_plan = planner.plan_job_for_list(iter(range(6)), "DELETE", db_session)
+        assert job_plan.api_calls == 12 and not job_plan.fits_threshold
+
+    def test_duration_by_workers(self, db_session, previous_jobs):
+        job_plan = planner.plan_job_for_list(range(100), "GET", db_session, 5, False)
+        assert job_plan.estimated_seconds == 10 and job_plan.calls_remaining is None
+
+    def test_no_previous_jobs(self, db_session, no_previous_jobs):
+        job_plan = planner.plan_job_for_list(range(100), "GET", db_session, 5, False)
+        assert job_plan.estimated_seconds is None
+
+    def test_unknown_method(self, db_session):
+        with pytest.raises(ValueError):
+            planner.plan_job_for_list([], "PATCH", db_session)
@@ -0,0 +1,50 @@
+"""Tests for almapipo.rollback"""
+
+from datetime import datetime, timezone
+from unittest import mock
+from xml.etree.ElementTree import fromstring
+
+from almapipo import config, rollback
+
+job_timestamp = datetime(2020, 2, 2, 20, 2, 2, tzinfo=timezone.utc)
+job_context = config.JobContext(db_engine=mock.MagicMock())
+backup = fromstring("<item><item_data><description>v.1</description>"
+                    "</item_data></item>")
+
+
+class TestRollback:
+
+    def test_put_sends_backup(self, monkeypatch):
+        monkeypatch.setattr("almapipo.db_read.get_fetched_xml_of_job",
+                            mock.MagicMock(return_value=backup))
+        backup_reader = rollback.BackupReader(job_timestamp, job_context)
+        assert b"<description>v.1</description>" \
+            in backup_reader.restore_record("99,22,23", "<item/>")
+
+    def test_delete_is_posted(self, monkeypatch):
+        monkeypatch.setattr("almapipo.db_read.get_fetched_xml_of_job",
+                            mock.MagicMock(return_value=backup))
+        backup_reader = rollback.BackupReader(job_timestamp, job_context)
+        records = list(backup_reader.get_records_to_post(["99,22,23"]))
+        assert [almaid for almaid, _ in records] == ["99,22,23"] \
+            and b"v.1" in records[0][1]
+
+    def test_missing_backup_is_error(self, monkeypatch):
+        status_writer = mock.MagicMock()
+        monkeypatch.setattr("almapipo.db_read.get_fetched_xml_of_job",
+                            lambda almaid, *_: None if almaid == "99,22,24" else backup)
+        monkeypatch.setattr("almapipo.db_write.add_almaids_to_job_status_per_id",
+                            mock.MagicMock(return_value=[("99,22,24", "POST", 1)]))
+        monkeypatch.setattr("almapipo.db_write.set_job_status_for_rows", status_writer)
+        backup_reader = rollback.BackupReader(job_timestamp, job_context)
+        records = list(backup_reader.get_records_to_post(["99,22,23", "99,22,24"]))
+        assert [almaid for almaid, _ in records] == ["99,22,23"] \
+            and status_writer.call_args.args[:2] == ("error", [1])
+
+    def test_almaids_by_method(self, monkeypatch):
+        def ids_by_status(status, method, timestamp, db_session):
+            return [("99,22",)] if method == "DELETE" else []
+        monkeypatch.setattr("almapipo.db_read.get_list_of_ids_by_status_and_method",
+                            ids_by_status)
+        assert rollback.get_almaids_to_roll_back(job_timestamp, mock.MagicMock()) \
+            == {"DELETE": ["99,22"]}
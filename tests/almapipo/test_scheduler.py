@@ -0,0 +1,61 @@
+"""Tests for almapipo.scheduler"""
+
+from unittest import mock
+
+import pytest
+
+from almapipo import exceptions, scheduler
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    """Budget tables replaced by mocks, calls allowed by default."""
+    monkeypatch.setattr("almapipo.db_write.add_budget_share", mock.MagicMock())
+    monkeypatch.setattr("almapipo.db_write.count_api_call",
+                        mock.MagicMock(return_value=(0, 1)))
+    monkeypatch.setattr("almapipo.db_read.get_active_budget_shares",
+                        mock.MagicMock(return_value=[]))
+    use_budget_share = mock.MagicMock(return_value=True)
+    monkeypatch.setattr("almapipo.db_write.use_budget_share", use_budget_share)
+    return use_budget_share
+
+
+class TestScheduler:
+
+    def test_share_by_weight(self):
+        active_shares = [("harvest", 0, 1.0), ("update", 0, 3.0)]
+        assert scheduler.calculate_fair_share("update", 0, 3.0, active_shares, 20) == 15 \
+            and scheduler.calculate_fair_share("harvest", 0, 1.0, active_shares, 20) == 5
+
+    def test_lower_priority_waits(self):
+        active_shares = [("harvest", 0, 1.0), ("update", 10, 1.0)]
+        assert scheduler.calculate_fair_share("harvest", 0, 1.0, active_shares, 20) == 0 \
+            and scheduler.calculate_fair_share("update", 10, 1.0, active_shares, 20) == 20
+
+    def test_at_least_one_call(self):
+        active_shares = [("harvest", 0, 100.0)]
+        assert scheduler.calculate_fair_share("update", 0, 1.0, active_shares, 20) == 1
+
+    def test_acquire_counts_budget(self, budget):
+        limiter = scheduler.FairShareLimiter(20, mock.MagicMock(), "update")
+        limiter.acquire()
+        assert budget.call_args.args[:4] == ("alma", "update", 0, 1.0)
+
+    def test_budget_used_up(self, budget):
+        budget.return_value = False
+        limiter = scheduler.FairShareLimiter(20, mock.MagicMock(), "update")
+        with pytest.raises(exceptions.ThresholdException):
+            limiter.acquire()
+
+    def test_acquire_waits_for_shared_limit(self, budget, monkeypatch):
+        # the job's share allows the call, the limit of all jobs only after
+        # the next second
+        count_api_call = mock.MagicMock(
+            side_effect=[(0, 1), None, (0, 1), (0, 1)]
+        )
+        monkeypatch.setattr("almapipo.db_write.count_api_call", count_api_call)
+        monkeypatch.setattr("almapipo.scheduler.sleep", mock.MagicMock())
+        limiter = scheduler.FairShareLimiter(20, mock.MagicMock(), "update")
+        limiter.acquire()
+        assert [call.args[:2] for call in count_api_call.call_args_list] \
+            == [("alma/update", 20), ("alma", 20)] * 2
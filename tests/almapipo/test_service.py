@@ -0,0 +1,86 @@
+"""Tests for almapipo.service"""
+
+from unittest import mock
+
+import pytest
+
+from almapipo import service
+
+hol_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<holding><record><leader>abc</leader></record></holding>"""
+
+
+@pytest.fixture
+def list_caller(monkeypatch):
+    caller = mock.MagicMock()
+    caller.handled = []
+
+    def call_api_for_list(almaids, *args, record_handled=None, **kwargs):
+        for almaid in almaids:
+            caller.handled.append(almaid)
+            record_handled(almaid)
+        return {}
+
+    caller.side_effect = call_api_for_list
+    monkeypatch.setattr("almapipo.almapipo.call_api_for_list", caller)
+    monkeypatch.setattr("almapipo.db_read.log_success_rate", mock.MagicMock())
+    return caller
+
+
+@pytest.fixture
+def db_sessionmaker():
+    return mock.MagicMock(kw={"bind": mock.MagicMock()})
+
+
+class TestJobService:
+
+    def test_job_with_almaids(self, list_caller, db_sessionmaker):
+        job_service = service.JobService(db_sessionmaker, workers=2)
+        almaids = ["9981093873901234", "9981093873911234", "9981093873921234"]
+        service_job = job_service.submit({
+            "action": "GET", "api": "bibs", "record_type": "holdings",
+            "almaids": almaids
+        })
+        job_service.shutdown()
+
+        progress = service_job.progress()
+        assert list_caller.handled == almaids \
+            and list_caller.call_args.args[6] == {"fetch": 2, "send": 2} \
+            and progress["state"] == "done" \
+            and progress["processed"] == progress["total"] == 3
+
+    def test_jobs_get_own_timestamps(self, list_caller, db_sessionmaker):
+        job_service = service.JobService(db_sessionmaker)
+        description = {"action": "GET", "api": "bibs",
+                       "record_type": "holdings", "almaids": []}
+        first_job = job_service.submit(description)
+        second_job = job_service.submit(description)
+        job_service.shutdown()
+        assert first_job.job_timestamp < second_job.job_timestamp
+
+    def test_finished_jobs_are_dropped(self, list_caller, db_sessionmaker):
+        job_service = service.JobService(db_sessionmaker, keep_finished_seconds=0)
+        description = {"action": "GET", "api": "bibs",
+                       "record_type": "holdings", "almaids": []}
+        first_job = job_service.submit(description)
+        job_service.shutdown()
+        assert first_job.state == "done" \
+            and job_service.get_job(first_job.job_id) is None \
+            and job_service.get_jobs() == []
+
+    def test_invalid_description(self, list_caller, db_sessionmaker):
+        job_service = service.JobService(db_sessionmaker)
+        with pytest.raises(ValueError):
+            job_service.submit({"action": "PUT", "api": "bibs",
+                                "record_type": "holdings",
+                                "almaids": ["9981093873901234"]})
+        job_service.shutdown()
+
+
+def test_update_element_text():
+    manipulate_xml = service._create_manipulation({
+        "action": "PUT", "xpath": "record/leader", "text": "def",
+        "mode": "append"
+    })
+    manipulated_xml = manipulate_xml("9981093873901234", hol_xml)
+    assert b"<leader>abcdef</leader>" in manipulated_xml
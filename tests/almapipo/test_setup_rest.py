@@ -0,0 +1,32 @@
+"""Tests for almapipo.setup_rest"""
+
+from almapipo import setup_rest
+
+error_response = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<web_service_result xmlns="http://com/exlibris/urm/general/xmlbeans">
+<errorsExist>true</errorsExist><errorList><error>
+<errorCode>402203</errorCode><errorMessage>Input parameters mmsId 123 is not valid.</errorMessage>
+<trackingId>E01-0101</trackingId></error></errorList></web_service_result>"""
+
+
+class TestParseApiError:
+
+    def test_error_list(self):
+        assert setup_rest.parse_api_error(400, error_response) == setup_rest.ApiError(
+            400, "402203", "Input parameters mmsId 123 is not valid.", False
+        )
+
+    def test_server_error_is_transient(self):
+        api_error = setup_rest.parse_api_error(503, "Service Unavailable")
+        assert api_error.transient and api_error.error_code is None
+
+    def test_threshold_is_transient(self):
+        api_error = setup_rest.parse_api_error(
+            400, '{"errorList": {"error": [{"errorCode": "DAILY_THRESHOLD"}]}}'
+        )
+        assert api_error.transient and api_error.error_code == "DAILY_THRESHOLD"
+
+    def test_pop_last_error(self):
+        setup_rest._thread_errors.last_error = setup_rest.ApiError(500, None, None, True)
+        assert setup_rest.pop_last_error().http_status == 500 \
+            and setup_rest.pop_last_error() is None
@@ -0,0 +1,37 @@
+"""Tests for almapipo.status_writer"""
+
+from unittest import mock
+
+import pytest
+
+from almapipo import status_writer
+
+
+@pytest.fixture
+def batch_writer(monkeypatch):
+    writer = mock.MagicMock()
+    monkeypatch.setattr("almapipo.db_write.update_job_statuses", writer)
+    return writer
+
+
+class TestStatusWriter:
+
+    def test_written_by_size(self, batch_writer):
+        statuses = status_writer.StatusWriter(mock.MagicMock(), max_rows=2)
+        statuses.update_job_status("done", 1)
+        assert batch_writer.call_count == 0
+        statuses.update_job_status("error", 2)
+        assert batch_writer.call_args.args[0] == [(1, "done"), (2, "error")]
+
+    def test_last_status_counts(self, batch_writer):
+        with status_writer.StatusWriter(mock.MagicMock()) as statuses:
+            statuses.update_job_status("new", 1)
+            statuses.update_job_status("done", 1)
+        assert batch_writer.call_args.args[0] == [(1, "done")]
+
+    def test_written_on_exception(self, batch_writer):
+        with pytest.raises(RuntimeError):
+            with status_writer.StatusWriter(mock.MagicMock()) as statuses:
+                statuses.update_job_status("done", 1)
+                raise RuntimeError
+        assert batch_writer.call_count == 1
@@ -0,0 +1,77 @@
+"""Tests for almapipo.worker"""
+
+from unittest import mock
+
+import pytest
+from sqlalchemy.orm import Session
+
+from almapipo import worker
+
+
+@pytest.fixture()
+def db_session(monkeypatch):
+    db_session = mock.Mock(spec_set=Session)
+    return db_session
+
+
+@pytest.fixture
+def claimed_batches(monkeypatch):
+    batches = [
+        [(1, "9981093873901234"), (2, "9981093873911234")],
+        [(3, "9981093873921234")],
+        [],
+    ]
+    claimer = mock.MagicMock(side_effect=batches)
+    monkeypatch.setattr("almapipo.db_write.claim_job_status_rows", claimer)
+    return claimer
+
+
+@pytest.fixture
+def releaser(monkeypatch):
+    releaser = mock.MagicMock()
+    monkeypatch.setattr("almapipo.db_write.release_job_status_rows", releaser)
+    return releaser
+
+
+@pytest.fixture
+def record_caller(monkeypatch):
+    caller = mock.MagicMock()
+    monkeypatch.setattr("almapipo.almapipo.call_api_for_record", caller)
+    monkeypatch.setattr("almapipo.db_read.log_success_rate", mock.MagicMock())
+    return caller
+
+
+@pytest.fixture
+def metrics_writer(monkeypatch):
+    metrics_writer = mock.MagicMock()
+    monkeypatch.setattr("almapipo.db_write.add_job_metrics", metrics_writer)
+    return metrics_writer
+
+
+class TestRunWorker:
+
+    def test_all_claimed_rows_are_handled(self, db_session, claimed_batches, releaser, record_caller,
+                                          metrics_writer):
+        number_of_almaids = worker.run_worker(
+            "1970-01-01 00:00:00+00:00", "bibs", "holdings", "DELETE", db_session
+        )
+        primary_keys = [call.kwargs["primary_keys"] for call in record_caller.call_args_list]
+        assert number_of_almaids == 3 \
+               and primary_keys == [{"DELETE": 1}, {"DELETE": 2}, {"DELETE": 3}] \
+               and releaser.call_count == 2 \
+               and metrics_writer.call_args.args[:3] == ("DELETE", 3, 1)
+
+
+class TestSeedJob:
+
+    def test_rows_added_in_batches(self, db_session, monkeypatch):
+        bulk_status_writer = mock.MagicMock(
+            side_effect=lambda almaids, action, *_: [(almaid, action, 1) for almaid in almaids]
+        )
+        monkeypatch.setattr("almapipo.db_write.add_almaids_to_job_status_per_id", bulk_status_writer)
+        number_of_rows = worker.seed_job(
+            (str(number) for number in range(5)), "DELETE",
+            "1970-01-01 00:00:00+00:00", db_session, batch_size=2
+        )
+        assert number_of_rows == 5 \
+               and [len(call.args[0]) for call in bulk_status_writer.call_args_list] == [2, 2, 1]
@@ -0,0 +1,86 @@
+"""Tests for almapipo.workflow"""
+
+from unittest import mock
+
+import pytest
+
+from almapipo import config, exceptions, workflow
+
+
+@pytest.fixture
+def job_context():
+    return config.JobContext(db_engine=mock.MagicMock())
+
+
+@pytest.fixture
+def metrics_writer(monkeypatch):
+    metrics_writer = mock.MagicMock()
+    monkeypatch.setattr("almapipo.db_write.add_job_metrics", metrics_writer)
+    return metrics_writer
+
+
+@pytest.fixture
+def record_caller(monkeypatch, metrics_writer):
+    calls = []
+
+    def call_api_for_record(almaid, api, record_type, method, db_session,
+                            manipulate_xml, job_context, record_done):
+        calls.append((record_type, method, almaid))
+        if not almaid.endswith("error"):
+            record_done(almaid, f"<bib><holding>{almaid}1</holding></bib>")
+
+    monkeypatch.setattr("almapipo.almapipo.call_api_for_record", call_api_for_record)
+    monkeypatch.setattr("almapipo.db_write.add_job_lineage", mock.MagicMock())
+    monkeypatch.setattr("almapipo.db_read.log_success_rate", mock.MagicMock())
+    return calls
+
+
+def derive_holdings(almaid, record_data):
+    return [f"{almaid},{almaid}1"]
+
+
+class TestRunWorkflow:
+
+    def test_almaids_are_handed_on(self, job_context, record_caller, metrics_writer):
+        steps = [
+            workflow.WorkflowStep("get_bibs", "bibs", "bibs", "GET",
+                                  derive_almaids=derive_holdings, workers=2),
+            workflow.WorkflowStep("delete_hols", "bibs", "holdings",
+                                  "DELETE", "get_bibs", workers=2),
+            workflow.WorkflowStep("verify", "bibs", "holdings", "GET",
+                                  "delete_hols"),
+        ]
+        job_timestamps = workflow.run_workflow(
+            steps, ["99", "98", "97error", "99"], job_context
+        )
+        assert sorted(record_caller) == [
+            ("bibs", "GET", "97error"),
+            ("bibs", "GET", "98"),
+            ("bibs", "GET", "99"),
+            ("holdings", "DELETE", "98,981"),
+            ("holdings", "DELETE", "99,991"),
+            ("holdings", "GET", "98,981"),
+            ("holdings", "GET", "99,991"),
+        ] and len(set(job_timestamps.values())) == 3 \
+            and sorted(call.args[:3] for call in metrics_writer.call_args_list) \
+            == [("DELETE", 2, 2), ("GET", 2, 1), ("GET", 3, 2)]
+
+    def test_error_is_raised_again(self, job_context, monkeypatch, metrics_writer):
+        monkeypatch.setattr(
+            "almapipo.almapipo.call_api_for_record",
+            mock.MagicMock(side_effect=exceptions.ThresholdException)
+        )
+        monkeypatch.setattr("almapipo.db_write.add_job_lineage", mock.MagicMock())
+        monkeypatch.setattr("almapipo.db_read.log_success_rate", mock.MagicMock())
+        steps = [workflow.WorkflowStep("get_bibs", "bibs", "bibs", "GET")]
+        with pytest.raises(exceptions.ThresholdException):
+            workflow.run_workflow(steps, ["99"], job_context)
+
+    def test_cyclic_steps(self, job_context):
+        steps = [
+            workflow.WorkflowStep("first", "bibs", "bibs", "GET"),
+            workflow.WorkflowStep("a", "bibs", "bibs", "GET", "b"),
+            workflow.WorkflowStep("b", "bibs", "bibs", "GET", "a"),
+        ]
+        with pytest.raises(ValueError):
+            workflow.run_workflow(steps, [], job_context)
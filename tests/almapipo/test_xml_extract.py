@@ -0,0 +1,15 @@
+"""Tests for almapipo.xml_extract"""
+
+from almapipo import xml_extract
+
+
+class TestHashRecord:
+
+    def test_same_hash_regardless_of_serialization(self):
+        assert xml_extract.hash_record(
+            b'<?xml version="1.0"?><bib b="2" a="1"><title/></bib>'
+        ) == xml_extract.hash_record('<bib a="1" b="2"><title></title></bib>')
+
+    def test_different_content(self):
+        assert xml_extract.hash_record("<bib><title>A</title></bib>") \
+            != xml_extract.hash_record("<bib><title>B</title></bib>")